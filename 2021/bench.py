@@ -0,0 +1,195 @@
+"""
+Throughput benchmark for mySender/myReceiver.
+
+Generates base64 text inputs the way the assignment does
+(base64 /dev/urandom | head -c N | tr -d '\\n'), runs receiver.py and sender.py
+as subprocesses over loopback for every size and seed, checks the output byte
+for byte and records goodput, wall time, retransmission ratio and per-side CPU
+time and peak RSS. Results are written as JSON so protocol versions can be
+compared run to run.
+
+Usage: python bench.py [--sizes 1,10,25,100] [--seeds 1,2,3] [--output bench_results.json]
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MB = 1000 * 1000
+# line length of base64(1) output
+BASE64_LINE = 76
+
+
+def generate_input(path, size, seed):
+    """
+    Write base64 text of random bytes, as head -c size of base64's wrapped output with newlines removed
+    :param path: output file
+    :param size: bytes taken from the wrapped base64 stream
+    :param seed: seed for the random bytes
+    :return: number of bytes written
+    """
+    rng = random.Random(seed)
+    chunk_lines = 1024
+    raw_per_chunk = BASE64_LINE * 3 // 4 * chunk_lines
+    remaining = size
+    written = 0
+    with open(path, "wb") as f:
+        while remaining > 0:
+            text = base64.b64encode(("%0*x" % (2 * raw_per_chunk, rng.getrandbits(8 * raw_per_chunk))).decode("hex"))
+            # every line of base64(1) output costs one extra byte for its newline
+            wrapped = min(remaining, len(text) + len(text) // BASE64_LINE)
+            kept = wrapped - wrapped // (BASE64_LINE + 1)
+            f.write(text[:kept])
+            written += kept
+            remaining -= wrapped
+    return written
+
+
+def wait_all(processes, timeout):
+    """
+    Wait for processes and collect their resource usage
+    :param processes: dict of name -> (Popen, start time)
+    :param timeout: seconds before the remaining processes are killed
+    :return: dict of name -> result dict
+    """
+    results = {}
+    pids = dict((p.pid, name) for name, (p, _) in processes.items())
+    deadline = time.time() + timeout
+    while pids:
+        pid, status, usage = os.wait4(-1, os.WNOHANG)
+        if pid == 0:
+            if time.time() > deadline:
+                for pid in pids:
+                    os.kill(pid, 9)
+                deadline = float("inf")
+            time.sleep(0.005)
+            continue
+        name = pids.pop(pid, None)
+        if name is None:
+            continue
+        results[name] = {
+            "exit_status": os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status),
+            "wall_time": time.time() - processes[name][1],
+            "cpu_user": usage.ru_utime,
+            "cpu_system": usage.ru_stime,
+            # ru_maxrss is reported in kilobytes on Linux
+            "peak_rss_kb": usage.ru_maxrss,
+        }
+    return results
+
+
+def run_once(workdir, input_path, seed, python, sender_args, timeout, stripes=1, scenario=None):
+    output_path = os.path.join(workdir, "output.txt")
+    sender_stats = os.path.join(workdir, "sender_stats.json")
+    receiver_stats = os.path.join(workdir, "receiver_stats.json")
+    for path in (sender_stats, receiver_stats):
+        if os.path.exists(path):
+            os.remove(path)
+
+    # both directions of the channel follow the same profile
+    channel_args = ["--scenario", scenario] if scenario else []
+    with open(output_path, "wb") as out:
+        receiver = subprocess.Popen([python, os.path.join(HERE, "receiver.py"), "--seed", str(2 * seed + 1),
+                                     "--fast-channel", "--stats", receiver_stats, "--stripes", str(stripes)] + channel_args,
+                                    stdout=out, cwd=workdir)
+    processes = {"receiver": (receiver, time.time())}
+    # give the receiver time to bind its socket
+    time.sleep(0.3)
+    with open(input_path, "rb") as inp:
+        start = time.time()
+        sender = subprocess.Popen([python, os.path.join(HERE, "sender.py"), "--seed", str(2 * seed),
+                                   "--fast-channel", "--stats", sender_stats, "--stripes", str(stripes)] + channel_args
+                                  + sender_args,
+                                  stdin=inp, cwd=workdir)
+    processes["sender"] = (sender, start)
+    sides = wait_all(processes, timeout)
+    wall = sides["sender"]["wall_time"]
+
+    for name, path in (("sender", sender_stats), ("receiver", receiver_stats)):
+        if os.path.exists(path):
+            with open(path) as f:
+                sides[name]["stats"] = json.load(f)
+
+    size = os.path.getsize(input_path)
+    ok = sides["sender"]["exit_status"] == 0 and files_equal(input_path, output_path)
+    sent = sides["sender"].get("stats", {}).get("packets_sent", 0)
+    retransmitted = sides["sender"].get("stats", {}).get("packets_retransmitted", 0)
+    return {
+        "seed": seed,
+        "bytes": size,
+        "ok": ok,
+        "wall_time": wall,
+        "goodput_mbps": size * 8 / wall / 1e6 if ok else 0.0,
+        "retransmission_ratio": float(retransmitted) / sent if sent else None,
+        "sender": sides["sender"],
+        "receiver": sides["receiver"],
+    }
+
+
+def files_equal(a, b, block=1 << 20):
+    if os.path.getsize(a) != os.path.getsize(b):
+        return False
+    with open(a, "rb") as fa, open(b, "rb") as fb:
+        while True:
+            da = fa.read(block)
+            if da != fb.read(block):
+                return False
+            if not da:
+                return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="1,10,25,100", help="comma separated input sizes in MB")
+    parser.add_argument("--seeds", default="1,2,3", help="comma separated channel seeds")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--python", default=sys.executable, help="interpreter for sender.py and receiver.py")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before a run is killed")
+    parser.add_argument("--stripes", type=int, default=1, help="parallel processes on each side")
+    parser.add_argument("--label", default="", help="protocol version label stored with the results")
+    parser.add_argument("--scenario", default=None, help="channel profile for both sides, see scenario.py")
+    parser.add_argument("sender_args", nargs=argparse.REMAINDER, help="extra arguments for sender.py, after --")
+    args = parser.parse_args()
+    sender_args = [a for a in args.sender_args if a != "--"]
+
+    # the sides run in the work directory, so profile files need an absolute path
+    scenario = args.scenario
+    if scenario is not None and os.path.exists(scenario):
+        scenario = os.path.abspath(scenario)
+
+    workdir = tempfile.mkdtemp(prefix="ece303-bench-")
+    runs = []
+    try:
+        for size_mb in [float(s) for s in args.sizes.split(",")]:
+            input_path = os.path.join(workdir, "input_{}MB.txt".format(size_mb))
+            generate_input(input_path, int(size_mb * MB), seed=int(size_mb * MB))
+            for seed in [int(s) for s in args.seeds.split(",")]:
+                result = run_once(workdir, input_path, seed, args.python, sender_args, args.timeout, args.stripes,
+                                  scenario)
+                result["size_mb"] = size_mb
+                runs.append(result)
+                print("{:>6} MB seed {:<4} {:<4} {:7.2f} s {:8.2f} Mbit/s  retransmitted {}".format(
+                    size_mb, seed, "ok" if result["ok"] else "FAIL", result["wall_time"], result["goodput_mbps"],
+                    "{:.1%}".format(result["retransmission_ratio"]) if result["retransmission_ratio"] is not None
+                    else "n/a"))
+            os.remove(input_path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump({"label": args.label, "sender_args": sender_args, "stripes": args.stripes, "scenario": args.scenario,
+                   "time": time.time(), "runs": runs}, f, indent=2,
+                  sort_keys=True)
+    return 0 if all(r["ok"] for r in runs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,31 @@
 # Written by S. Mevawala, modified by D. Gitzel
 
+import errno
+import heapq
 import logging
+import os
+import random
+import select
 import socket
+import time
+from binascii import hexlify, unhexlify
 from collections import deque
-from random import randint, choice, uniform
 from copy import deepcopy
 
+import scenario as scenarios
 import utils
+from scenario import DROP, ERROR, SWAP, SWAP_NEWEST
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # region Helper Functions
 
 
-def random_bytes(n):
-    return bytearray([randint(0, 255) for i in xrange(n)])
+def random_bytes(n, rng=random):
+    return bytearray([rng.randint(0, 255) for i in xrange(n)])
 
 
 def slice_frames(data_bytes):
@@ -44,21 +57,51 @@ class ChannelSimulator(object):
     PROTOCOL_VERSION = 5
     BUFFER_SIZE = 1024
     CORRUPTERS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 255)
+    # fast engine: random bytes below 250 map uniformly onto the 10 corrupters, the rest are rejected
+    CORRUPTER_TABLE = "".join(map(chr, (CORRUPTERS * (256 // len(CORRUPTERS) + 1))[:256]))
+    REJECTED_BYTES = "".join(map(chr, xrange(256 - 256 % len(CORRUPTERS), 256)))
     # endregion Constants
 
-    def __init__(self, inbound_port, outbound_port, debug_level=logging.INFO, ip_addr="127.0.0.1"):
+    def __init__(self, inbound_port, outbound_port, debug_level=logging.INFO, ip_addr="127.0.0.1", fast=False,
+                 seed=None, scenario=None, replay=None, record=None):
         """
         Create a ChannelSimulator
         :param inbound_port: port number for inbound connections
         :param outbound_port: port number of outbound connections
         :param debug_level: debug level for logging (e.g. logging.DEBUG)
         :param ip_addr: destination IP
+        :param fast: corrupt frames with batched operations instead of per-byte Python loops; the error statistics
+            are the same
+        :param seed: seed for a private random generator, making the channel's errors reproducible
+        :param scenario: settings of the outgoing direction from scenario.direction, None for corrupt's defaults
+        :param replay: with scenario, path of frame fates saved by an earlier run to impose instead of drawing them
+        :param record: with scenario, path save_record writes the fate of every frame sent to
         """
 
         self.ip = ip_addr
         self.sndr_socket = None
         self.rcvr_socket = None
-        self.swap_queue = deque([random_bytes(ChannelSimulator.BUFFER_SIZE), random_bytes(ChannelSimulator.BUFFER_SIZE)])
+        self.fast = fast
+        self.seed = seed
+        self.rng = random if seed is None else random.Random(seed)
+        if fast and numpy is not None:
+            self.numpy_rng = numpy.random.RandomState(seed)
+            self.numpy_corrupters = numpy.array(ChannelSimulator.CORRUPTERS, dtype=numpy.uint8)
+        else:
+            self.numpy_rng = None
+        self.swap_queue = deque([self.random_frame(), self.random_frame()])
+        # largest frame received; senders may send larger frames, the far end must be told first
+        self.frame_size = ChannelSimulator.BUFFER_SIZE
+        # preallocated receive buffers for u_receive_many, grown on demand
+        self.receive_pool = []
+        # the scenario draws from its own generator, seeded apart from the one corrupting frame contents
+        self.model = None
+        if scenario is not None:
+            self.model = scenarios.ChannelModel(scenario, None if seed is None else seed ^ 0x5ce4a710, replay)
+        self.record = record
+        # (arrival time, tie breaker, frame) of delayed frames, by arrival time
+        self.in_transit = []
+        self.transit_count = 0
         self.debug = debug_level == logging.DEBUG
         if self.debug:
             self.logger = utils.Logger(self.__class__.__name__, debug_level)
@@ -77,16 +120,32 @@ class ChannelSimulator(object):
         self.sndr_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sndr_socket.settimeout(timeout)
 
-    def rcvr_setup(self, timeout):
+    def rcvr_setup(self, timeout, rcvbuf=None, reuse_port=False):
         """
         Setup the receiver socket
         :param timeout: time out value to use, in seconds
+        :param rcvbuf: socket receive buffer size in bytes (SO_RCVBUF), or None for the OS default
+        :param reuse_port: let other sockets bind the port too (SO_REUSEPORT); the kernel then spreads senders over
+            them, keeping every sender on one socket
         :return:
         """
         self.rcvr_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if rcvbuf is not None:
+            self.rcvr_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        if reuse_port:
+            self.rcvr_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.rcvr_socket.bind((self.ip, self.rcvr_port))
         self.rcvr_socket.settimeout(timeout)
 
+    def set_frame_size(self, frame_size):
+        """
+        Receive frames of up to frame_size bytes from now on
+        :param frame_size: largest frame in bytes, at most a UDP datagram
+        """
+        self.frame_size = frame_size
+        # reallocated on demand; frames returned earlier keep the old buffers alive
+        self.receive_pool = []
+
     def put_to_socket(self, data_bytes):
         """
         (INTERNAL) Put data to the socket
@@ -101,9 +160,46 @@ class ChannelSimulator(object):
         :return: bit string of data from the socket
         """
         while True:
-            data, address = self.rcvr_socket.recvfrom(ChannelSimulator.BUFFER_SIZE)  # buffer size is 1024 bytes
+            data, address = self.rcvr_socket.recvfrom(self.frame_size)  # buffer size is 1024 bytes by default
             return bytearray(data)
 
+    def random_frame(self):
+        """
+        (INTERNAL) Frame of random bytes used to refill the swap queue
+        :return: byte array of BUFFER_SIZE bytes
+        """
+        if not self.fast:
+            return random_bytes(ChannelSimulator.BUFFER_SIZE, self.rng)
+        return bytearray(self.random_string(ChannelSimulator.BUFFER_SIZE))
+
+    def random_string(self, n):
+        """
+        (INTERNAL) n random bytes, from the seeded generator if there is one
+        :param n: number of bytes
+        :return: str of n bytes
+        """
+        if self.seed is None:
+            return os.urandom(n)
+        return unhexlify("%0*x" % (2 * n, self.rng.getrandbits(8 * n))) if n else ""
+
+    def random_errors(self, data_bytes):
+        """
+        (INTERNAL) XOR every byte of a frame with a corrupter drawn uniformly from CORRUPTERS, in one batch
+        :param data_bytes: byte array (frame) to corrupt
+        :return: corrupted copy of the frame
+        """
+        n = len(data_bytes)
+        if not n:
+            return bytearray()
+        if self.numpy_rng is not None:
+            mask = self.numpy_rng.choice(self.numpy_corrupters, n)
+            return bytearray(numpy.bitwise_xor(numpy.frombuffer(buffer(data_bytes), dtype=numpy.uint8), mask).tostring())
+        mask = ""
+        while len(mask) < n:
+            mask += self.random_string(2 * n).translate(ChannelSimulator.CORRUPTER_TABLE, ChannelSimulator.REJECTED_BYTES)
+        corrupted = int(hexlify(data_bytes), 16) ^ int(hexlify(mask[:n]), 16)
+        return bytearray(unhexlify("%0*x" % (2 * n, corrupted)))
+
     def corrupt(self, data_bytes, drop_error_prob=0.005, random_error_prob=0.005, swap_error_prob=0.005):
         """
         Corrupt data in the channel with random errors, swaps, and drops.
@@ -121,33 +217,60 @@ class ChannelSimulator(object):
         """
         if self.debug:
             logging.debug("Sending bytes through corrupting channel")
-        p_error = uniform(0, 1)
-        p_swap = uniform(0, 1)
-        p_drop = uniform(0, 1)
-        corrupted = deepcopy(data_bytes)
+        p_error = self.rng.uniform(0, 1)
+        p_swap = self.rng.uniform(0, 1)
+        p_drop = self.rng.uniform(0, 1)
+        fate = 0
         if p_drop < drop_error_prob:
+            fate |= DROP
+        if p_error < random_error_prob:
+            fate |= ERROR
+        if p_swap < swap_error_prob:
+            fate |= SWAP | (SWAP_NEWEST if p_swap < swap_error_prob / 2 else 0)
+        return self.apply_fate(data_bytes, fate)
+
+    def corrupt_scenario(self, data_bytes):
+        """
+        Corrupt data with the fate the scenario decides for it
+        :param data_bytes: byte array (frame) to corrupt
+        :return: corrupted byte array, None if dropped
+        """
+        return self.apply_fate(data_bytes, self.model.fate(len(data_bytes)))
+
+    def apply_fate(self, data_bytes, fate):
+        """
+        (INTERNAL) Apply the drops, random errors and swaps decided for a frame
+        :param data_bytes: byte array (frame) to corrupt
+        :param fate: combination of scenario.DROP, ERROR, SWAP and SWAP_NEWEST
+        :return: corrupted byte array, None if dropped
+        """
+        corrupted = bytearray(data_bytes) if self.fast else deepcopy(data_bytes)
+        if fate & DROP:
             if self.debug:
                 logging.debug("Dropping delayed and swapped frames: {}".format(self.swap_queue))
             # drop all the delayed frames in the swap queue
             self.swap_queue.clear()
-            self.swap_queue += [random_bytes(ChannelSimulator.BUFFER_SIZE), random_bytes(ChannelSimulator.BUFFER_SIZE)]
+            self.swap_queue += [self.random_frame(), self.random_frame()]
             if self.debug:
                 logging.debug("Dropping current frame: {}".format(data_bytes))
             return None
-        if p_error < random_error_prob:
+        if fate & ERROR:
             # insert random errors into the frame
             if self.debug:
                 logging.debug("Frame before random errors: {}".format(data_bytes))
-            for n in xrange(len(data_bytes)):
-                # XOR a random corrupter byte to change a single bit, none of the bits, or all the bits
-                corrupted[n] ^= choice(ChannelSimulator.CORRUPTERS)
+            if self.fast:
+                corrupted = self.random_errors(data_bytes)
+            else:
+                for n in xrange(len(data_bytes)):
+                    # XOR a random corrupter byte to change a single bit, none of the bits, or all the bits
+                    corrupted[n] ^= self.rng.choice(ChannelSimulator.CORRUPTERS)
             if self.debug:
                 logging.debug("Frame after random errors: {}".format(corrupted))
-        if p_swap < swap_error_prob:
+        if fate & SWAP:
             if self.debug:
                 logging.debug("Frame before swap: {}".format(data_bytes))
             # swap packets with an earlier packet by popping it off the swap queue
-            if p_swap < swap_error_prob / 2:
+            if fate & SWAP_NEWEST:
                 corrupted = self.swap_queue.pop()
             else:
                 corrupted = self.swap_queue.popleft()
@@ -165,11 +288,7 @@ class ChannelSimulator(object):
         """
 
         # split data into 1024 byte frames
-        for frame in slice_frames(data_bytes):
-            corrupted = self.corrupt(frame)
-            # put corrupted frame into socket if it wasn't dropped
-            if corrupted:
-                self.put_to_socket(corrupted)
+        self.u_send_many(slice_frames(data_bytes))
 
     def u_receive(self):
         """
@@ -177,3 +296,124 @@ class ChannelSimulator(object):
         :return: byte array of data
         """
         return self.get_from_socket()
+
+    def u_send_many(self, frames):
+        """
+        Send a batch of frames through the unreliable channel, one datagram per frame
+        :param frames: iterable of byte arrays no longer than the far end's frame size
+        :return:
+        """
+        model = self.model
+        if model is not None and model.delays:
+            self.send_delayed(frames)
+            return
+        corrupt = self.corrupt if model is None else self.corrupt_scenario
+        sendto = self.sndr_socket.sendto
+        address = (self.ip, self.sndr_port)
+        for frame in frames:
+            corrupted = corrupt(frame)
+            # put corrupted frame into socket if it wasn't dropped
+            if corrupted:
+                sendto(corrupted, address)
+
+    def send_delayed(self, frames):
+        """
+        (INTERNAL) Hold frames back until the scenario lets them arrive, sending whatever is due already
+        :param frames: iterable of byte arrays no longer than the far end's frame size
+        """
+        now = time.time()
+        in_transit = self.in_transit
+        for frame in frames:
+            corrupted = self.corrupt_scenario(frame)
+            if corrupted:
+                arrival = self.model.arrival(now, len(corrupted), len(in_transit))
+                if arrival is not None:
+                    self.transit_count += 1
+                    heapq.heappush(in_transit, (arrival, self.transit_count, corrupted))
+        self.send_due(now)
+
+    def send_due(self, now):
+        """
+        Send the delayed frames whose arrival time has come
+        :param now: current time, in seconds
+        """
+        in_transit = self.in_transit
+        sendto = self.sndr_socket.sendto
+        address = (self.ip, self.sndr_port)
+        while in_transit and in_transit[0][0] <= now:
+            sendto(heapq.heappop(in_transit)[2], address)
+
+    def next_arrival(self):
+        """
+        :return: arrival time of the earliest delayed frame, None if none is in transit
+        """
+        return self.in_transit[0][0] if self.in_transit else None
+
+    def save_record(self):
+        """
+        Write the fates of the frames sent so far to the record path, if recording
+        """
+        if self.record is not None and self.model is not None:
+            self.model.save(self.record)
+
+    def u_receive_many(self, max_frames, timeout=None):
+        """
+        Receive every frame that is ready, up to max_frames, waiting only for the first one.
+        Frames are read into a pool of preallocated buffers that is reused by the next call, so callers must copy
+        any frame they keep beyond that.
+        :param max_frames: largest number of frames to return
+        :param timeout: seconds to wait for the first frame, or None to keep the socket's timeout
+        :return: list of read-only buffers, one per frame
+        """
+        sock = self.rcvr_socket
+        pool = self.receive_pool
+        while len(pool) < max_frames:
+            pool.append(bytearray(self.frame_size))
+        if self.in_transit:
+            timeout = self.wait_in_transit(sock.gettimeout() if timeout is None else timeout)
+        if timeout is not None:
+            sock.settimeout(timeout)
+
+        nbytes, _ = sock.recvfrom_into(pool[0])
+        frames = [buffer(pool[0], 0, nbytes)]
+        if max_frames > 1:
+            # drain whatever else is already queued without blocking
+            previous = sock.gettimeout()
+            sock.setblocking(0)
+            try:
+                for i in xrange(1, max_frames):
+                    nbytes, _ = sock.recvfrom_into(pool[i])
+                    frames.append(buffer(pool[i], 0, nbytes))
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+            finally:
+                sock.settimeout(previous)
+        return frames
+
+    def wait_in_transit(self, timeout):
+        """
+        (INTERNAL) Wait for the receiver socket while sending delayed frames as they come due
+        :param timeout: seconds to wait, None to wait for as long as it takes
+        :return: what is left of the timeout once the socket is readable or nothing is in transit any more
+        """
+        sock = self.rcvr_socket
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            now = time.time()
+            self.send_due(now)
+            if not self.in_transit:
+                break
+            wait = self.in_transit[0][0] - now
+            if end is not None:
+                wait = min(wait, end - now)
+            if select.select([sock], [], [], max(0.0, wait))[0]:
+                return None if end is None else max(0.0, end - time.time())
+            if end is not None and time.time() >= end:
+                raise socket.timeout("timed out")
+        if end is None:
+            return None
+        remaining = end - time.time()
+        if remaining <= 0 and timeout:
+            raise socket.timeout("timed out")
+        return max(0.0, remaining)
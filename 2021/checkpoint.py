@@ -0,0 +1,296 @@
+"""
+Resumable transfers.
+
+A receiver given a checkpoint path writes the transfer to that file instead of
+stdout, and beside it keeps a manifest of every block of BLOCK_SIZE bytes that
+reached the file:
+
+    magic       4 bytes  MANIFEST_MAGIC
+    block size  uint32
+    records     one per completed block
+        index   uint32   block number
+        length  uint32   bytes in the block, less than the block size only for the last block of the output
+        crc32   uint32   CRC-32 of those bytes
+
+A block's record is appended only once the block has been flushed to the
+output. Process death therefore loses at most the blocks still being written.
+When the receiver starts again, it checks every record against the file. In
+its SYN|ACK it answers a resuming sender with the byte ranges that are still
+missing. The sender sends only those ranges, concatenated, as the session's
+stream, and the receiver writes them back at their offsets. Recovery then
+costs what was lost rather than the size of the file.
+"""
+
+import os
+import struct
+import zlib
+
+BLOCK_SIZE = 1 << 16
+
+MANIFEST_HEADER = struct.Struct(">4sI")
+MANIFEST_MAGIC = b"CKPT"
+RECORD = struct.Struct(">III")
+
+
+def manifest_path(path):
+    return path + ".manifest"
+
+
+def coalesce(ranges, limit):
+    """
+    Merge ranges across the narrowest gaps until at most limit are left
+    :param ranges: sorted, disjoint (offset, length) pairs, the last length may be None for "to the end"
+    :param limit: most ranges returned
+    :return: list of (offset, length) pairs covering at least the given ranges
+    """
+    if len(ranges) <= limit:
+        return list(ranges)
+    by_gap = sorted(xrange(len(ranges) - 1), key=lambda i: ranges[i + 1][0] - ranges[i][0] - ranges[i][1])
+    # the limit - 1 widest gaps stay, every other gap is sent again
+    kept = set(by_gap[len(ranges) - limit:])
+    merged = [ranges[0]]
+    for i in xrange(1, len(ranges)):
+        offset, length = ranges[i]
+        if i - 1 in kept:
+            merged.append((offset, length))
+        else:
+            start = merged[-1][0]
+            merged[-1] = (start, None if length is None else offset + length - start)
+    return merged
+
+
+class Checkpoint(object):
+
+    def __init__(self, path, block_size=BLOCK_SIZE):
+        """
+        Open the output of a resumable transfer and check what an earlier run left of it
+        :param path: output file, its manifest lives at manifest_path(path)
+        :param block_size: block size of a new manifest; an existing manifest keeps its own
+        """
+        self.path = path
+        self.block_size = block_size
+        self.output = open(path, "r+b" if os.path.exists(path) else "w+b")
+        # block index -> (length, crc32) of every block verified or written
+        self.blocks = {}
+        self._load()
+        # bytes found intact on disk when the transfer started
+        self.verified = sum(length for length, _ in self.blocks.values())
+        # rewrite the manifest without the records that failed verification
+        self.manifest = open(manifest_path(path), "wb")
+        self.manifest.write(MANIFEST_HEADER.pack(MANIFEST_MAGIC, self.block_size))
+        for index in sorted(self.blocks):
+            self.manifest.write(RECORD.pack(index, *self.blocks[index]))
+        self.manifest.flush()
+
+    def _load(self):
+        try:
+            with open(manifest_path(self.path), "rb") as f:
+                manifest = f.read()
+        except IOError:
+            return
+        if len(manifest) < MANIFEST_HEADER.size:
+            return
+        magic, block_size = MANIFEST_HEADER.unpack_from(manifest)
+        if magic != MANIFEST_MAGIC:
+            return
+        self.block_size = block_size
+        file_size = os.fstat(self.output.fileno()).st_size
+        for position in xrange(MANIFEST_HEADER.size, len(manifest) - RECORD.size + 1, RECORD.size):
+            index, length, crc = RECORD.unpack_from(manifest, position)
+            # only blocks whose bytes survived count, a record may outlive a truncated or edited file
+            if length > block_size or index * block_size + length > file_size:
+                continue
+            self.output.seek(index * block_size)
+            if zlib.crc32(self.output.read(length)) & 0xffffffff == crc:
+                self.blocks[index] = (length, crc)
+
+    @property
+    def size(self):
+        """
+        :return: length of the whole output, None until its last block is known
+        """
+        for index, (length, _) in self.blocks.iteritems():
+            if length < self.block_size:
+                return index * self.block_size + length
+        return None
+
+    def missing(self):
+        """
+        :return: (offset, length) of every range the output still lacks, in order; the last length is None when the
+                 end of the output is unknown
+        """
+        size = self.size
+        end = (size + self.block_size - 1) // self.block_size if size is not None else max(self.blocks or [-1]) + 1
+        ranges = []
+        for index in xrange(end):
+            if index in self.blocks:
+                continue
+            offset = index * self.block_size
+            if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + self.block_size)
+            else:
+                ranges.append((offset, self.block_size))
+        # the last block is intact whenever the size is known, so only an unknown end leaves an open range
+        if size is None:
+            ranges.append((end * self.block_size, None))
+        return ranges
+
+    def restart(self):
+        """
+        Forget every block, for a sender that sends the whole input
+        :return: the one range covering the whole output
+        """
+        self.blocks = {}
+        self.verified = 0
+        self.manifest.seek(MANIFEST_HEADER.size)
+        self.manifest.truncate()
+        return [(0, None)]
+
+    def writer(self, ranges):
+        """
+        :param ranges: ranges the sender was asked for, as from missing or restart
+        :return: RangeWriter placing the session's stream in them
+        """
+        return RangeWriter(self, ranges)
+
+    def complete(self, index, length, crc):
+        """
+        Record a block once its bytes are flushed
+        :param index: block number
+        :param length: bytes in the block
+        :param crc: CRC-32 of the block
+        """
+        self.output.flush()
+        self.blocks[index] = (length, crc)
+        self.manifest.write(RECORD.pack(index, length, crc))
+        self.manifest.flush()
+
+    def close(self):
+        self.output.close()
+        self.manifest.close()
+
+
+class RangeWriter(object):
+    """
+    File-like sink writing a stream of concatenated ranges at their offsets and recording every completed block
+    """
+
+    def __init__(self, checkpoint, ranges):
+        """
+        :param checkpoint: Checkpoint of the output
+        :param ranges: block aligned (offset, length) pairs the stream fills in order, the last length may be None
+        """
+        self.checkpoint = checkpoint
+        self.ranges = list(ranges)
+        self.position = 0
+        # CRC-32 of the part of the current block written so far
+        self.crc = 0
+        self.finished = False
+        self._next_range()
+
+    def _next_range(self):
+        if self.ranges:
+            offset, length = self.ranges.pop(0)
+            self.position = offset
+            self.end = None if length is None else offset + length
+            self.checkpoint.output.seek(offset)
+        else:
+            self.end = self.position
+
+    def write(self, data):
+        """
+        :param data: next bytes of the stream
+        """
+        checkpoint = self.checkpoint
+        block_size = checkpoint.block_size
+        data = buffer(data)
+        written = 0
+        while written < len(data):
+            if self.position == self.end:
+                if not self.ranges:
+                    raise ValueError("Stream runs past the ranges asked for")
+                self._next_range()
+                continue
+            size = block_size - self.position % block_size
+            if self.end is not None:
+                size = min(size, self.end - self.position)
+            chunk = data[written:written + size]
+            checkpoint.output.write(chunk)
+            self.crc = zlib.crc32(chunk, self.crc)
+            self.position += len(chunk)
+            written += len(chunk)
+            if self.position % block_size == 0:
+                checkpoint.complete(self.position // block_size - 1, block_size, self.crc & 0xffffffff)
+                self.crc = 0
+
+    def flush(self):
+        self.checkpoint.output.flush()
+
+    def finish(self):
+        """
+        End of the stream: a stream that ran to the end of the output fixes its size
+        """
+        if self.finished:
+            return
+        self.finished = True
+        checkpoint = self.checkpoint
+        if self.end is None and not self.ranges:
+            block_size = checkpoint.block_size
+            # the last block may be empty, its record still marks the end of the output
+            checkpoint.output.truncate(self.position)
+            checkpoint.complete(self.position // block_size, self.position % block_size, self.crc & 0xffffffff)
+        checkpoint.output.flush()
+
+
+class RangesReader(object):
+    """
+    File-like view of the concatenated ranges of an input, read forward only
+    """
+
+    # bytes read per step when skipping an unseekable input
+    SKIP_CHUNK = 1 << 16
+
+    def __init__(self, stream, ranges):
+        """
+        :param stream: file object opened for binary reading at offset 0
+        :param ranges: sorted, disjoint (offset, length) pairs, the last length may be None for "to the end"
+        """
+        self.stream = stream
+        self.ranges = list(ranges)
+        self.position = 0
+
+    def read(self, size):
+        """
+        :param size: bytes wanted
+        :return: size bytes, fewer only at the end of the last range or of the input
+        """
+        chunks = []
+        while size and self.ranges:
+            offset, length = self.ranges[0]
+            if self.position < offset:
+                self._skip(offset - self.position)
+            wanted = size if length is None else min(size, offset + length - self.position)
+            chunk = self.stream.read(wanted) if wanted > 0 else b""
+            self.position += len(chunk)
+            chunks.append(chunk)
+            size -= len(chunk)
+            if len(chunk) < wanted:
+                # the input ended
+                self.ranges = []
+            elif length is not None and self.position >= offset + length:
+                self.ranges.pop(0)
+        return b"".join(chunks)
+
+    def _skip(self, count):
+        try:
+            self.stream.seek(count, os.SEEK_CUR)
+            self.position += count
+            return
+        except (AttributeError, IOError):
+            pass
+        while count:
+            chunk = self.stream.read(min(count, self.SKIP_CHUNK))
+            if not chunk:
+                break
+            self.position += len(chunk)
+            count -= len(chunk)
@@ -0,0 +1,92 @@
+"""
+Microbenchmark comparing the checksums in checksums.py with the legacy bit-string Adler-32.
+
+For each checksum it reports the cost per 1024 byte frame and how many frames
+corrupted by ChannelSimulator.corrupt (random errors) or by a single bit flip
+still pass verification. Frames are built and verified by packet.PacketCodec,
+so the checksum covers exactly what it covers on the wire.
+
+Usage: python checksum_bench.py [frames]
+"""
+
+import logging
+import os
+import random
+import sys
+import timeit
+
+import checksums
+import packet
+from channelsimulator import ChannelSimulator
+
+
+def make_frames(codec, n):
+    """
+    :param codec: packet.PacketCodec sealing the frames
+    :param n: number of frames
+    :return: list of full-sized data frames with random payloads
+    """
+    return [codec.encode(seq, 0, os.urandom(packet.MAX_PAYLOAD)) for seq in xrange(n)]
+
+
+def flip_bit(frame):
+    flipped = bytearray(frame)
+    bit = random.randrange(len(frame) * 8)
+    flipped[bit // 8] ^= 1 << (bit % 8)
+    return flipped
+
+
+def escapes(codec, frames, corrupt):
+    """
+    Count corrupted frames that still pass a checksum
+    :param codec: packet.PacketCodec that sealed the frames
+    :param frames: valid frames
+    :param corrupt: function returning a corrupted copy of a frame
+    :return: (corrupted frames, undetected frames)
+    """
+    corrupted = undetected = 0
+    for frame in frames:
+        bad = corrupt(frame)
+        if bad is None or bad == frame:
+            continue
+        corrupted += 1
+        # decode verifies against the checksum carried in the (possibly corrupted) frame, as the receiver does
+        if codec.decode(bad) is not None:
+            undetected += 1
+    return corrupted, undetected
+
+
+def main(n):
+    frames = make_frames(packet.PacketCodec(checksums.new_checksum()), n)
+    channel = ChannelSimulator(inbound_port=44444, outbound_port=55555, debug_level=logging.WARNING)
+
+    def channel_error(frame):
+        return channel.corrupt(frame, drop_error_prob=0, random_error_prob=1, swap_error_prob=0)
+
+    def legacy():
+        for seq, frame in enumerate(frames):
+            checksums.legacy_checksum("{0:b}".format(seq).zfill(32), frame[packet.HEADER_SIZE:])
+
+    legacy_time = min(timeit.repeat(legacy, number=1, repeat=3)) / n
+    print("{:<10} {:>12} {:>10} {:>22} {:>22}".format("checksum", "us/frame", "speedup", "channel escapes", "bit flip escapes"))
+    print("{:<10} {:>12.2f} {:>10}".format("legacy", legacy_time * 1e6, "1.0x"))
+
+    for name in sorted(checksums.CHECKSUMS):
+        codec = packet.PacketCodec(checksums.new_checksum(name))
+        sealed = make_frames(codec, n)
+
+        def run():
+            for frame in sealed:
+                codec.decode(frame)
+
+        elapsed = min(timeit.repeat(run, number=1, repeat=3)) / n
+        channel_stats = escapes(codec, sealed, channel_error)
+        flip_stats = escapes(codec, sealed, flip_bit)
+        print("{:<10} {:>12.2f} {:>9.1f}x {:>22} {:>22}".format(
+            name, elapsed * 1e6, legacy_time / elapsed,
+            "{}/{}".format(channel_stats[1], channel_stats[0]),
+            "{}/{}".format(flip_stats[1], flip_stats[0])))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,200 @@
+"""
+Optional compression of the byte stream ahead of packetization.
+
+The sender cuts its input into blocks of BLOCK_SIZE bytes and writes each one
+as a frame
+
+    mode      uint8    RAW, ZLIB or BASE64
+    length    uint32   encoded length in bytes
+    data      bytes    encoded block
+
+and the frames are sent as an ordinary stream; the receiver decodes them after
+reassembly, so packets, ACKs and retransmissions are unaffected. BASE64 repacks
+base64 text, which carries 6 bits in every byte, into the bytes it encodes, a
+fixed 25% saving done entirely in C; it applies only where the text re-encodes
+to exactly the same bytes. ZLIB is a single streaming deflate context flushed
+at every block. The encoder measures the ratio it achieves on the first
+blocks and falls back to RAW for the rest of a stream that does not compress.
+"""
+
+import binascii
+import struct
+import zlib
+
+FRAME = struct.Struct(">BI")
+
+# region Modes
+
+RAW = 0
+ZLIB = 1
+BASE64 = 2
+# endregion Modes
+
+# names accepted by CompressingReader, "auto" repacks base64 and deflates anything else
+METHODS = ("zlib", "base64", "auto")
+
+BLOCK_SIZE = 1 << 16
+
+
+class DecodeError(ValueError):
+    """
+    The framed stream cannot be decoded, e.g. a ZLIB frame that does not inflate
+    """
+
+
+def is_base64(block):
+    """
+    :param block: bytes whose length is a multiple of 4
+    :return: decoded bytes if block is canonical base64 without line breaks, else None
+    """
+    try:
+        decoded = binascii.a2b_base64(block)
+    except binascii.Error:
+        return None
+    # a2b_base64 skips characters outside the alphabet, so only an exact round trip proves the block is base64
+    if binascii.b2a_base64(decoded)[:-1] != block:
+        return None
+    return decoded
+
+
+class CompressingReader(object):
+
+    # blocks measured before deciding whether compression pays off
+    PROBE_BLOCKS = 4
+    # compression is abandoned if the probe blocks shrink less than this
+    MAX_RATIO = 0.95
+
+    def __init__(self, stream, method="auto", level=1):
+        """
+        Read a stream as a sequence of compressed frames
+        :param stream: file object opened for binary reading
+        :param method: one of METHODS
+        :param level: zlib compression level
+        """
+        if method not in METHODS:
+            raise ValueError("Unknown compression {}, expected one of {}".format(method, ", ".join(METHODS)))
+        self.stream = stream
+        self.method = method
+        self.deflate = zlib.compressobj(level)
+        self.enabled = True
+        self.pending = b""
+        self.exhausted = False
+        self.blocks = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def read(self, size):
+        """
+        :param size: most bytes to return
+        :return: up to size bytes of framed stream, fewer only at its end
+        """
+        chunks = [self.pending]
+        available = len(self.pending)
+        while available < size and not self.exhausted:
+            block = self.stream.read(BLOCK_SIZE)
+            if len(block) < BLOCK_SIZE:
+                self.exhausted = True
+            if not block:
+                break
+            frames = self.encode(block)
+            chunks.append(frames)
+            available += len(frames)
+        data = b"".join(chunks)
+        self.pending = data[size:]
+        return data[:size]
+
+    def encode(self, block):
+        """
+        :param block: input bytes
+        :return: one or more frames carrying block
+        """
+        size = len(block)
+        frames = []
+        if self.enabled:
+            if self.method != "zlib":
+                whole = size - size % 4
+                decoded = is_base64(block[:whole]) if whole else None
+                if decoded is not None:
+                    frames.append(FRAME.pack(BASE64, len(decoded)) + decoded)
+                    block = block[whole:]
+            if block and self.method != "base64":
+                # deflate on a copy: a block sent RAW must not enter the stream the receiver inflates
+                deflate = self.deflate.copy()
+                deflated = deflate.compress(block) + deflate.flush(zlib.Z_SYNC_FLUSH)
+                if len(deflated) < len(block):
+                    self.deflate = deflate
+                    frames.append(FRAME.pack(ZLIB, len(deflated)) + deflated)
+                    block = b""
+        if block:
+            frames.append(FRAME.pack(RAW, len(block)) + block)
+        frames = b"".join(frames)
+
+        self.blocks += 1
+        self.bytes_in += size
+        self.bytes_out += len(frames)
+        if self.enabled and self.blocks == self.PROBE_BLOCKS and self.ratio() > self.MAX_RATIO:
+            # incompressible input, stop spending CPU on it
+            self.enabled = False
+        return frames
+
+    def ratio(self):
+        """
+        :return: framed bytes per input byte so far
+        """
+        return float(self.bytes_out) / self.bytes_in if self.bytes_in else 1.0
+
+
+class Decoder(object):
+
+    def __init__(self, output):
+        """
+        Decode a framed stream as it is reassembled
+        :param output: file object receiving the original bytes
+        """
+        self.output = output
+        self.inflate = zlib.decompressobj()
+        self.buffer = bytearray()
+        self.bytes_out = 0
+
+    def write(self, data):
+        """
+        :param data: next bytes of the framed stream
+        :raises DecodeError: if a frame cannot be decoded
+        """
+        self.buffer += data
+        buf = self.buffer
+        position = 0
+        decoded = []
+        while len(buf) - position >= FRAME.size:
+            mode, length = FRAME.unpack_from(buf, position)
+            end = position + FRAME.size + length
+            if end > len(buf):
+                break
+            payload = buffer(buf, position + FRAME.size, length)
+            if mode == BASE64:
+                decoded.append(binascii.b2a_base64(payload)[:-1])
+            elif mode == ZLIB:
+                try:
+                    decoded.append(self.inflate.decompress(payload))
+                except zlib.error as e:
+                    raise DecodeError(str(e))
+            elif mode == RAW:
+                decoded.append(str(payload))
+            else:
+                raise DecodeError("Unknown compression frame mode {}".format(mode))
+            position = end
+        del buf[:position]
+        if decoded:
+            decoded = b"".join(decoded)
+            self.bytes_out += len(decoded)
+            self.output.write(decoded)
+
+    def flush(self):
+        self.output.flush()
+
+    @property
+    def incomplete(self):
+        """
+        :return: True if a partial frame is still buffered
+        """
+        return len(self.buffer) > 0
@@ -0,0 +1,165 @@
+"""
+Pluggable sender window controllers.
+
+A controller decides how many packets may be in flight and, for paced
+controllers, when the next one may leave. The sender reports every ACK and
+every loss (a retransmission timer expiring) to it. The receiver-side limit,
+mySender.WINDOW_SIZE, still bounds the span of sequence numbers in flight.
+"""
+
+import time
+
+
+class WindowController(object):
+
+    NAME = None
+
+    def __init__(self, max_window):
+        """
+        Create a controller
+        :param max_window: largest window the receiver can buffer, in packets
+        """
+        self.max_window = max_window
+        self.window = max_window
+
+    def can_send(self, in_flight, now):
+        """
+        :param in_flight: packets sent but not acknowledged
+        :param now: current time, in seconds
+        :return: True if another packet may be sent now
+        """
+        return in_flight < self.window
+
+    def next_send_time(self, now):
+        """
+        :param now: current time, in seconds
+        :return: earliest time at which pacing allows another packet
+        """
+        return now
+
+    def on_send(self, now):
+        pass
+
+    def on_ack(self, acked, now):
+        """
+        :param acked: number of packets newly acknowledged
+        :param now: current time, in seconds
+        """
+        pass
+
+    def on_loss(self, seq, next_seq, now):
+        """
+        :param seq: sequence number of the packet whose timer expired
+        :param next_seq: next sequence number the sender will assign
+        :param now: current time, in seconds
+        """
+        pass
+
+
+class FixedWindow(WindowController):
+    """
+    Baseline: always allow the receiver's full window.
+    """
+
+    NAME = "fixed"
+
+
+class NewRenoWindow(WindowController):
+    """
+    AIMD: slow start, then one packet per window per RTT, halved at most once per
+    window of data on loss, NewReno style.
+    """
+
+    NAME = "newreno"
+    INITIAL_WINDOW = 10
+    MIN_WINDOW = 2
+
+    def __init__(self, max_window):
+        super(NewRenoWindow, self).__init__(max_window)
+        self.cwnd = float(self.INITIAL_WINDOW)
+        self.ssthresh = float(max_window)
+        # losses of packets sent before this point belong to the current recovery
+        self.recovery_point = -1
+        self.window = self.INITIAL_WINDOW
+
+    def on_ack(self, acked, now):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += acked
+        else:
+            self.cwnd += float(acked) / self.cwnd
+        self.cwnd = min(self.cwnd, self.max_window)
+        self.window = int(self.cwnd)
+
+    def on_loss(self, seq, next_seq, now):
+        if seq < self.recovery_point:
+            return
+        self.recovery_point = next_seq
+        self.ssthresh = max(self.cwnd / 2, self.MIN_WINDOW)
+        self.cwnd = self.ssthresh
+        self.window = int(self.cwnd)
+
+
+class PacedWindow(WindowController):
+    """
+    Send at a fixed packet rate within the receiver's window, so bursts never
+    overrun the receiver's socket buffer.
+    """
+
+    NAME = "paced"
+    DEFAULT_RATE = 20000
+
+    def __init__(self, max_window, rate=DEFAULT_RATE):
+        """
+        :param max_window: largest window the receiver can buffer, in packets
+        :param rate: packets per second
+        """
+        super(PacedWindow, self).__init__(max_window)
+        self.interval = 1.0 / rate
+        self.next_time = 0.0
+
+    def can_send(self, in_flight, now):
+        return in_flight < self.window and now >= self.next_time
+
+    def next_send_time(self, now):
+        return max(now, self.next_time)
+
+    def on_send(self, now):
+        # do not bank credit for idle periods longer than one interval
+        self.next_time = max(self.next_time, now - self.interval) + self.interval
+
+
+CONTROLLERS = dict((cls.NAME, cls) for cls in (FixedWindow, NewRenoWindow, PacedWindow))
+DEFAULT_CONTROLLER = NewRenoWindow.NAME
+
+
+def new_controller(name, max_window, **kwargs):
+    """
+    Create a window controller by name
+    :param name: one of CONTROLLERS
+    :param max_window: largest window the receiver can buffer, in packets
+    :param kwargs: controller specific options (e.g. rate for paced)
+    :return: WindowController instance
+    """
+    try:
+        return CONTROLLERS[name](max_window, **kwargs)
+    except KeyError:
+        raise ValueError("Unknown window controller {!r}, expected one of {}".format(name, sorted(CONTROLLERS)))
+
+
+class WindowLog(object):
+    """
+    Logs window size and goodput roughly once per smoothed RTT.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.last_time = time.time()
+        self.acked_bytes = 0
+
+    def update(self, acked_bytes, window, srtt, now):
+        self.acked_bytes += acked_bytes
+        elapsed = now - self.last_time
+        if elapsed >= (srtt or 0.1):
+            self.logger.debug("Window {} packets, goodput {:.1f} KB/s", window, self.acked_bytes / elapsed / 1024)
+            self.last_time = now
+            self.acked_bytes = 0
@@ -0,0 +1,195 @@
+"""
+Minimal single-threaded event loop for the channel, in the style of asyncio.
+
+Python 2 has no asyncio, so this module provides the subset the sender and
+receiver need with the same names: an EventLoop with call_at/call_later
+timers and add_reader callbacks multiplexed through select, a
+DatagramProtocol base class, and a ChannelTransport that sends through a
+ChannelSimulator and delivers every frame queued on its receive socket to
+the protocol in one batch. Timers and socket readiness are served by the same
+wait, so ACK processing, pacing and retransmissions never block each other.
+"""
+
+import errno
+import heapq
+import itertools
+import select
+import socket
+import time
+
+
+class Handle(object):
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop(object):
+
+    def __init__(self):
+        # (deadline, tie breaker, handle)
+        self.timers = []
+        self.counter = itertools.count()
+        # file descriptor -> (callback, args)
+        self.readers = {}
+        self.running = False
+
+    @staticmethod
+    def time():
+        return time.time()
+
+    def call_at(self, when, callback, *args):
+        """
+        Schedule a callback
+        :param when: time, as returned by time()
+        :param callback: function called with args
+        :return: Handle that can cancel the call
+        """
+        handle = Handle(when, callback, args)
+        heapq.heappush(self.timers, (when, next(self.counter), handle))
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.time() + delay, callback, *args)
+
+    def call_soon(self, callback, *args):
+        return self.call_at(0, callback, *args)
+
+    def add_reader(self, fd, callback, *args):
+        """
+        Call callback(*args) whenever fd is readable
+        :param fd: file descriptor or object with fileno()
+        """
+        self.readers[fd if isinstance(fd, int) else fd.fileno()] = (callback, args)
+
+    def remove_reader(self, fd):
+        self.readers.pop(fd if isinstance(fd, int) else fd.fileno(), None)
+
+    def stop(self):
+        self.running = False
+
+    def run_forever(self):
+        """
+        Serve timers and readers until stop() is called
+        """
+        self.running = True
+        timers = self.timers
+        while self.running:
+            while timers and timers[0][2].cancelled:
+                heapq.heappop(timers)
+            timeout = max(0.0, timers[0][0] - self.time()) if timers else None
+            if self.readers:
+                try:
+                    readable, _, _ = select.select(list(self.readers), [], [], timeout)
+                except select.error as e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+                    readable = []
+            else:
+                if timeout is None:
+                    raise RuntimeError("Event loop has nothing left to wait for")
+                time.sleep(timeout)
+                readable = []
+            for fd in readable:
+                entry = self.readers.get(fd)
+                if entry is not None and self.running:
+                    entry[0](*entry[1])
+            now = self.time()
+            while timers and timers[0][0] <= now and self.running:
+                _, _, handle = heapq.heappop(timers)
+                if not handle.cancelled:
+                    handle.callback(*handle.args)
+
+
+class DatagramProtocol(object):
+
+    def connection_made(self, transport):
+        """
+        :param transport: ChannelTransport the protocol was attached to
+        """
+        pass
+
+    def datagram_received(self, data):
+        """
+        :param data: one received frame, only valid until the callback returns
+        """
+        pass
+
+    def datagrams_received(self, frames):
+        """
+        Every frame read in one wakeup; override to handle a batch at once
+        :param frames: list of frames, only valid until the callback returns
+        """
+        for frame in frames:
+            self.datagram_received(frame)
+
+    def error_received(self, exc):
+        pass
+
+
+class ChannelTransport(object):
+
+    # most frames delivered per wakeup
+    MAX_BATCH = 256
+
+    def __init__(self, loop, simulator, protocol):
+        """
+        Attach a protocol to a ChannelSimulator whose sockets are already set up
+        :param loop: EventLoop
+        :param simulator: channelsimulator.ChannelSimulator
+        :param protocol: DatagramProtocol
+        """
+        self.loop = loop
+        self.simulator = simulator
+        self.protocol = protocol
+        # sends frames a channel scenario holds back once they are due
+        self.arrival_timer = None
+        loop.add_reader(simulator.rcvr_socket, self._read_ready)
+        protocol.connection_made(self)
+
+    def sendto(self, frame):
+        self.sendto_many((frame,))
+
+    def sendto_many(self, frames):
+        if frames:
+            self.simulator.u_send_many(frames)
+            self._schedule_arrivals()
+
+    def close(self):
+        self.loop.remove_reader(self.simulator.rcvr_socket)
+        if self.arrival_timer is not None:
+            self.arrival_timer.cancel()
+
+    def _schedule_arrivals(self):
+        arrival = self.simulator.next_arrival()
+        if arrival is None:
+            return
+        if self.arrival_timer is not None:
+            if self.arrival_timer.when <= arrival:
+                return
+            self.arrival_timer.cancel()
+        self.arrival_timer = self.loop.call_at(arrival, self._send_arrivals)
+
+    def _send_arrivals(self):
+        self.arrival_timer = None
+        self.simulator.send_due(self.loop.time())
+        self._schedule_arrivals()
+
+    def _read_ready(self):
+        try:
+            frames = self.simulator.u_receive_many(self.MAX_BATCH, 0.0)
+        except socket.timeout:
+            # only a channel scenario's wait for delayed frames times out, and nothing was readable after all
+            return
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.protocol.error_received(e)
+            return
+        self.protocol.datagrams_received(frames)
@@ -0,0 +1,238 @@
+"""
+Forward error correction with XOR parity groups.
+
+The sender splits the data packets into groups of k consecutive sequence
+numbers, group g covering packets g*k to g*k + k - 1. With m parity packets per
+group, parity packet j is the XOR of the group's packets j, j + m, j + 2m, ...
+so the receiver can rebuild one lost or corrupted packet out of each of those m
+interleaved classes without a round trip; a burst of up to m consecutive losses
+is always recoverable. Parity packets are sent once and never retransmitted.
+
+A parity packet carries the first sequence number of its group in its header
+and this payload:
+
+    group     uint8    k, packets per group
+    count     uint8    packets actually in the group (short at end of stream)
+    index     uint8    j, the class this parity covers
+    stride    uint8    m, parity packets sent for the group
+    length    uint16   XOR of the lengths of the covered payloads
+    parity    bytes    XOR of the covered payloads, shorter ones padded with zeros
+
+Payloads are XORed as Python ints so a whole packet is one C-level operation.
+"""
+
+import math
+import struct
+from binascii import hexlify, unhexlify
+
+PARITY_HEADER = struct.Struct(">BBBBH")
+MAX_GROUP = 255
+
+DEFAULT_GROUP = 16
+DEFAULT_PARITY = 1
+
+
+def _to_int(payload, width):
+    """
+    :param payload: bytes of at most width bytes
+    :param width: width of the parity block
+    :return: payload as a big-endian int, padded with zeros on the right to width bytes
+    """
+    if not len(payload):
+        return 0
+    return int(hexlify(payload), 16) << 8 * (width - len(payload))
+
+
+def _to_bytes(value, length):
+    """
+    :param value: int of at most length bytes
+    :param length: number of bytes
+    :return: value as big-endian bytes
+    """
+    return unhexlify("%0*x" % (2 * length, value)) if length else b""
+
+
+class ParityEncoder(object):
+
+    # packets sent between two updates of the loss estimate
+    OBSERVE_PACKETS = 256
+    # weight of the newest loss sample
+    LOSS_GAIN = 1.0 / 4
+    # parity packets per group aim at this multiple of the expected losses per group
+    REDUNDANCY = 2.0
+
+    def __init__(self, group=DEFAULT_GROUP, parity=DEFAULT_PARITY, payload_size=None, adaptive=False,
+                 max_parity=None):
+        """
+        Create an encoder
+        :param group: data packets per group (k)
+        :param parity: parity packets per group (m); with adaptive, the least used
+        :param payload_size: largest data payload, in bytes
+        :param adaptive: raise the parity per group with the observed loss rate
+        :param max_parity: most parity packets per group when adaptive, defaults to a quarter of the group
+        """
+        if not 0 < group <= MAX_GROUP:
+            raise ValueError("FEC group must hold 1 to {} packets, not {}".format(MAX_GROUP, group))
+        if not 0 <= parity <= group:
+            raise ValueError("FEC parity must be between 0 and the group size {}, not {}".format(group, parity))
+        self.group = group
+        self.min_parity = parity
+        self.parity = parity
+        self.max_parity = max(parity, max_parity if max_parity is not None else group // 4)
+        self.payload_size = payload_size
+        self.adaptive = adaptive
+        self.loss_rate = 0.0
+        self.parity_sent = 0
+        self._observed_sent = 0
+        self._observed_lost = 0
+        self._reset(None)
+
+    def _reset(self, start):
+        self.start = start
+        self.count = 0
+        self.stride = self.parity
+        self.xors = [0] * self.stride
+        self.lengths = [0] * self.stride
+        self.widths = [0] * self.stride
+
+    def add(self, seq, payload):
+        """
+        Account a data packet in its group
+        :param seq: sequence number, consecutive from a multiple of the group size
+        :param payload: data payload
+        :return: list of (group start, parity payload) pairs, non-empty once the group is complete
+        """
+        if self.count == 0:
+            self._reset(seq)
+        if self.stride:
+            index = self.count % self.stride
+            self.xors[index] ^= _to_int(payload, self.payload_size)
+            self.lengths[index] ^= len(payload)
+            self.widths[index] = max(self.widths[index], len(payload))
+        self.count += 1
+        if self.count == self.group:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        Close the current group, complete or not
+        :return: list of (group start, parity payload) pairs
+        """
+        parities = []
+        for index in xrange(min(self.stride, self.count)):
+            width = self.widths[index]
+            value = self.xors[index] >> 8 * (self.payload_size - width)
+            parities.append((self.start, PARITY_HEADER.pack(self.group, self.count, index, self.stride,
+                                                            self.lengths[index]) + _to_bytes(value, width)))
+        self.parity_sent += len(parities)
+        self.count = 0
+        return parities
+
+    def observe(self, sent, lost):
+        """
+        Feed the loss estimate that drives adaptive redundancy
+        :param sent: data packets sent, retransmissions included
+        :param lost: packets retransmitted because their timer expired
+        """
+        self._observed_sent += sent
+        self._observed_lost += lost
+        if self._observed_sent < self.OBSERVE_PACKETS:
+            return
+        sample = float(self._observed_lost) / self._observed_sent
+        self.loss_rate += self.LOSS_GAIN * (sample - self.loss_rate)
+        self._observed_sent = self._observed_lost = 0
+        if self.adaptive:
+            target = int(math.ceil(self.REDUNDANCY * self.loss_rate * self.group))
+            self.parity = max(self.min_parity, min(self.max_parity, target))
+
+
+class ParityDecoder(object):
+
+    def __init__(self):
+        # sequence number -> payload, for every packet of a group that may still need repair
+        self.payloads = {}
+        # group start -> {index: (count, stride, length, parity)}, for parity not yet used
+        self.parities = {}
+        # packets per group, learnt from the first parity packet
+        self.group = None
+        # packets below this are no longer kept
+        self.lowest = 0
+        self.recovered = 0
+
+    def add_data(self, seq, payload):
+        """
+        Keep a received data packet for repairs
+        :param seq: sequence number
+        :param payload: payload bytes, kept by reference
+        :return: list of (sequence number, payload) pairs rebuilt with its help
+        """
+        if seq < self.lowest:
+            return []
+        self.payloads[seq] = payload
+        if self.group is None:
+            return []
+        return self._recover(seq - seq % self.group)
+
+    def add_parity(self, start, payload):
+        """
+        Use a parity packet
+        :param start: first sequence number of its group
+        :param payload: parity payload
+        :return: list of (sequence number, payload) pairs rebuilt with its help
+        """
+        if start < self.lowest or len(payload) < PARITY_HEADER.size:
+            return []
+        group, count, index, stride, length = PARITY_HEADER.unpack_from(payload)
+        if not 0 < count <= group or index >= stride or start % group:
+            return []
+        self.group = group
+        # slicing copies, the payload may be a view into a reused receive buffer
+        self.parities.setdefault(start, {})[index] = (count, stride, length, payload[PARITY_HEADER.size:])
+        return self._recover(start)
+
+    def _recover(self, start):
+        parities = self.parities.get(start)
+        if not parities:
+            return []
+        recovered = []
+        for index, (count, stride, length, parity) in parities.items():
+            members = xrange(start + index, start + count, stride)
+            missing = [seq for seq in members if seq not in self.payloads]
+            if len(missing) > 1:
+                continue
+            del parities[index]
+            if not missing:
+                continue
+            width = len(parity)
+            value = _to_int(parity, width)
+            for seq in members:
+                if seq != missing[0]:
+                    value ^= _to_int(self.payloads[seq], width)
+                    length ^= len(self.payloads[seq])
+            if length > width:
+                # inconsistent parity, nothing can be rebuilt from it
+                continue
+            payload = _to_bytes(value >> 8 * (width - length), length)
+            self.payloads[missing[0]] = payload
+            recovered.append((missing[0], payload))
+        if not parities:
+            del self.parities[start]
+        self.recovered += len(recovered)
+        return recovered
+
+    def discard_below(self, expected):
+        """
+        Forget every group that lies entirely below a sequence number
+        :param expected: cumulative acknowledgement of the receiver
+        """
+        # without a known group size keep a full group's worth of history
+        lowest = expected - expected % self.group if self.group else expected - MAX_GROUP
+        if lowest <= self.lowest:
+            return
+        for seq in xrange(self.lowest, lowest):
+            self.payloads.pop(seq, None)
+        if self.parities:
+            for start in [start for start in self.parities if start < lowest]:
+                del self.parities[start]
+        self.lowest = lowest
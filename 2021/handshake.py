@@ -0,0 +1,145 @@
+"""
+Connection setup and teardown.
+
+The sender opens a session with a SYN whose payload offers its window, its
+data payload size, optional features and its checksum; the receiver answers
+SYN|ACK with the agreed values, the smaller window and payload size, the
+offered features it supports and the offered checksum if it implements it,
+its own otherwise. Both ends switch to the agreed
+checksum for data and ACK frames, while SYN, FIN and their acknowledgements
+are always sealed with CONTROL_CHECKSUM so that either end can read them
+before or without agreeing. Peers tell control frames apart by their flags.
+The SYN's sequence number is random and echoed by the SYN|ACK, so a receiver
+server can tell a sender that started over on the same connection ID from a
+repeated SYN.
+
+    window        uint16   packets the sender may have in flight
+    packet size   uint16   largest payload in bytes, the frame size less packet.HEADER_SIZE
+    features      uint8    combination of the feature flags below
+    name length   uint8    length of the checksum name
+    checksum      bytes    name of the checksum, as in checksums.CHECKSUMS
+    ranges                 SYN|ACK of a RESUME session only, at most MAX_RANGES of
+        offset    uint64   first byte of a range the receiver is missing
+        length    uint64   its length, TO_END for everything from the offset on
+
+Once every packet is acknowledged the sender sends FIN carrying the final
+sequence number and, as payload, how long the receiver should linger. The
+receiver only accepts a FIN once it holds everything below that sequence
+number, answers FIN|ACK and, like TCP's TIME_WAIT, keeps answering repeated
+FINs until the linger time passes without one. The sender retries its SYN and
+its FIN a bounded number of times, so neither end can hang on a lost frame.
+
+A receiver that cannot go on with a session, for instance because the stream
+does not decompress, answers ABORT instead: a FIN|NAK sealed like the other
+control frames, repeated for every frame it hears while it lingers. The
+sender gives up the transfer as soon as it reads one.
+"""
+
+import struct
+
+import checksums
+import packet
+
+CONTROL_CHECKSUM = checksums.DEFAULT_CHECKSUM
+
+SYN_OPTIONS = struct.Struct(">HHBB")
+RANGE = struct.Struct(">QQ")
+# range length meaning "up to the end of the input"
+TO_END = 2 ** 64 - 1
+# keeps a SYN|ACK within the smallest frame an endpoint receives before agreeing
+MAX_RANGES = 48
+
+# region Features
+
+# the data stream is framed by compress.CompressingReader
+COMPRESSED = 0x01
+# the sender sends only the ranges listed in the SYN|ACK, see checkpoint
+RESUME = 0x02
+# parity packets follow the data, see fec; only then does the receiver keep payloads for repairs
+PARITY = 0x04
+# endregion Features
+
+SUPPORTED_FEATURES = COMPRESSED | RESUME | PARITY
+# flags of the frame that ends a session from the receiver's side
+ABORT = packet.FIN | packet.NAK
+# linger time carried by FIN, in milliseconds
+FIN_OPTIONS = struct.Struct(">I")
+
+
+def control_codec(connection_id=0):
+    """
+    :param connection_id: connection ID written into every frame
+    :return: PacketCodec for SYN, FIN and their acknowledgements
+    """
+    return packet.PacketCodec(checksums.new_checksum(CONTROL_CHECKSUM), connection_id=connection_id)
+
+
+def encode_options(window, packet_size, checksum_name, features=0, ranges=()):
+    """
+    :param window: window in packets
+    :param packet_size: data payload size in bytes
+    :param checksum_name: name of the checksum
+    :param features: feature flags
+    :param ranges: (offset, length) pairs for a SYN|ACK with RESUME, a length of None for "to the end"
+    :return: SYN or SYN|ACK payload
+    """
+    return (SYN_OPTIONS.pack(window, packet_size, features, len(checksum_name)) + checksum_name +
+            b"".join(RANGE.pack(offset, TO_END if length is None else length) for offset, length in ranges))
+
+
+def decode_options(payload):
+    """
+    :param payload: SYN or SYN|ACK payload
+    :return: (window, packet size, checksum name, features), or None if the payload is malformed
+    """
+    if len(payload) < SYN_OPTIONS.size:
+        return None
+    window, packet_size, features, name_length = SYN_OPTIONS.unpack_from(payload)
+    if len(payload) < SYN_OPTIONS.size + name_length:
+        return None
+    return window, packet_size, str(payload[SYN_OPTIONS.size:SYN_OPTIONS.size + name_length]), features
+
+
+def decode_ranges(payload):
+    """
+    :param payload: SYN|ACK payload that decode_options accepted
+    :return: list of (offset, length) pairs following the options, a length of None for "to the end"
+    """
+    start = SYN_OPTIONS.size + SYN_OPTIONS.unpack_from(payload)[3]
+    ranges = []
+    for position in xrange(start, len(payload) - RANGE.size + 1, RANGE.size):
+        offset, length = RANGE.unpack_from(payload, position)
+        ranges.append((offset, None if length == TO_END else length))
+    return ranges
+
+
+def negotiate(offer, window, packet_size, checksum_name, features=SUPPORTED_FEATURES):
+    """
+    Settle the session parameters on the receiver
+    :param offer: (window, packet size, checksum name, features) from the SYN
+    :param window: largest window the receiver can buffer
+    :param packet_size: largest payload the receiver accepts
+    :param checksum_name: checksum used when the offered one is unknown
+    :param features: features the receiver supports
+    :return: agreed (window, packet size, checksum name, features)
+    """
+    offered_window, offered_size, offered_checksum, offered_features = offer
+    if offered_checksum in checksums.CHECKSUMS:
+        checksum_name = offered_checksum
+    return (min(window, offered_window), min(packet_size, offered_size), checksum_name,
+            offered_features & features)
+
+
+def encode_linger(seconds):
+    return FIN_OPTIONS.pack(int(seconds * 1000))
+
+
+def decode_linger(payload, default):
+    """
+    :param payload: FIN payload
+    :param default: linger time for a malformed payload, in seconds
+    :return: linger time in seconds
+    """
+    if len(payload) < FIN_OPTIONS.size:
+        return default
+    return FIN_OPTIONS.unpack_from(payload)[0] / 1000.0
@@ -0,0 +1,194 @@
+"""
+Low-overhead instrumentation for mySender and myReceiver.
+
+Counters stay plain integer attributes of the endpoints and end up in their
+stats. Distributions go into Histogram, which keeps one counter per power-of-two
+bucket so recording a value is a bit_length and an array increment. Per-packet
+events optionally go into PacketTrace, a fixed-size ring of flat arrays that is
+overwritten oldest first and only serialized when the endpoint exits, so tracing
+neither allocates nor formats anything on the hot path.
+
+Run as a script to turn a dumped trace into a timeline:
+
+Usage: python instrument.py TRACE [--interval 0.1]
+"""
+
+import argparse
+import struct
+from array import array
+
+# region Events
+
+SEND = 1
+RETRANSMIT = 2
+ACKED = 3
+RECEIVE = 4
+CORRUPT = 5
+DUPLICATE = 6
+OUT_OF_ORDER = 7
+ACK_SENT = 8
+EVENTS = {SEND: "send", RETRANSMIT: "retransmit", ACKED: "acked", RECEIVE: "receive", CORRUPT: "corrupt",
+          DUPLICATE: "duplicate", OUT_OF_ORDER: "out_of_order", ACK_SENT: "ack_sent"}
+# endregion Events
+
+# magic, records, records overwritten, start time; the record arrays follow in native byte order
+TRACE_HEADER = struct.Struct(">4sIQd")
+TRACE_MAGIC = b"PKTT"
+
+
+class Histogram(object):
+    """
+    Counts values in power-of-two buckets of a unit: bucket i holds values below 2**i units
+    """
+
+    BUCKETS = 48
+
+    def __init__(self, unit=1.0):
+        """
+        :param unit: value of the smallest bucket, e.g. 1e-4 for RTTs in seconds
+        """
+        self.unit = unit
+        self.buckets = array("L", [0]) * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        """
+        :param value: non-negative sample
+        """
+        self.buckets[min(self.BUCKETS - 1, int(value / self.unit).bit_length())] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """
+        :param fraction: between 0 and 1
+        :return: upper bound of the bucket holding that fraction of the samples, 0 without samples
+        """
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(self.max, (1 << i) * self.unit)
+        return 0.0
+
+    def summary(self):
+        """
+        :return: dict of count, mean, max and percentiles, JSON serializable
+        """
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+        }
+
+
+class PacketTrace(object):
+    """
+    Ring of the most recent (time, event, sequence number, value) records
+    """
+
+    CAPACITY = 2 ** 18
+
+    def __init__(self, start, capacity=CAPACITY):
+        """
+        :param start: time the trace starts, record times are kept relative to it
+        :param capacity: records kept before the oldest ones are overwritten
+        """
+        self.start = start
+        self.capacity = capacity
+        self.times = array("d", [0.0]) * capacity
+        self.seqs = array("I", [0]) * capacity
+        self.values = array("I", [0]) * capacity
+        self.events = bytearray(capacity)
+        # records ever made; the next one goes to slot recorded % capacity
+        self.recorded = 0
+
+    def record(self, now, event, seq, value=0):
+        """
+        :param now: time of the event, in seconds
+        :param event: one of EVENTS
+        :param seq: sequence number concerned, the cumulative point for ACK_SENT
+        :param value: window for SEND and RETRANSMIT, packets in flight for ACKED, frame or payload length otherwise
+        """
+        index = self.recorded % self.capacity
+        self.times[index] = now - self.start
+        self.events[index] = event
+        self.seqs[index] = seq
+        self.values[index] = value
+        self.recorded += 1
+
+    def dump(self, path):
+        """
+        Write the records still in the ring, oldest first
+        :param path: output file
+        """
+        count = min(self.recorded, self.capacity)
+        head = self.recorded % self.capacity if self.recorded > self.capacity else 0
+        with open(path, "wb") as f:
+            f.write(TRACE_HEADER.pack(TRACE_MAGIC, count, self.recorded - count, self.start))
+            for column in (self.times, self.seqs, self.values):
+                column[head:count].tofile(f)
+                column[:head].tofile(f)
+            f.write(self.events[head:count])
+            f.write(self.events[:head])
+
+
+def load_trace(path):
+    """
+    Read a trace written by PacketTrace.dump on this machine
+    :param path: trace file
+    :return: (start time, records overwritten, list of (time, event, seq, value) records)
+    """
+    with open(path, "rb") as f:
+        magic, count, overwritten, start = TRACE_HEADER.unpack(f.read(TRACE_HEADER.size))
+        if magic != TRACE_MAGIC:
+            raise ValueError("{} is not a packet trace".format(path))
+        columns = []
+        for typecode in "dII":
+            column = array(typecode)
+            column.fromfile(f, count)
+            columns.append(column)
+        events = bytearray(f.read(count))
+    times, seqs, values = columns
+    return start, overwritten, zip(times, events, seqs, values)
+
+
+def timeline(records, interval):
+    """
+    Count events per interval
+    :param records: (time, event, seq, value) records in time order
+    :param interval: bucket width, in seconds
+    :return: list of (interval start, {event: count}, highest sequence number seen) rows, empty intervals left out
+    """
+    rows = []
+    for when, event, seq, _ in records:
+        start = int(when / interval) * interval
+        if not rows or rows[-1][0] != start:
+            rows.append((start, {}, seq))
+        counts = rows[-1][1]
+        counts[event] = counts.get(event, 0) + 1
+        if seq > rows[-1][2]:
+            rows[-1] = (start, counts, seq)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a packet trace written with --trace")
+    parser.add_argument("trace", help="trace file")
+    parser.add_argument("--interval", type=float, default=0.1, help="timeline resolution, in seconds")
+    args = parser.parse_args()
+
+    start, overwritten, records = load_trace(args.trace)
+    present = sorted(set(event for _, event, _, _ in records))
+    print("{} records, {} older ones overwritten".format(len(records), overwritten))
+    print("\t".join(["time"] + [EVENTS.get(event, str(event)) for event in present] + ["highest_seq"]))
+    for when, counts, seq in timeline(records, args.interval):
+        print("\t".join(["{:.3f}".format(when)] + [str(counts.get(event, 0)) for event in present] + [str(seq)]))
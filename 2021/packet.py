@@ -0,0 +1,144 @@
+"""
+Binary packet codec shared by mySender and myReceiver.
+
+Every datagram is a fixed header followed by the payload:
+
+    checksum    uint32   covers everything after this field
+    connection  uint16   session the frame belongs to, the sender's ACK port
+    sequence    uint16   data: packet number, ACK: acknowledged packet number,
+                         both modulo 2**16
+    flags       uint8    combination of ACK, NAK, FIN, SACK, PARITY, SYN
+
+Frames are not padded and the channel keeps datagram boundaries, so the
+payload is whatever follows the header. Sequence numbers are unwrapped against
+a reference the reader knows, the receiver's cumulative point or the sender's
+lowest unacknowledged packet, which is never more than a window away; windows
+must stay below 2**15 packets. The connection ID lets one receiver server
+tell concurrent sessions apart on a single port; receivers echo the ID of the
+SYN in every reply.
+
+A datagram fits in one ChannelSimulator frame: BUFFER_SIZE bytes by default,
+up to MAX_FRAME_SIZE once both ends agree on a larger frame size.
+"""
+
+import struct
+
+from channelsimulator import ChannelSimulator
+
+HEADER = struct.Struct(">IHHB")
+HEADER_SIZE = HEADER.size
+# the checksum field itself is not covered by the checksum
+_BODY = struct.Struct(">HHB")
+_CHECKSUM = struct.Struct(">I")
+_CONNECTION = struct.Struct(">H")
+_FLAGS = struct.Struct(">B")
+
+SEQ_MODULUS = 1 << 16
+SEQ_MASK = SEQ_MODULUS - 1
+_HALF = SEQ_MODULUS >> 1
+
+# payload of a default-sized frame
+MAX_PAYLOAD = ChannelSimulator.BUFFER_SIZE - HEADER_SIZE
+# largest UDP datagram over IPv4
+MAX_FRAME_SIZE = 65507
+
+# region Flags
+
+ACK = 0x01
+NAK = 0x02
+FIN = 0x04
+SACK = 0x08
+# forward error correction parity, see fec.py
+PARITY = 0x10
+# connection setup, see handshake.py
+SYN = 0x20
+# SYN and FIN frames and their acknowledgements are sealed with the control checksum
+CONTROL = SYN | FIN
+# endregion Flags
+
+
+def peek_flags(frame):
+    """
+    Read the flags of a frame before it is verified, to pick the codec that can verify it
+    :param frame: received byte array
+    :return: flags as claimed by the header, 0 for a truncated frame
+    """
+    return _FLAGS.unpack_from(frame, HEADER_SIZE - _FLAGS.size)[0] if len(frame) >= HEADER_SIZE else 0
+
+
+def peek_connection(frame):
+    """
+    Read the connection ID of a frame before it is verified, to find the session that can verify it
+    :param frame: received byte array
+    :return: connection ID as claimed by the header, None for a truncated frame
+    """
+    return _CONNECTION.unpack_from(frame, _CHECKSUM.size)[0] if len(frame) >= HEADER_SIZE else None
+
+
+def unwrap(seq, reference):
+    """
+    :param seq: sequence number modulo SEQ_MODULUS, as carried in the header
+    :param reference: full sequence number within half the modulus of the packet
+    :return: full sequence number
+    """
+    return reference + ((seq - reference + _HALF) & SEQ_MASK) - _HALF
+
+
+class PacketCodec(object):
+
+    def __init__(self, checksum, max_payload=MAX_PAYLOAD, connection_id=0):
+        """
+        Create a codec
+        :param checksum: checksums.Checksum used to seal and verify frames
+        :param max_payload: largest payload accepted by encode
+        :param connection_id: connection ID written into every frame
+        """
+        self.checksum = checksum
+        self.max_payload = max_payload
+        self.connection_id = connection_id
+
+    def encode_into(self, frame, seq, flags=0, payload=b"", offset=0):
+        """
+        Write a packet into a preallocated buffer
+        :param frame: writable buffer (bytearray) of at least offset + HEADER_SIZE + len(payload) bytes
+        :param seq: sequence number
+        :param flags: packet flags
+        :param payload: payload bytes
+        :param offset: position of the packet in frame
+        :return: number of bytes written
+        """
+        length = len(payload)
+        if length > self.max_payload:
+            raise ValueError("Payload of {} bytes exceeds {} bytes".format(length, self.max_payload))
+        end = offset + HEADER_SIZE + length
+        _BODY.pack_into(frame, offset + _CHECKSUM.size, self.connection_id, seq & SEQ_MASK, flags)
+        frame[offset + HEADER_SIZE:end] = payload
+        _CHECKSUM.pack_into(frame, offset, self.checksum.compute(buffer(frame, offset + _CHECKSUM.size, end - offset - _CHECKSUM.size)))
+        return end - offset
+
+    def encode(self, seq, flags=0, payload=b""):
+        """
+        Build a packet in a new buffer sized exactly for it
+        :param seq: sequence number
+        :param flags: packet flags
+        :param payload: payload bytes
+        :return: datagram byte array
+        """
+        frame = bytearray(HEADER_SIZE + len(payload))
+        self.encode_into(frame, seq, flags, payload)
+        return frame
+
+    def decode(self, frame, reference=0):
+        """
+        Parse and verify a received datagram
+        :param frame: received byte array
+        :param reference: full sequence number the packet's is unwrapped against
+        :return: (sequence number, flags, payload) with payload a zero-copy view into frame, or None if the frame is
+            truncated or fails its checksum
+        """
+        if len(frame) < HEADER_SIZE:
+            return None
+        checksum, _, seq, flags = HEADER.unpack_from(frame)
+        if not self.checksum.verify(checksum, buffer(frame, _CHECKSUM.size)):
+            return None
+        return unwrap(seq, reference), flags, buffer(frame, HEADER_SIZE)
@@ -0,0 +1,234 @@
+"""
+Packet sources for mySender.
+
+Data packet seq carries bytes seq * size to (seq + 1) * size of the input, and
+the final packet is short, or empty when the input length is a multiple of the
+packet size, to mark the end of the data. A source hands out the datagram of
+any packet that is not yet acknowledged, for first transmissions and
+retransmissions alike.
+
+PacketTable serves a regular file through mmap: datagrams are assembled on
+demand from zero-copy slices of the mapping, and the only per-packet state is
+an array('I') of frame checksums, filled on first transmission so that
+retransmissions skip the checksum. The file is mapped in segments that are
+unmapped once every packet in them is acknowledged, so resident memory stays
+flat however large the file is. StreamPackets reads pipes and other
+unseekable inputs block by block and holds the datagrams of unacknowledged
+packets until they are released.
+"""
+
+import mmap
+import os
+import stat
+from array import array
+
+import packet
+
+
+def map_input(stream):
+    """
+    Make a whole input randomly accessible without reading it when possible
+    :param stream: file object, usually stdin
+    :return: MappedFile of a non-empty regular file, or None
+    """
+    try:
+        fd = stream.fileno()
+    except (AttributeError, IOError, ValueError):
+        return None
+    info = os.fstat(fd)
+    if stat.S_ISREG(info.st_mode) and info.st_size > 0:
+        return MappedFile(fd, info.st_size)
+    return None
+
+
+def open_source(codec, stream, packet_size=packet.MAX_PAYLOAD, block_packets=64):
+    """
+    Pick the packet source for an input stream
+    :param codec: packet.PacketCodec used to seal datagrams
+    :param stream: file object opened for binary reading
+    :param packet_size: payload bytes per packet
+    :param block_packets: packets read per block from unmappable streams
+    :return: PacketTable for regular files, StreamPackets otherwise
+    """
+    data = map_input(stream)
+    if data is not None:
+        return PacketTable(codec, data, packet_size=packet_size)
+    return StreamPackets(codec, stream, packet_size, block_packets)
+
+
+class MappedFile(object):
+
+    # a multiple of mmap.ALLOCATIONGRANULARITY
+    SEGMENT_SIZE = 1 << 22
+    # segments overlap by this much so that no view smaller than it straddles two
+    OVERLAP = 1 << 16
+
+    def __init__(self, fd, size):
+        """
+        Map a file lazily, one segment at a time
+        :param fd: file descriptor of a regular file
+        :param size: file size in bytes
+        """
+        self.fd = fd
+        self.size = size
+        # segment number -> mmap
+        self.segments = {}
+
+    def __len__(self):
+        return self.size
+
+    def view(self, offset, size):
+        """
+        :param offset: first byte
+        :param size: number of bytes, at most OVERLAP
+        :return: zero-copy buffer of the bytes
+        """
+        index = offset // self.SEGMENT_SIZE
+        segment = self.segments.get(index)
+        if segment is None:
+            start = index * self.SEGMENT_SIZE
+            segment = mmap.mmap(self.fd, min(self.SEGMENT_SIZE + self.OVERLAP, self.size - start),
+                                access=mmap.ACCESS_READ, offset=start)
+            self.segments[index] = segment
+        return buffer(segment, offset - index * self.SEGMENT_SIZE, size)
+
+    def release_below(self, offset):
+        """
+        Unmap every segment that only serves bytes below offset
+        :param offset: lowest byte still needed
+        """
+        for index in [index for index in self.segments if (index + 1) * self.SEGMENT_SIZE <= offset]:
+            self.segments.pop(index).close()
+
+
+class PacketTable(object):
+
+    def __init__(self, codec, data, offset=0, length=None, packet_size=packet.MAX_PAYLOAD):
+        """
+        Index a randomly accessible input
+        :param codec: packet.PacketCodec used to seal datagrams
+        :param data: MappedFile, str or anything else buffer() accepts
+        :param offset: first byte to send
+        :param length: number of bytes to send, by default up to the end of data
+        :param packet_size: payload bytes per packet
+        """
+        self.codec = codec
+        self.data = data
+        self.offset = offset
+        self.length = len(data) - offset if length is None else length
+        self.packet_size = packet_size
+        # every full packet plus the final short or empty one
+        self.count = self.length // packet_size + 1
+        self.checksums = array("I", [0]) * self.count
+        self.sealed = bytearray(self.count)
+        self.mapped = isinstance(data, MappedFile)
+
+    def datagram(self, seq):
+        """
+        :param seq: sequence number
+        :return: new datagram byte array, or None past the end of the input
+        """
+        if seq >= self.count:
+            return None
+        start = seq * self.packet_size
+        size = min(self.packet_size, self.length - start)
+        if self.mapped:
+            payload = self.data.view(self.offset + start, size)
+        else:
+            payload = buffer(self.data, self.offset + start, size)
+        frame = bytearray(packet.HEADER_SIZE + size)
+        if self.sealed[seq]:
+            packet.HEADER.pack_into(frame, 0, self.checksums[seq], self.codec.connection_id, seq & packet.SEQ_MASK, 0)
+            frame[packet.HEADER_SIZE:] = payload
+        else:
+            self.codec.encode_into(frame, seq, 0, payload)
+            self.checksums[seq] = packet.HEADER.unpack_from(frame)[0]
+            self.sealed[seq] = 1
+        return frame
+
+    def release_below(self, seq):
+        """
+        Drop what is only needed by acknowledged packets
+        :param seq: every packet below this is acknowledged
+        """
+        if self.mapped:
+            self.data.release_below(self.offset + seq * self.packet_size)
+
+
+class RangeReader(object):
+
+    def __init__(self, data, offset, length):
+        """
+        File-like view of a range of an input, for stages that consume streams
+        :param data: MappedFile, str or anything else buffer() accepts
+        :param offset: first byte of the range
+        :param length: length of the range
+        """
+        self.data = data
+        self.position = offset
+        self.end = offset + length
+
+    def read(self, size):
+        """
+        :param size: most bytes to return, at most MappedFile.OVERLAP for mapped files
+        :return: bytes, empty at the end of the range
+        """
+        size = min(size, self.end - self.position)
+        if isinstance(self.data, MappedFile):
+            chunk = str(self.data.view(self.position, size))
+        else:
+            chunk = self.data[self.position:self.position + size]
+        self.position += size
+        return chunk
+
+
+class StreamPackets(object):
+
+    def __init__(self, codec, stream, packet_size=packet.MAX_PAYLOAD, block_packets=64):
+        """
+        Packetize a stream as it is read
+        :param codec: packet.PacketCodec used to seal datagrams
+        :param stream: file object opened for binary reading
+        :param packet_size: payload bytes per packet
+        :param block_packets: packets read per block
+        """
+        self.codec = codec
+        self.stream = stream
+        self.packet_size = packet_size
+        self.block_size = packet_size * block_packets
+        # sequence number -> datagram, for every packet read but not released
+        self.held = {}
+        self.released = 0
+        self.produced = 0
+        self.exhausted = False
+
+    def datagram(self, seq):
+        """
+        :param seq: sequence number, at most one past the last packet handed out
+        :return: datagram byte array, or None past the end of the input
+        """
+        while seq >= self.produced and not self.exhausted:
+            self._read_block()
+        return self.held.get(seq)
+
+    def release_below(self, seq):
+        """
+        Forget acknowledged packets
+        :param seq: every packet below this is acknowledged
+        """
+        for released in xrange(self.released, seq):
+            self.held.pop(released, None)
+        self.released = max(self.released, seq)
+
+    def _read_block(self):
+        block = self.stream.read(self.block_size)
+        for lower in xrange(0, len(block), self.packet_size):
+            self.held[self.produced] = self.codec.encode(self.produced, 0, buffer(block, lower, self.packet_size))
+            self.produced += 1
+        # a short block means the stream is exhausted; a final partial packet
+        # (possibly empty) marks the end of data
+        if len(block) < self.block_size:
+            if len(block) % self.packet_size == 0:
+                self.held[self.produced] = self.codec.encode(self.produced)
+                self.produced += 1
+            self.exhausted = True
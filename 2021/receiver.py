@@ -1,25 +1,43 @@
 # Written by S. Mevawala, modified by D. Gitzel
 
+import argparse
+import json
 import logging
-
-import string
-import struct
-import zlib
+import os
+import signal
 
 import channelsimulator
+import checkpoint
+import checksums
+import compress
+import eventloop
+import fec
+import handshake
+import instrument
+import packet
+import reorder
+import sack
+import scenario
+import stripe
 import utils
 import sys
 import socket
+import time
 
 class Receiver(object):
 
-    def __init__(self, inbound_port=50005, outbound_port=50006, timeout=10, debug_level=logging.INFO):
+    def __init__(self, inbound_port=50005, outbound_port=50006, timeout=10, debug_level=logging.INFO,
+                 simulator=None, **channel_options):
         self.logger = utils.Logger(self.__class__.__name__, debug_level)
 
         self.inbound_port = inbound_port
         self.outbound_port = outbound_port
+        if simulator is not None:
+            # a session of a ReceiverServer, which receives for it and hands over a channel that only sends
+            self.simulator = simulator
+            return
         self.simulator = channelsimulator.ChannelSimulator(inbound_port=inbound_port, outbound_port=outbound_port,
-                                                           debug_level=debug_level)
+                                                           debug_level=debug_level, **channel_options)
         self.simulator.rcvr_setup(timeout)
         self.simulator.sndr_setup(timeout)
 
@@ -30,8 +48,8 @@ class Receiver(object):
 class BogoReceiver(Receiver):
     ACK_DATA = bytes(123)
 
-    def __init__(self):
-        super(BogoReceiver, self).__init__()
+    def __init__(self, **kwargs):
+        super(BogoReceiver, self).__init__(**kwargs)
 
     def receive(self):
         self.logger.info("Receiving on port: {} and replying with ACK on port: {}".format(self.inbound_port, self.outbound_port))
@@ -47,86 +65,695 @@ class BogoReceiver(Receiver):
 
 class myReceiver(BogoReceiver):
 
-    def __init__(self,timeout=0.05):
-        super(myReceiver,self).__init__()
-        self.simulator.sndr_setup(timeout)
-        self.simulator.rcvr_setup(timeout)
+    # large enough to absorb a full sender window of 1 KB frames
+    RCVBUF=2**22
+    # must be at least mySender.WINDOW_SIZE; frames beyond it are dropped unacknowledged
+    WINDOW_SIZE=2**11
+    # most frames handled per wakeup
+    MAX_BATCH=256
+    # never block for less than this, a zero timeout would make the socket non-blocking
+    MIN_SOCKET_TIMEOUT=0.001
+    # TIME_WAIT after FIN|ACK when the FIN does not say how long, in seconds
+    LINGER=0.5
+    # one ACK per this many in-order packets, and no arrival waits longer than ACK_DELAY seconds for one
+    ACK_EVERY=2
+    ACK_DELAY=0.005
+
+    def __init__(self,timeout=1.0,checksum_name=checksums.DEFAULT_CHECKSUM,rcvbuf=RCVBUF,output=None,event_loop=False,
+                 ack_every=ACK_EVERY,ack_delay=ACK_DELAY,trace_path=None,max_frame_size=packet.MAX_FRAME_SIZE,checkpoint_path=None,simulator=None,**kwargs):
+        super(myReceiver,self).__init__(simulator=simulator,**kwargs)
+        self.output=output if output is not None else sys.stdout
+        # in-order data goes through a decompressor when the session agreed on compression
+        self.sink=self.output
+        # with a checkpoint the output goes to its file instead, and a resuming sender only sends what it lacks
+        self.checkpoint=checkpoint.Checkpoint(checkpoint_path) if checkpoint_path else None
+        # wait for frames on the select-based event loop instead of blocking reads
+        self.event_loop=event_loop
+        self.frames_received=0
+        self.duplicates=0
+        self.bytes_delivered=0
+        self.frames_recovered=0
+        # new packets that arrived beyond a hole
+        self.out_of_order=0
+        self.acks_sent=0
+        self.ack_every=ack_every
+        self.ack_delay=ack_delay
+        # per-packet events, written to trace_path by dump_trace
+        self.trace_path=trace_path
+        self.trace=instrument.PacketTrace(time.time()) if trace_path else None
+        # largest frame size agreed to, the receive buffers grow to it once agreed
+        self.max_frame_size=max_frame_size
+        # echoed in every reply, taken from the sender's SYN
+        self.connection_id=0
+        # used unless the sender offers another checksum this receiver implements
+        self.checksum_name=checksum_name
+        self.use_checksum(checksum_name)
+        # SYN and FIN exchanges always use the control checksum
+        self.control_codec=handshake.control_codec()
+        # one preallocated frame serves every reply
+        self.ack_frame=bytearray(channelsimulator.ChannelSimulator.BUFFER_SIZE)
+        # bounds idle waits; the only timers are the delayed ACK and the TIME_WAIT linger
+        self.idle_timeout=timeout
+        if simulator is None:
+            self.simulator.sndr_setup(timeout)
+            self.simulator.rcvr_setup(timeout,rcvbuf)
 
     def receive(self):
-        self.logger.info("Receiving on port: {} and replying with ACK on port: {}".format(self.inbound_port, self.outbound_port))
-
-        lower=0
-        termination=False
-
-        received_packets={}
-
-        while not termination:
-            try:
-                received_packet=self.simulator.u_receive()
-
-                # first check if it is "1011111" -> termination message
-                if received_packet[0] & (~received_packet[1] & 0xFF) & received_packet[2] & received_packet[3] & received_packet[4] & received_packet[5] & received_packet[6] == 255:
-                    self.logger.info("TERMINATION")
-                    # send back "1011111" termination message and terminate
-                    self.simulator.u_send(bytearray([255, 0] + [255]*5))
-                    termination = True
-                    break
-                    
-                
-                received_seq_num_bin=received_packet[0:4]
-                received_data_len_bin=received_packet[4:8]
-                received_checksum_bin=received_packet[8:12]
-                received_data=received_packet[12:]
-
-                received_seq_num_int=struct.unpack(">i",received_seq_num_bin)[0]
-
-                self.logger.info("RECEIVED: {}".format(received_seq_num_int))
-
-                received_seq_num_bin_str=bin(received_seq_num_int)[2:].zfill(32)
-
-                checksum_bin_str=format(self.checksum(received_seq_num_bin_str,received_data),'b').zfill(32)
-                checksum_bin=bytearray(int(checksum_bin_str[i:i+8],2) for i in range(0,32,8))
-
-                # received_data_len_int=struct.unpack(">i",received_data_len_bin)[0]
-                # self.logger.info("Length: {}".format(received_data_len_int))
-
-                # compare received checksum vs. checksum calculated from received packet
-                if received_checksum_bin==checksum_bin:
-                    self.logger.info("UNCORRUPTED")
-                    received_packets[received_seq_num_int]=received_data[:struct.unpack(">i",received_data_len_bin)[0]]
-                    # sys.stderr.write(received_data_len_int)
-
-                    ones = 1111
-                    return_msg = received_seq_num_bin + struct.pack(">i",ones)
-                    self.simulator.u_send(return_msg)
-                    self.logger.info("Replying ACK {}".format(received_seq_num_int))
-
+        self.logger.info("Receiving on port: {} and replying with ACK on port: {}",self.inbound_port,self.outbound_port)
+
+        protocol=ReceiverProtocol(self)
+        if self.event_loop:
+            loop=eventloop.EventLoop()
+            transport=eventloop.ChannelTransport(loop,self.simulator,protocol)
+            loop.run_forever()
+            transport.close()
+        else:
+            while not protocol.closed(time.time()):
+                try:
+                    frames=self.simulator.u_receive_many(self.MAX_BATCH,protocol.wait_time(time.time()))
+                except socket.timeout as timeoutException:
+                    replies=protocol.delayed_ack(time.time())
+                    if not replies:
+                        self.logger.debug(str(timeoutException))
+                    self.simulator.u_send_many(replies)
+                    continue
+                self.simulator.u_send_many(protocol.handle(frames))
+
+        if isinstance(self.sink,compress.Decoder) and self.sink.incomplete:
+            self.logger.info("Stream ended inside a compressed frame")
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+        self.logger.info("Checksum {} accepted {} and rejected {} frames",self.checksum.NAME,self.checksum.passed,self.checksum.failed)
+        sys.exit(1 if protocol.failed else 0)
+
+    def use_checksum(self,checksum_name):
+        """
+        Switch data and ACK frames to a checksum
+        :param checksum_name: name from checksums.CHECKSUMS
+        """
+        self.checksum=checksums.new_checksum(checksum_name)
+        self.codec=packet.PacketCodec(self.checksum,connection_id=self.connection_id)
+
+    def stats(self):
+        """
+        :return: dict of transfer statistics
+        """
+        return {
+            "frames_received": self.frames_received,
+            "frames_corrupted": self.checksum.failed,
+            "duplicates": self.duplicates,
+            "frames_recovered": self.frames_recovered,
+            "out_of_order": self.out_of_order,
+            "acks_sent": self.acks_sent,
+            "bytes_delivered": self.bytes_delivered,
+            "bytes_resumed": self.checkpoint.verified if self.checkpoint is not None else 0,
+        }
+
+    def dump_trace(self):
+        """
+        Write the packet trace, if tracing
+        """
+        if self.trace is not None:
+            self.trace.dump(self.trace_path)
+
+
+class ReceiverProtocol(eventloop.DatagramProtocol):
+    """
+    Receiver state machine, driven by the blocking loop in myReceiver.receive or by the event loop
+    """
+
+    def __init__(self,receiver):
+        """
+        :param receiver: myReceiver providing the codec, output and counters
+        """
+        self.receiver=receiver
+        self.logger=receiver.logger
+        self.tracker=sack.ReceiveTracker()
+        self.reorder_buffer=reorder.ReorderBuffer(receiver.WINDOW_SIZE)
+        # fec.ParityDecoder rebuilding lost packets, None unless parity was agreed
+        self.decoder=None
+        self.ack_scheduler=sack.AckScheduler(receiver.ack_every,receiver.ack_delay)
+        # agreed (window, packet size, checksum name, features), once a SYN arrived
+        self.agreed=None
+        # ranges a resuming sender was asked for, and the checkpoint.RangeWriter placing them
+        self.ranges=()
+        self.writer=None
+        self.terminated=False
+        # why the session was cut short, None while it is healthy
+        self.failed=None
+        # end of the TIME_WAIT linger, pushed back by every repeated FIN
+        self.linger_until=None
+        self.transport=None
+        self.linger_timer=None
+        self.ack_timer=None
+
+    def closed(self,now):
+        """
+        :param now: current time, in seconds
+        :return: True once the session terminated and lingered
+        """
+        return self.terminated and now >= self.linger_until
+
+    def wait_time(self,now):
+        """
+        :param now: current time, in seconds
+        :return: how long the blocking loop may wait for the next frame, in seconds
+        """
+        deadline=self.linger_until if self.terminated else self.ack_scheduler.deadline
+        if deadline is None:
+            return self.receiver.idle_timeout
+        # a zero timeout would make the socket non-blocking
+        return max(self.receiver.MIN_SOCKET_TIMEOUT,deadline-now)
+
+    def acknowledge(self,replies,now):
+        """
+        Append one cumulative ACK plus a bitmap of everything received beyond it, covering every arrival so far
+        :param replies: list the ACK frame is appended to
+        :param now: current time, in seconds
+        """
+        receiver=self.receiver
+        tracker=self.tracker
+        size=receiver.codec.encode_into(receiver.ack_frame,tracker.expected,packet.ACK | packet.SACK,tracker.bitmap())
+        replies.append(receiver.ack_frame[:size])
+        receiver.acks_sent+=1
+        if receiver.trace is not None:
+            receiver.trace.record(now,instrument.ACK_SENT,tracker.expected,size)
+        self.ack_scheduler.sent()
+
+    def delayed_ack(self,now):
+        """
+        :param now: current time, in seconds
+        :return: list holding the ACK whose delay ran out, empty if none is due
+        """
+        replies=[]
+        if self.ack_scheduler.due(now):
+            self.acknowledge(replies,now)
+        return replies
+
+    def handle(self,frames):
+        """
+        Process a batch of frames and deliver what became contiguous
+        :param frames: received frames
+        :return: list of reply frames
+        """
+        receiver=self.receiver
+        tracker=self.tracker
+        reorder_buffer=self.reorder_buffer
+        scheduler=self.ack_scheduler
+        trace=receiver.trace
+        now=time.time()
+        replies=[]
+        ready=[]
+        receiver.frames_received+=len(frames)
+        for received_packet in frames:
+            if packet.peek_flags(received_packet) & packet.CONTROL:
+                self.handle_control(received_packet,replies)
+                continue
+            if self.agreed is None or self.terminated:
+                # data of a session this receiver has not seen open, or after its end
+                if self.failed is not None and not replies:
+                    replies.append(self.abort_frame())
+                continue
+
+            codec=receiver.codec
+            decoded=codec.decode(received_packet,tracker.expected)
+
+            if decoded is None:
+                # the SACK bitmap already shows the sender the hole, a corrupted frame only hurries the next ACK
+                if trace is not None:
+                    trace.record(now,instrument.CORRUPT,0,len(received_packet))
+                if scheduler.arrived(now,False):
+                    self.acknowledge(replies,now)
+                continue
+
+            received_seq_num_int,flags,received_data=decoded
+
+            if flags & packet.PARITY:
+                if self.decoder is None:
+                    continue
+                arrivals=self.decoder.add_parity(received_seq_num_int,received_data)
+                receiver.frames_recovered+=len(arrivals)
+                if not arrivals:
+                    continue
+            else:
+                arrivals=[(received_seq_num_int,received_data)]
+
+            # packets filling a hole or landing beyond one are acknowledged without delay
+            in_order=not tracker.mask
+            while arrivals:
+                received_seq_num_int,received_data=arrivals.pop()
+                expected=tracker.expected
+                if reorder_buffer.accepts(received_seq_num_int) and tracker.add(received_seq_num_int):
+                    if received_seq_num_int!=expected:
+                        receiver.out_of_order+=1
+                    if trace is not None:
+                        trace.record(now,instrument.RECEIVE if received_seq_num_int==expected else instrument.OUT_OF_ORDER,
+                                     received_seq_num_int,len(received_data))
+                    # receive buffers are reused by the next batch, so keep a copy of the payload
+                    received_data=str(received_data)
+                    reorder_buffer.put(received_seq_num_int,received_data)
+                    ready.extend(reorder_buffer.pop_ready())
+                    if self.decoder is not None:
+                        # a new packet may complete a parity class waiting for it
+                        recovered=self.decoder.add_data(received_seq_num_int,received_data)
+                        receiver.frames_recovered+=len(recovered)
+                        arrivals.extend(recovered)
                 else:
-                    self.logger.info("CORRUPTED")
-
-                    zeros = 0000
-                    return_msg = received_seq_num_bin + struct.pack(">i",zeros)
-                    self.simulator.u_send(return_msg)
-                    self.logger.info("Replying ACK {}".format(received_seq_num_int))
-            except socket.timeout as timeoutException:
-                self.logger.info(str(timeoutException))
-                pass
-
-        self.logger.info("Writing to file")
-        for key,value in sorted(received_packets.items()):
-            sys.stdout.write(value)
-
-        sys.exit()
-
-
-
-
-    def checksum(self,seq_num_bin_str,data_bin):
-        filled_data = string.join([string.zfill(n, 8) for n in map(lambda s: s[2:], map(bin, data_bin))], '')
-        checksum = zlib.adler32(seq_num_bin_str + filled_data) & 0xffffffff
-        return checksum
+                    receiver.duplicates+=1
+                    if trace is not None:
+                        trace.record(now,instrument.DUPLICATE,received_seq_num_int,len(received_data))
+                    # a duplicate means an earlier ACK was lost
+                    in_order=False
+
+            if scheduler.arrived(now,in_order and not tracker.mask):
+                self.acknowledge(replies,now)
+
+        if scheduler.due(now):
+            self.acknowledge(replies,now)
+        if self.decoder is not None:
+            self.decoder.discard_below(tracker.expected)
+        # hand every contiguous run to the consumer as soon as the batch is processed
+        if ready:
+            ready="".join(ready)
+            receiver.bytes_delivered+=len(ready)
+            try:
+                receiver.sink.write(ready)
+            except compress.DecodeError as e:
+                self.fail("Undecodable compressed stream: {}".format(e))
+                return [self.abort_frame()]
+            receiver.sink.flush()
+        if self.terminated and self.writer is not None:
+            # the FIN ended the stream, which may fix the size of the output
+            self.writer.finish()
+        self.logger.debug("Handled {} frames, replying ACK {}",len(frames),tracker.expected)
+        return replies
+
+    def fail(self,reason):
+        """
+        End the session at once without confirming anything more; frames heard while lingering are answered with
+        ABORT, in case the first one is lost
+        :param reason: message logged
+        """
+        self.logger.info("Session failed: {}",reason)
+        self.failed=reason
+        self.terminated=True
+        self.linger_until=time.time()+self.receiver.LINGER
+
+    def abort_frame(self):
+        """
+        :return: ABORT frame telling the sender the session failed
+        """
+        return self.receiver.control_codec.encode(self.tracker.expected,handshake.ABORT)
+
+    def handle_control(self,frame,replies):
+        """
+        Answer SYN and FIN frames
+        :param frame: received frame with SYN or FIN claimed in its flags
+        :param replies: list the reply frame is appended to
+        """
+        receiver=self.receiver
+        control_codec=receiver.control_codec
+        decoded=control_codec.decode(frame,self.tracker.expected)
+        if decoded is None:
+            return
+        seq,flags,payload=decoded
+
+        if flags & packet.SYN:
+            offer=handshake.decode_options(payload)
+            if offer is None:
+                return
+            if self.agreed is None:
+                receiver.connection_id=packet.peek_connection(frame)
+                receiver.control_codec=control_codec=handshake.control_codec(receiver.connection_id)
+                features=handshake.SUPPORTED_FEATURES
+                if receiver.checkpoint is None:
+                    features&=~handshake.RESUME
+                self.agreed=handshake.negotiate(offer,receiver.WINDOW_SIZE,receiver.max_frame_size-packet.HEADER_SIZE,
+                                                receiver.checksum_name,features)
+                receiver.simulator.set_frame_size(packet.HEADER_SIZE+self.agreed[1])
+                receiver.use_checksum(self.agreed[2])
+                output=receiver.output
+                if receiver.checkpoint is not None:
+                    if self.agreed[3] & handshake.RESUME:
+                        self.ranges=checkpoint.coalesce(receiver.checkpoint.missing(),handshake.MAX_RANGES)
+                        self.logger.info("Resuming: {} bytes intact, asking for {} ranges",receiver.checkpoint.verified,
+                                         len(self.ranges))
+                    else:
+                        # a sender that cannot resume sends everything again
+                        receiver.checkpoint.restart()
+                        self.ranges=[(0,None)]
+                    self.writer=output=receiver.checkpoint.writer(self.ranges)
+                receiver.sink=compress.Decoder(output) if self.agreed[3] & handshake.COMPRESSED else output
+                if self.agreed[3] & handshake.PARITY:
+                    self.decoder=fec.ParityDecoder()
+                self.logger.info("Connected: window {}, packet size {}, checksum {}, features {}",*self.agreed)
+            # repeated SYNs mean the SYN|ACK was lost, answer every one
+            ranges=self.ranges if self.agreed[3] & handshake.RESUME else ()
+            replies.append(control_codec.encode(seq,packet.SYN | packet.ACK,handshake.encode_options(*self.agreed,ranges=ranges)))
+
+        elif flags & packet.FIN:
+            if self.failed is not None:
+                replies.append(self.abort_frame())
+                return
+            # a FIN only ends a session that holds every packet before it; anything else is stale or premature
+            if self.agreed is None or seq != self.tracker.expected:
+                return
+            if not self.terminated:
+                self.logger.info("TERMINATION")
+            self.terminated=True
+            # the sender only closes once everything is acknowledged
+            self.ack_scheduler.sent()
+            # confirm every FIN and keep lingering as long as they come
+            self.linger_until=time.time()+handshake.decode_linger(payload,receiver.LINGER)
+            replies.append(control_codec.encode(seq,packet.FIN | packet.ACK))
+
+    # region Event loop callbacks
+
+    def connection_made(self,transport):
+        self.transport=transport
+
+    def datagrams_received(self,frames):
+        self.transport.sendto_many(self.handle(frames))
+        if self.terminated and self.linger_timer is None:
+            self.linger_timer=self.transport.loop.call_at(self.linger_until,self.linger_expired)
+        self.arm_ack_timer()
+
+    def arm_ack_timer(self):
+        deadline=self.ack_scheduler.deadline
+        if deadline is not None and self.ack_timer is None:
+            self.ack_timer=self.transport.loop.call_at(deadline,self.ack_timer_expired)
+
+    def ack_timer_expired(self):
+        # an ACK sent in between may have moved the deadline, re-arm for the new one
+        self.ack_timer=None
+        self.transport.sendto_many(self.delayed_ack(self.transport.loop.time()))
+        self.arm_ack_timer()
+
+    def linger_expired(self):
+        loop=self.transport.loop
+        if self.closed(loop.time()):
+            loop.stop()
+        else:
+            self.linger_timer=loop.call_at(self.linger_until,self.linger_expired)
+    # endregion Event loop callbacks
+
+
+def receive_stripe(index,results,directory,options):
+    """
+    Receive one range of a striped transfer; run in its own process
+    :param index: stripe number, selects the port pair
+    :param results: queue receiving (index, stats)
+    :param directory: spool directory for every stripe but the first
+    :param options: myReceiver keyword arguments
+    """
+    inbound_port,outbound_port=stripe.ports(index)
+    options=stripe.stripe_options(options,index)
+    output=sys.stdout if index==0 else open(stripe.spool_path(directory,index),"wb")
+    rcvr=myReceiver(inbound_port=inbound_port,outbound_port=outbound_port,output=output,**options)
+    try:
+        rcvr.receive()
+    finally:
+        output.flush()
+        rcvr.dump_trace()
+        rcvr.simulator.save_record()
+        results.put((index,rcvr.stats()))
+
+class ReceiverServer(object):
+    """
+    Long-running receiver accepting any number of senders on one port. Frames are demultiplexed by the connection
+    ID in their header into one myReceiver and ReceiverProtocol per session, each writing to its own file and
+    replying through its own channel to the sender's port. A SYN carrying a new sequence number opens a session,
+    replacing an earlier one of the same connection.
+    """
+
+    # most frames handled per wakeup, across sessions
+    MAX_BATCH=512
+    # a session that hears nothing for this long is abandoned, in seconds
+    SESSION_TIMEOUT=10.0
+
+    def __init__(self,directory,inbound_port=stripe.RECEIVER_INBOUND_PORT,worker=0,timeout=1.0,
+                 rcvbuf=myReceiver.RCVBUF,debug_level=logging.INFO,channel_options=None,**session_options):
+        """
+        :param directory: directory every session's output file is created in
+        :param inbound_port: port every sender sends to
+        :param worker: index of this process in the worker pool, the pool's processes share the port
+        :param timeout: longest idle wait, in seconds
+        :param rcvbuf: socket receive buffer size in bytes
+        :param debug_level: logging level
+        :param channel_options: ChannelSimulator keyword arguments for the channel of each session's replies
+        :param session_options: myReceiver keyword arguments for every session
+        """
+        self.logger=utils.Logger(self.__class__.__name__,debug_level)
+        self.directory=directory
+        self.inbound_port=inbound_port
+        self.worker=worker
+        self.timeout=timeout
+        self.debug_level=debug_level
+        self.channel_options=channel_options or {}
+        self.session_options=session_options
+        # receives for every session; frame buffers grow to the largest frame size any session agrees on
+        self.simulator=channelsimulator.ChannelSimulator(inbound_port=inbound_port,outbound_port=0,debug_level=debug_level)
+        self.simulator.rcvr_setup(timeout,rcvbuf,reuse_port=True)
+        # verifies SYNs before a session exists for them
+        self.control_codec=handshake.control_codec()
+        # connection ID -> Session
+        self.sessions={}
+        self.sessions_completed=0
+        self.sessions_abandoned=0
+        # counters of every closed session, summed
+        self.totals={}
+
+    def serve(self):
+        """
+        Receive until the process is stopped
+        """
+        self.logger.info("Worker {} serving on port {}, writing sessions to {}",self.worker,self.inbound_port,self.directory)
+        simulator=self.simulator
+        while True:
+            try:
+                frames=simulator.u_receive_many(self.MAX_BATCH,self.wait_time(time.time()))
+            except socket.timeout:
+                frames=()
+            now=time.time()
+            # one batch per session keeps the per-batch work of ReceiverProtocol.handle
+            batches={}
+            for frame in frames:
+                connection_id=packet.peek_connection(frame)
+                if connection_id is not None:
+                    batches.setdefault(connection_id,[]).append(frame)
+            for connection_id,batch in batches.iteritems():
+                session=self.find_session(connection_id,batch,now)
+                if session is not None:
+                    session.last_heard=now
+                    session.receiver.simulator.u_send_many(session.protocol.handle(batch))
+                    if session.receiver.simulator.frame_size > simulator.frame_size:
+                        simulator.set_frame_size(session.receiver.simulator.frame_size)
+            self.service(time.time())
+
+    def wait_time(self,now):
+        """
+        :param now: current time, in seconds
+        :return: how long to wait for the next frame, in seconds
+        """
+        wait=self.timeout
+        for session in self.sessions.itervalues():
+            wait=min(wait,session.protocol.wait_time(now))
+            arrival=session.receiver.simulator.next_arrival()
+            if arrival is not None:
+                wait=min(wait,max(myReceiver.MIN_SOCKET_TIMEOUT,arrival-now))
+        return wait
+
+    def service(self,now):
+        """
+        Send due ACKs and delayed frames, then close sessions that ended or went quiet
+        :param now: current time, in seconds
+        """
+        for connection_id,session in self.sessions.items():
+            simulator=session.receiver.simulator
+            simulator.u_send_many(session.protocol.delayed_ack(now))
+            simulator.send_due(now)
+            if session.protocol.closed(now) or now-session.last_heard > self.SESSION_TIMEOUT:
+                self.close_session(connection_id)
+
+    def find_session(self,connection_id,batch,now):
+        """
+        :param connection_id: connection ID the batch's frames claim
+        :param batch: frames of that connection
+        :param now: current time, in seconds
+        :return: Session the frames belong to, None if they belong to none
+        """
+        session=self.sessions.get(connection_id)
+        for frame in batch:
+            if packet.peek_flags(frame)!=packet.SYN:
+                continue
+            decoded=self.control_codec.decode(frame)
+            if decoded is None:
+                continue
+            incarnation=decoded[0] & packet.SEQ_MASK
+            if session is None or session.incarnation!=incarnation:
+                if session is not None:
+                    # the sender on that port started over
+                    self.close_session(connection_id)
+                session=self.open_session(connection_id,incarnation,now)
+            break
+        return session
+
+    def open_session(self,connection_id,incarnation,now):
+        path=os.path.join(self.directory,"{}_{}.out".format(connection_id,int(now*1000)))
+        options=dict(self.channel_options)
+        if options.get("seed") is not None:
+            options["seed"]+=connection_id
+        channel=channelsimulator.ChannelSimulator(inbound_port=self.inbound_port,outbound_port=connection_id,
+                                                 debug_level=self.debug_level,**options)
+        channel.sndr_setup(self.timeout)
+        receiver=myReceiver(inbound_port=self.inbound_port,outbound_port=connection_id,output=open(path,"wb"),
+                            debug_level=self.debug_level,simulator=channel,**self.session_options)
+        session=Session(receiver,ReceiverProtocol(receiver),incarnation,now,path)
+        self.sessions[connection_id]=session
+        self.logger.info("Session {} opened, writing to {}",connection_id,path)
+        return session
+
+    def close_session(self,connection_id):
+        session=self.sessions.pop(connection_id)
+        session.receiver.output.close()
+        session.receiver.simulator.sndr_socket.close()
+        completed=session.protocol.terminated and session.protocol.failed is None
+        if completed:
+            self.sessions_completed+=1
+        else:
+            self.sessions_abandoned+=1
+        stats=session.receiver.stats()
+        for key,count in stats.iteritems():
+            self.totals[key]=self.totals.get(key,0)+count
+        self.logger.info("Session {} {} after {} bytes",connection_id,
+                         "completed" if completed else "abandoned",stats["bytes_delivered"])
+
+    def close(self):
+        for connection_id in list(self.sessions):
+            self.close_session(connection_id)
+        self.simulator.rcvr_socket.close()
+
+    def stats(self):
+        """
+        :return: dict of the counters of every closed session summed, and the number of sessions
+        """
+        stats=dict(self.totals)
+        stats["sessions_completed"]=self.sessions_completed
+        stats["sessions_abandoned"]=self.sessions_abandoned
+        return stats
+
+
+class Session(object):
+
+    def __init__(self,receiver,protocol,incarnation,now,path):
+        """
+        :param receiver: myReceiver of the session, replying through the session's own channel
+        :param protocol: ReceiverProtocol driven by the server
+        :param incarnation: sequence number of the SYN that opened the session, modulo packet.SEQ_MODULUS
+        :param now: time the session opened, in seconds
+        :param path: output file
+        """
+        self.receiver=receiver
+        self.protocol=protocol
+        self.incarnation=incarnation
+        self.last_heard=now
+        self.path=path
+
+
+def serve_worker(index,results,directory,options):
+    """
+    Run one ReceiverServer of a worker pool until the process is terminated; run in its own process
+    :param index: worker number
+    :param results: queue receiving (index, stats) once the worker stops
+    :param directory: output directory of every session
+    :param options: ReceiverServer keyword arguments
+    """
+    # let the finally clause run when the pool is stopped
+    signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))
+    server=ReceiverServer(directory,worker=index,**options)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        results.put((index,server.stats()))
 
 if __name__ == "__main__":
-    # test out BogoReceiver
-    rcvr = myReceiver()
-    rcvr.receive()
+    parser=argparse.ArgumentParser(description="Receive data from the unreliable channel and write it to stdout")
+    parser.add_argument("--seed",type=int,default=None,help="seed the channel's errors")
+    parser.add_argument("--fast-channel",action="store_true",help="use the simulator's fast corruption engine")
+    parser.add_argument("--stats",default=None,help="write transfer statistics as JSON to this file")
+    parser.add_argument("--event-loop",action="store_true",help="run the transfer on the select-based event loop")
+    parser.add_argument("--stripes",type=int,default=1,help="parallel receiver processes, one port pair each")
+    parser.add_argument("--serve",default=None,metavar="DIR",
+                        help="keep running and accept any number of senders, writing each session to a file in DIR")
+    parser.add_argument("--workers",type=int,default=1,help="with --serve, processes sharing the port")
+    parser.add_argument("--ack-every",type=int,default=myReceiver.ACK_EVERY,help="in-order packets covered by one ACK")
+    parser.add_argument("--ack-delay",type=float,default=myReceiver.ACK_DELAY,
+                        help="longest a packet waits for its ACK, in seconds")
+    parser.add_argument("--max-frame-size",type=int,default=packet.MAX_FRAME_SIZE,
+                        help="largest datagram in bytes accepted from the sender, header included")
+    parser.add_argument("--resume",default=None,metavar="PATH",
+                        help="write to PATH instead of stdout and keep a manifest beside it, so that an interrupted "
+                             "transfer resumes where it stopped")
+    parser.add_argument("--log-level",choices=utils.LOG_LEVELS,default="info",help="least severe messages written to the log")
+    parser.add_argument("--trace",default=None,
+                        help="write a binary per-packet trace to this file, read it with instrument.py")
+    parser.add_argument("--scenario",default=None,
+                        help="channel profile, one of {} or a JSON file".format(", ".join(sorted(scenario.PROFILES))))
+    parser.add_argument("--channel-record",default=None,help="with --scenario, save the fate of every frame sent")
+    parser.add_argument("--channel-replay",default=None,help="with --scenario, impose fates saved by --channel-record")
+    args=parser.parse_args()
+    if args.resume and args.stripes > 1:
+        parser.error("--resume needs a single stripe")
+    if args.serve and (args.stripes > 1 or args.resume or args.event_loop or args.trace or args.channel_record or
+                       args.channel_replay):
+        parser.error("--serve cannot be combined with --stripes, --resume, --event-loop, --trace or --channel-record/replay")
+
+    receiver_options={"seed": args.seed, "fast": args.fast_channel, "event_loop": args.event_loop,
+                      "ack_every": args.ack_every, "ack_delay": args.ack_delay,
+                      "debug_level": getattr(logging,args.log_level.upper()), "trace_path": args.trace,
+                      "scenario": scenario.direction(scenario.load(args.scenario),scenario.REVERSE) if args.scenario else None,
+                      "record": args.channel_record, "replay": args.channel_replay, "max_frame_size": args.max_frame_size,
+                      "checkpoint_path": args.resume}
+
+    if args.serve:
+        if not os.path.isdir(args.serve):
+            os.makedirs(args.serve)
+        channel_options={key: receiver_options[key] for key in ("seed","fast","scenario")}
+        server_options={key: receiver_options[key] for key in ("ack_every","ack_delay","debug_level","max_frame_size")}
+        processes,results=stripe.run(serve_worker,args.workers,args.serve,dict(server_options,channel_options=channel_options))
+        # stopping the server stops the pool, whose workers report on their way out
+        signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))
+        try:
+            for process in processes:
+                process.join()
+        except (KeyboardInterrupt,SystemExit):
+            for process in processes:
+                process.terminate()
+        stats=stripe.merge_stats(stripe.collect(processes,results))
+        if args.stats:
+            with open(args.stats,"w") as stats_file:
+                json.dump(stats,stats_file)
+        sys.exit(0)
+
+    if args.stripes > 1:
+        directory=stripe.spool_directory()
+        processes,results=stripe.run(receive_stripe,args.stripes,directory,receiver_options)
+        stripe.merge_spools(processes,directory)
+        stats=stripe.merge_stats(stripe.collect(processes,results))
+        if args.stats:
+            with open(args.stats,"w") as stats_file:
+                json.dump(stats,stats_file)
+        sys.exit(max(abs(process.exitcode) for process in processes))
+
+    rcvr = myReceiver(**receiver_options)
+    try:
+        rcvr.receive()
+    finally:
+        rcvr.dump_trace()
+        rcvr.simulator.save_record()
+        if args.stats:
+            with open(args.stats,"w") as stats_file:
+                json.dump(rcvr.stats(),stats_file)
@@ -0,0 +1,59 @@
+"""
+Bounded reorder buffer for the receiver.
+
+Out-of-order payloads wait in a ring of capacity slots indexed by sequence
+number modulo the capacity; as soon as the next expected packet arrives the
+contiguous run starting at it is released in order, so receiver memory is
+bounded by the window rather than the transfer size.
+"""
+
+
+class ReorderBuffer(object):
+
+    def __init__(self, capacity):
+        """
+        Create a reorder buffer
+        :param capacity: number of slots, at least the sender's window size
+        """
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        # next sequence number to release
+        self.expected = 0
+        self.buffered = 0
+
+    def accepts(self, seq):
+        """
+        :param seq: sequence number
+        :return: True if seq falls inside the window the buffer can hold
+        """
+        return self.expected <= seq < self.expected + self.capacity
+
+    def put(self, seq, payload):
+        """
+        Store a payload
+        :param seq: sequence number, must satisfy accepts()
+        :param payload: payload bytes or buffer
+        :return: True if the slot was empty (the packet is not a duplicate)
+        """
+        index = seq % self.capacity
+        if self.slots[index] is not None:
+            return False
+        self.slots[index] = payload
+        self.buffered += 1
+        return True
+
+    def pop_ready(self):
+        """
+        Release the contiguous run of payloads starting at the expected sequence number
+        :return: list of payloads in sequence order, possibly empty
+        """
+        ready = []
+        slots = self.slots
+        index = self.expected % self.capacity
+        while slots[index] is not None:
+            ready.append(slots[index])
+            slots[index] = None
+            index = (index + 1) % self.capacity
+        self.expected += len(ready)
+        self.buffered -= len(ready)
+        return ready
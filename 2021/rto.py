@@ -0,0 +1,61 @@
+"""
+Retransmission timeout estimation (Jacobson/Karels, RFC 6298).
+
+The sender feeds RTT samples taken from packets that were transmitted exactly
+once (Karn's rule: an ACK for a retransmitted packet cannot tell which copy it
+acknowledges). Like TCP's single retransmission timer, the timeout is doubled
+when the oldest outstanding packet times out, and stays backed off until a
+fresh sample arrives; timers of younger packets reuse the current value.
+
+The 200 ms floor, as in Linux TCP, keeps the timeout above the queueing delay
+that builds while the window grows. Samples taken on the idle path, such as
+the handshake's, would otherwise set timers that expire spuriously.
+"""
+
+
+class RttEstimator(object):
+
+    # region Constants
+
+    ALPHA = 1.0 / 8
+    BETA = 1.0 / 4
+    K = 4
+    # endregion Constants
+
+    def __init__(self, initial_rto=0.5, min_rto=0.2, max_rto=5.0):
+        """
+        Create an estimator
+        :param initial_rto: timeout used until the first sample, in seconds
+        :param min_rto: lower bound for the timeout, in seconds
+        :param max_rto: upper bound for the timeout, in seconds
+        """
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.samples = 0
+        self.backoffs = 0
+
+    def sample(self, rtt):
+        """
+        Update smoothed RTT and variance with a new measurement and recompute the timeout
+        :param rtt: measured round trip time, in seconds
+        :return:
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.samples += 1
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + self.K * self.rttvar))
+
+    def backoff(self):
+        """
+        Double the timeout after the oldest outstanding packet timed out
+        :return:
+        """
+        self.backoffs += 1
+        self.rto = min(self.max_rto, self.rto * 2)
@@ -0,0 +1,165 @@
+"""
+Cumulative ACK plus SACK bitmap bookkeeping for selective repeat.
+
+An ACK frame carries the cumulative acknowledgement in its sequence field (every
+packet below it has arrived) and, with the SACK flag, a bitmap payload in which
+bit i (least significant first) reports packet cumulative + 1 + i as received.
+Both ends keep their bitmaps as Python ints so shifting and merging a window of
+thousands of packets stays a handful of C-level operations.
+"""
+
+from binascii import hexlify, unhexlify
+
+import packet
+
+MAX_SACK_BITS = packet.MAX_PAYLOAD * 8
+
+
+def encode_bitmap(mask):
+    """
+    Serialize a SACK bitmap
+    :param mask: int bitmap
+    :return: big-endian bytes of the bitmap, empty if no bit is set
+    """
+    if not mask:
+        return b""
+    digits = "%x" % mask
+    if len(digits) & 1:
+        digits = "0" + digits
+    return unhexlify(digits)
+
+
+def decode_bitmap(payload):
+    """
+    Parse a SACK bitmap
+    :param payload: bytes produced by encode_bitmap
+    :return: int bitmap
+    """
+    return int(hexlify(payload), 16) if len(payload) else 0
+
+
+class ReceiveTracker(object):
+
+    def __init__(self):
+        # every packet below expected has been received
+        self.expected = 0
+        # bit i set: packet expected + i has been received
+        self.mask = 0
+
+    def add(self, seq):
+        """
+        Record an arriving packet and advance the cumulative point over any contiguous run
+        :param seq: sequence number of the packet
+        :return: True if the packet was not seen before
+        """
+        offset = seq - self.expected
+        if offset < 0 or offset >= MAX_SACK_BITS or self.mask >> offset & 1:
+            return False
+        self.mask |= 1 << offset
+        if offset == 0:
+            # skip the run of ones at the bottom of the mask
+            run = ((~self.mask & (self.mask + 1)).bit_length() - 1)
+            self.mask >>= run
+            self.expected += run
+        return True
+
+    def bitmap(self):
+        """
+        :return: SACK payload for the packets received beyond the cumulative point
+        """
+        return encode_bitmap(self.mask >> 1)
+
+
+class AckScheduler(object):
+    """
+    Decides when the receiver answers: every few in-order packets, when the delay timer of the oldest unacknowledged
+    arrival runs out, or at the end of the batch once something arrived out of order, was duplicated or corrupted.
+    Each ACK is cumulative plus SACK, so it stands in for every one it replaces.
+    """
+
+    def __init__(self, every=2, delay=0.005):
+        """
+        :param every: in-order packets covered by one ACK
+        :param delay: longest an arrival waits for its ACK, in seconds; keep well under the sender's minimum RTO
+        """
+        self.every = every
+        self.delay = delay
+        # arrivals since the last ACK
+        self.pending = 0
+        self.urgent = False
+        # when the oldest pending arrival must be acknowledged, None when nothing is pending
+        self.deadline = None
+
+    def arrived(self, now, in_order=True):
+        """
+        Count an arrival
+        :param now: current time, in seconds
+        :param in_order: False for duplicates, corrupted frames and packets on either side of a hole
+        :return: True if an ACK should go out right away
+        """
+        self.pending += 1
+        if not in_order:
+            self.urgent = True
+        if self.deadline is None:
+            self.deadline = now + self.delay
+        return self.pending >= self.every
+
+    def due(self, now):
+        """
+        :param now: current time, in seconds
+        :return: True if the pending arrivals must be acknowledged at the end of this batch
+        """
+        return self.pending > 0 and (self.urgent or now >= self.deadline)
+
+    def sent(self):
+        """
+        Reset after an ACK covering every pending arrival went out
+        """
+        self.pending = 0
+        self.urgent = False
+        self.deadline = None
+
+
+class Scoreboard(object):
+
+    def __init__(self):
+        # lowest packet not yet known to be received
+        self.lower = 0
+        # bit i set: packet lower + i has been selectively acknowledged
+        self.sacked = 0
+
+    def ack(self, cumulative, bitmap):
+        """
+        Merge an ACK into the scoreboard
+        :param cumulative: cumulative acknowledgement carried by the ACK
+        :param bitmap: int SACK bitmap carried by the ACK
+        :return: list of sequence numbers acknowledged for the first time
+        """
+        newly_acked = []
+        if cumulative > self.lower:
+            # packets below the cumulative point that we had not seen SACKed
+            fresh = ~self.sacked & ((1 << (cumulative - self.lower)) - 1)
+            newly_acked.extend(self._bits(fresh, self.lower))
+            self.sacked >>= cumulative - self.lower
+            self.lower = cumulative
+
+        offset = cumulative + 1 - self.lower
+        incoming = bitmap << offset if offset >= 0 else bitmap >> -offset
+        fresh = incoming & ~self.sacked
+        if fresh:
+            self.sacked |= fresh
+            newly_acked.extend(self._bits(fresh, self.lower))
+        if self.sacked & 1:
+            run = ((~self.sacked & (self.sacked + 1)).bit_length() - 1)
+            self.sacked >>= run
+            self.lower += run
+        return newly_acked
+
+    @staticmethod
+    def _bits(mask, base):
+        seqs = []
+        while mask:
+            low = mask & -mask
+            seqs.append(base + low.bit_length() - 1)
+            mask ^= low
+        return seqs
@@ -0,0 +1,204 @@
+"""
+Seedable channel scenarios for ChannelSimulator.
+
+A profile describes both directions of the channel: "forward" carries data from
+sender to receiver and "reverse" carries ACKs back. Each direction takes the
+keys of DEFAULTS:
+
+    drop, error, swap  per-frame probabilities, as ChannelSimulator.corrupt
+    scaled             if true, drop and error apply per SCALE_UNIT bytes, so
+                       larger frames are lost and corrupted more often
+    burst              Gilbert-Elliott loss model replacing drop, a dict with
+                       to_bad, to_good (per-frame state transition
+                       probabilities) and loss_good, loss_bad
+    delay, jitter      seconds added to every frame, jitter uniformly in
+                       [0, jitter) so frames may overtake each other
+    bandwidth          bytes per second the direction serializes, 0 unlimited
+    queue              frames waiting on a capped link before the tail is
+                       dropped, 0 unlimited
+
+Profiles are named entries of PROFILES or JSON files of the same shape. Every
+ChannelModel draws from its own generator, so a seeded run always sees the same
+fates. The fate of every frame is recorded and can be saved and replayed, which
+reproduces a loss trace exactly even across protocol changes that alter how
+many random draws a frame costs.
+"""
+
+import json
+import os
+import random
+
+FORWARD = "forward"
+REVERSE = "reverse"
+
+DEFAULTS = {"drop": 0.005, "error": 0.005, "swap": 0.005, "scaled": False, "burst": None, "delay": 0.0,
+            "jitter": 0.0, "bandwidth": 0, "queue": 0}
+# ChannelSimulator.BUFFER_SIZE, the frame size the per-frame probabilities were set for
+SCALE_UNIT = 1024
+
+_BURSTY = {"burst": {"to_bad": 0.002, "to_good": 0.2, "loss_good": 0.0, "loss_bad": 0.5}}
+_WAN = {"delay": 0.01, "jitter": 0.002, "bandwidth": 12500000, "queue": 512}
+PROFILES = {
+    # the assignment's channel
+    "default": {},
+    "clean": {FORWARD: {"drop": 0.0, "error": 0.0, "swap": 0.0}, REVERSE: {"drop": 0.0, "error": 0.0, "swap": 0.0}},
+    "lossy": {FORWARD: {"drop": 0.02, "error": 0.02, "swap": 0.01}, REVERSE: {"drop": 0.02, "error": 0.02, "swap": 0.01}},
+    # bad spells of five frames on average losing half their frames, about 0.5% overall
+    "bursty": {FORWARD: _BURSTY, REVERSE: _BURSTY},
+    # 100 Mbit/s with a 20 ms round trip
+    "wan": {FORWARD: _WAN, REVERSE: dict(_WAN, bandwidth=0)},
+    # the assignment's channel for frames of any size, to weigh larger frames against their higher loss
+    "scaled": {FORWARD: {"scaled": True}, REVERSE: {"scaled": True}},
+    # the heavier conditions for long runs: bursty, lossy and slow at once
+    "stress": {FORWARD: dict(_WAN, error=0.02, swap=0.01, **_BURSTY), REVERSE: dict(_BURSTY, delay=0.01, jitter=0.002)},
+}
+
+# region Fates
+
+DROP = 0x01
+ERROR = 0x02
+SWAP = 0x04
+# with SWAP: swap with the newest frame in the swap queue instead of the oldest
+SWAP_NEWEST = 0x08
+# endregion Fates
+
+
+def load(name):
+    """
+    :param name: key of PROFILES or path to a JSON profile
+    :return: profile dict
+    """
+    if name in PROFILES:
+        return PROFILES[name]
+    if not os.path.exists(name):
+        raise ValueError("Unknown scenario {!r}, expected a file or one of {}".format(name, sorted(PROFILES)))
+    with open(name) as f:
+        return json.load(f)
+
+
+def direction(profile, which):
+    """
+    :param profile: profile dict
+    :param which: FORWARD or REVERSE
+    :return: settings of that direction with every missing key taken from DEFAULTS
+    """
+    settings = dict(DEFAULTS)
+    unknown = set(profile.get(which, {})) - set(DEFAULTS)
+    if unknown:
+        raise ValueError("Unknown scenario settings {}".format(sorted(unknown)))
+    settings.update(profile.get(which, {}))
+    return settings
+
+
+class GilbertElliott(object):
+    """
+    Two-state Markov loss model: frames are lost with loss_good in the good state and loss_bad in the bad one
+    """
+
+    def __init__(self, rng, to_bad, to_good, loss_good=0.0, loss_bad=1.0):
+        """
+        :param rng: random.Random to draw from
+        :param to_bad: probability of moving from the good to the bad state before a frame
+        :param to_good: probability of moving from the bad to the good state before a frame
+        :param loss_good: loss probability in the good state
+        :param loss_bad: loss probability in the bad state
+        """
+        self.rng = rng
+        self.to_bad = to_bad
+        self.to_good = to_good
+        self.loss_good = loss_good
+        self.loss_bad = loss_bad
+        self.bad = False
+
+    def loss(self):
+        """
+        Advance the state by one frame
+        :return: loss probability of that frame
+        """
+        if self.rng.random() < (self.to_good if self.bad else self.to_bad):
+            self.bad = not self.bad
+        return self.loss_bad if self.bad else self.loss_good
+
+
+class ChannelModel(object):
+    """
+    Fate and arrival time of every frame sent in one direction
+    """
+
+    def __init__(self, settings, seed=None, replay=None):
+        """
+        :param settings: one direction of a profile, see direction
+        :param seed: seed of the model's own generator, None for a fresh one
+        :param replay: path of saved fates to replay instead of drawing them
+        """
+        self.rng = random.Random(seed)
+        self.drop = settings["drop"]
+        self.error = settings["error"]
+        self.swap = settings["swap"]
+        self.scaled = settings["scaled"]
+        self.burst = GilbertElliott(self.rng, **settings["burst"]) if settings["burst"] else None
+        self.delay = settings["delay"]
+        self.jitter = settings["jitter"]
+        self.bandwidth = settings["bandwidth"]
+        self.queue = settings["queue"]
+        # frames need holding back until their arrival time
+        self.delays = bool(self.delay or self.jitter or self.bandwidth)
+        self.replay = None
+        if replay is not None:
+            with open(replay, "rb") as f:
+                self.replay = bytearray(f.read())
+        # one fate per frame so far
+        self.fates = bytearray()
+        # when the capped link finishes serializing the frames handed to it
+        self.link_free = 0.0
+
+    def fate(self, size=SCALE_UNIT):
+        """
+        :param size: frame length in bytes
+        :return: combination of DROP, ERROR, SWAP and SWAP_NEWEST for the next frame
+        """
+        if self.replay is not None:
+            sent = len(self.fates)
+            fate = self.replay[sent] if sent < len(self.replay) else 0
+        else:
+            rng = self.rng
+            fate = 0
+            drop = self.burst.loss() if self.burst is not None else self.drop
+            error = self.error
+            if self.scaled:
+                # as if every SCALE_UNIT bytes were an independent frame
+                drop = 1 - (1 - drop) ** (float(size) / SCALE_UNIT)
+                error = 1 - (1 - error) ** (float(size) / SCALE_UNIT)
+            if rng.random() < drop:
+                fate |= DROP
+            if rng.random() < error:
+                fate |= ERROR
+            p_swap = rng.random()
+            if p_swap < self.swap:
+                fate |= SWAP | (SWAP_NEWEST if p_swap < self.swap / 2 else 0)
+        self.fates.append(fate)
+        return fate
+
+    def arrival(self, now, size, waiting):
+        """
+        :param now: time the frame is handed to the channel, in seconds
+        :param size: frame length in bytes
+        :param waiting: frames already in transit
+        :return: time the frame reaches the far socket, None if the link's queue is full
+        """
+        if self.bandwidth:
+            if self.queue and waiting >= self.queue:
+                # recorded as a drop so that a replay loses the frame too
+                self.fates[-1] |= DROP
+                return None
+            self.link_free = max(now, self.link_free) + float(size) / self.bandwidth
+            now = self.link_free
+        return now + self.delay + (self.rng.random() * self.jitter if self.jitter else 0.0)
+
+    def save(self, path):
+        """
+        Write the fate of every frame so far, for replay
+        :param path: output file
+        """
+        with open(path, "wb") as f:
+            f.write(self.fates)
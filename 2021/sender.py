@@ -1,26 +1,42 @@
 # Written by S. Mevawala, modified by D. Gitzel
 
+import argparse
+import heapq
+import json
 import logging
+import random
 import socket
-
 import time
-import struct
-import string
-import zlib
 
 import channelsimulator
+import checkpoint
+import checksums
+import compress
+import congestion
+import eventloop
+import fec
+import handshake
+import instrument
+import packet
+import packettable
+import rto
+import sack
+import scenario
+import sendstate
+import stripe
 import utils
 import sys
 
 class Sender(object):
 
-    def __init__(self, inbound_port=50006, outbound_port=50005, timeout=10, debug_level=logging.INFO):
+    def __init__(self, inbound_port=50006, outbound_port=50005, timeout=10, debug_level=logging.INFO,
+                 **channel_options):
         self.logger = utils.Logger(self.__class__.__name__, debug_level)
 
         self.inbound_port = inbound_port
         self.outbound_port = outbound_port
         self.simulator = channelsimulator.ChannelSimulator(inbound_port=inbound_port, outbound_port=outbound_port,
-                                                           debug_level=debug_level)
+                                                           debug_level=debug_level, **channel_options)
         self.simulator.sndr_setup(timeout)
         self.simulator.rcvr_setup(timeout)
 
@@ -30,8 +46,8 @@ class Sender(object):
 
 class BogoSender(Sender):
 
-    def __init__(self):
-        super(BogoSender, self).__init__()
+    def __init__(self, **kwargs):
+        super(BogoSender, self).__init__(**kwargs)
 
     def send(self, data):
         self.logger.info("Sending on port: {} and waiting for ACK on port: {}".format(self.outbound_port, self.inbound_port))
@@ -47,158 +63,559 @@ class BogoSender(Sender):
 
 class mySender(BogoSender):
 
-    def __init__(self,timeout=0.05):
-        super(mySender, self).__init__()
-        self.simulator.sndr_setup(timeout)
-        self.simulator.rcvr_setup(timeout)
+    def __init__(self,initial_rto=0.5,checksum_name=checksums.DEFAULT_CHECKSUM,controller_name=congestion.DEFAULT_CONTROLLER,controller_options=None,fec_options=None,event_loop=False,compression=None,trace_path=None,frame_size=channelsimulator.ChannelSimulator.BUFFER_SIZE,resume=False,**kwargs):
+        super(mySender, self).__init__(**kwargs)
+        if not packet.HEADER_SIZE+fec.PARITY_HEADER.size < frame_size <= packet.MAX_FRAME_SIZE:
+            raise ValueError("Frame size {} outside ({}, {}]".format(frame_size,packet.HEADER_SIZE+fec.PARITY_HEADER.size,packet.MAX_FRAME_SIZE))
+        # offered in the SYN, the receiver may settle for less
+        self.frame_size=frame_size
+        self.BYTES_PER_PACKET=frame_size-packet.HEADER_SIZE
+        # the port ACKs arrive on names the session, no other sender on this host can use it
+        self.connection_id=self.inbound_port
+        self.checksum=checksums.new_checksum(checksum_name)
+        self.codec=packet.PacketCodec(self.checksum,self.BYTES_PER_PACKET,self.connection_id)
+        # SYN and FIN exchanges always use the control checksum
+        self.control_codec=handshake.control_codec(self.connection_id)
+        # retransmission timeout follows the measured RTT; the socket timeout
+        # is re-armed from the earliest retransmit deadline on every wait
+        self.rtt=rto.RttEstimator(initial_rto)
+        self.controller=congestion.new_controller(controller_name,self.WINDOW_SIZE,**(controller_options or {}))
+        # optional parity packets, see fec.ParityEncoder for the options
+        self.fec=None
+        if fec_options is not None:
+            # leave room for the parity header in parity packets
+            self.BYTES_PER_PACKET-=fec.PARITY_HEADER.size
+            self.fec=fec.ParityEncoder(payload_size=self.BYTES_PER_PACKET,**fec_options)
+        # serve ACKs, pacing and retransmit timers from one select-based event loop
+        self.event_loop=event_loop
+        # compress.METHODS entry offered in the handshake, None to send the input as is
+        self.compression=compression
+        # compress.CompressingReader of the current transfer, if the receiver agreed
+        self.compressor=None
+        # ask the receiver which ranges it lacks and send only those
+        self.resume=resume
+        # (offset, length) ranges of the input the receiver asked for, None to send all of it
+        self.ranges=None
+        self.packets_sent=0
+        self.packets_retransmitted=0
+        self.bytes_sent=0
+        # retransmit timer expiries that resent anything
+        self.timeouts=0
+        self.acks_received=0
+        self.acks_corrupted=0
+        self.rtt_histogram=instrument.Histogram(1e-4)
+        self.window_histogram=instrument.Histogram()
+        # per-packet events, written to trace_path by dump_trace
+        self.trace_path=trace_path
+        self.trace=instrument.PacketTrace(time.time()) if trace_path else None
 
     WINDOW_SIZE=2**11
-    BYTES_PER_PACKET=1012
+    # never block for less than this, a zero timeout would make the socket non-blocking
+    MIN_SOCKET_TIMEOUT=0.001
+    # most ACK frames handled per wakeup
+    MAX_BATCH=256
+    BYTES_PER_PACKET=packet.MAX_PAYLOAD
+    # number of packets worth of input pulled from the stream per read
+    READ_BLOCK_PACKETS=64
+    # FIN transmissions before the sender gives up on a confirmation
+    FIN_ATTEMPTS=6
+    # SYN transmissions before the sender gives up on reaching a receiver
+    SYN_ATTEMPTS=8
+    # consecutive retransmit timeouts without a packet acknowledged before the transfer is given up
+    MAX_BACKOFFS=10
+    # the receiver lingers this many FIN timeouts after its last FIN|ACK
+    LINGER_TIMEOUTS=3
 
     def send(self, data):
-        self.logger.info("Sending on port: {} and waiting for ACK on port: {}".format(self.outbound_port, self.inbound_port))
-
-        lower=0
-
-        tuple_array,success = self.prepare_data(data)
-        total_packets=len(tuple_array)
-
-        window_size=self.WINDOW_SIZE if total_packets > self.WINDOW_SIZE else total_packets
-
-        termination=False
-
-        while not termination:
-            try:
-                # upper=lower+window_size if lower+window_size < total_packets else total_packets
-                upper=min(lower+window_size,total_packets)
-
-                lower_seq_num_bin = tuple_array[lower]["sequence_number"]
-                upper_seq_num_bin = tuple_array[upper-1]["sequence_number"]
-
-                lower_seq_num_int = struct.unpack(">i",lower_seq_num_bin)[0]
-                upper_seq_num_int = struct.unpack(">i",upper_seq_num_bin)[0]
-
-                for i in range(lower_seq_num_int,upper_seq_num_int+1):
-                    if tuple_array[i]["sent"] == False:
-                        datagram = tuple_array[i]["sequence_number"] + \
-                                   tuple_array[i]["data_packet_length"] + \
-                                   tuple_array[i]["checksum"] + \
-                                   tuple_array[i]["data"]
-
-                        self.simulator.u_send(datagram)
-                        tuple_array[i]["sent"]=True
-                        self.logger.info("Sent packet with sequence number {} out of {} packets".format(i, total_packets))
-                
-                while not termination:
-                    return_packet=self.simulator.u_receive()
-
-                    returned_seq_num_bin=return_packet[0:4]
-                    returned_ack_bin=return_packet[4:8]
-
-                    returned_seq_num_int=struct.unpack(">i",returned_seq_num_bin)[0]
-                    returned_ack_int=struct.unpack(">i",returned_ack_bin)[0]
-
-                    
-
-                    if  (returned_ack_int==1111 or returned_ack_int==1110 or returned_ack_int==1101 or returned_ack_int==1011 or returned_ack_int==111) and returned_seq_num_int>=lower and returned_seq_num_int<=upper and success[returned_seq_num_int]==False:
-                    
-                        tuple_array[returned_seq_num_int]["ack"]=True
-                        success[returned_seq_num_int]=True
-                        self.logger.info("Received ACK for packet with sequence number {}".format(returned_seq_num_int))
-                        if returned_seq_num_int==lower:
-                            break
-
-                    # find the next unsuccessful packet and update lower
-                for i in range(lower,min(upper+1,total_packets-1)):
-                    if not success[i]:
-                        lower = i
-                        break
-                    
-            except socket.timeout as timeoutException:
-                self.logger.info(str(timeoutException))
-                unfinished=False
-                for i in range(lower_seq_num_int,upper_seq_num_int+1):
-                    if not success[i]:
-                        datagram = tuple_array[i]["sequence_number"] + \
-                                   tuple_array[i]["data_packet_length"] + \
-                                   tuple_array[i]["checksum"] + \
-                                   tuple_array[i]["data"]
-                        self.simulator.u_send(datagram)
-                        unfinished=True
-                        self.logger.info("Resent packet with sequence number {}".format(i))
-                
-                if not unfinished:
-                    self.logger.info("Finished")
-                    termination=True
-
+        compressed=self.connect()
+        if compressed or self.ranges is not None:
+            self.send_source(self.stream_source(packettable.RangeReader(data,0,len(data)),compressed))
+        else:
+            self.send_source(packettable.PacketTable(self.codec,data,packet_size=self.BYTES_PER_PACKET))
+
+    def send_stream(self, stream):
+        compressed=self.connect()
+        if compressed or self.ranges is not None:
+            self.send_source(self.stream_source(stream,compressed))
+        else:
+            # regular files are mapped, anything else is read as the window advances
+            self.send_source(packettable.open_source(self.codec,stream,self.BYTES_PER_PACKET,self.READ_BLOCK_PACKETS))
+
+    def stream_source(self,stream,compressed):
+        """
+        :param stream: file object opened for binary reading
+        :param compressed: True to compress the stream
+        :return: packettable.StreamPackets over the ranges the receiver asked for, compressed if agreed
+        """
+        if self.ranges is not None:
+            stream=checkpoint.RangesReader(stream,self.ranges)
+        if compressed:
+            self.compressor=compress.CompressingReader(stream,self.compression)
+            stream=self.compressor
+        return packettable.StreamPackets(self.codec,stream,self.BYTES_PER_PACKET,self.READ_BLOCK_PACKETS)
+
+    def send_source(self, packets):
+        """
+        Transfer every packet of a source over a connected session, then terminate it
+        :param packets: packettable.PacketTable or packettable.StreamPackets
+        """
+        self.logger.info("Sending on port: {} and waiting for ACK on port: {}",self.outbound_port,self.inbound_port)
+
+        protocol=SenderProtocol(self,packets)
+        if self.event_loop:
+            loop=eventloop.EventLoop()
+            transport=eventloop.ChannelTransport(loop,self.simulator,protocol)
+            loop.run_forever()
+            transport.close()
+        else:
+            while True:
+                now=time.time()
+                batch=protocol.fill(now)
+                if batch:
+                    self.simulator.u_send_many(batch)
+                if protocol.finished or protocol.aborted is not None:
+                    break
+                try:
+                    frames=self.simulator.u_receive_many(self.MAX_BATCH,max(self.MIN_SOCKET_TIMEOUT,protocol.wake_time(now)-time.time()))
+                except socket.timeout as timeoutException:
+                    self.logger.debug(str(timeoutException))
+                    frames=()
+                now=time.time()
+                protocol.merge_acks(frames,now)
+                batch=protocol.expire(now)
+                if batch:
+                    self.simulator.u_send_many(batch)
+        if protocol.aborted is not None:
+            sys.exit(1)
+        self.logger.info("Finished")
+
+        self.logger.info("RTT estimate {:.4f}s, RTO {:.4f}s after {} samples and {} backoffs",self.rtt.srtt or 0.0,self.rtt.rto,self.rtt.samples,self.rtt.backoffs)
 
         # done with all packets, time for terminator
-        while True:
+        self.close(protocol.window.next_seq)
+        sys.exit(0)
+
+    def connect(self):
+        """
+        Open the session: offer window, packet size, checksum, compression and resumption with SYN until the receiver
+        answers SYN|ACK, then adopt the agreed values; exit with status 1 if it never does
+        :return: True if the stream is to be compressed
+        """
+        features=handshake.COMPRESSED if self.compression else 0
+        if self.resume:
+            features|=handshake.RESUME
+        if self.fec is not None:
+            features|=handshake.PARITY
+        offer=handshake.encode_options(self.WINDOW_SIZE,self.frame_size-packet.HEADER_SIZE,self.checksum.NAME,features)
+        # a fresh SYN sequence number tells a server this is a new session even if the port was used before
+        incarnation=random.SystemRandom().getrandbits(16)
+        syn=self.control_codec.encode(incarnation,packet.SYN,offer)
+        timeout=self.rtt.rto
+        for attempts in xrange(1,self.SYN_ATTEMPTS+1):
+            sent=time.time()
+            self.simulator.u_send_many((syn,))
+            reply=self.await_control(packet.SYN | packet.ACK,sent+timeout,incarnation)
+            if reply is not None:
+                payload=reply[2]
+                options=handshake.decode_options(payload)
+                if options is not None:
+                    break
+            # the receiver may not be up yet, keep trying with backoff
+            timeout=min(2*timeout,self.rtt.max_rto)
+        else:
+            self.logger.info("No SYN|ACK after {} attempts, giving up",self.SYN_ATTEMPTS)
+            sys.exit(1)
+        if attempts==1:
+            self.rtt.sample(time.time()-sent)
+
+        window,packet_size,checksum_name,features=options
+        self.logger.info("Connected: window {}, packet size {}, checksum {}, features {}",*options)
+        self.WINDOW_SIZE=window
+        self.frame_size=packet.HEADER_SIZE+packet_size
+        self.BYTES_PER_PACKET=packet_size
+        if window < self.controller.max_window:
+            self.controller.max_window=window
+            self.controller.window=min(self.controller.window,window)
+        if self.fec is not None and not features & handshake.PARITY:
+            self.logger.info("The receiver declined parity, sending without FEC")
+            self.fec=None
+        if self.fec is not None:
+            # parity packets carry the parity header on top of a data payload
+            self.BYTES_PER_PACKET-=fec.PARITY_HEADER.size
+            self.fec.payload_size=self.BYTES_PER_PACKET
+        if checksum_name!=self.checksum.NAME:
+            self.checksum=checksums.new_checksum(checksum_name)
+        self.codec=packet.PacketCodec(self.checksum,packet_size,self.connection_id)
+        if features & handshake.RESUME:
+            self.ranges=handshake.decode_ranges(payload)
+            self.logger.info("Resuming: the receiver asked for {} ranges",len(self.ranges))
+        return bool(features & handshake.COMPRESSED)
+
+    def close(self,final_seq):
+        """
+        Send FIN until the receiver confirms with FIN|ACK, a bounded number of times
+        :param final_seq: sequence number following the last data packet
+        :return: True if the receiver confirmed
+        """
+        timeout=self.rtt.rto
+        for _ in xrange(self.FIN_ATTEMPTS):
             self.logger.info("Try to terminate")
-            try:
-                # send "1011111" as termination message
-                self.simulator.u_send(bytearray([255, 0] + [255]*5))
-                self.logger.info("Sent TERMINATION MESSAGE")
-                ack = self.simulator.u_receive()
-
-            except socket.timeout as e:
-                self.logger.info(str(e))
-            
-            # if reciever returns "1011111" -> successful termination
-            if ack[0] & (~ack[1] & 0xFF) & ack[2] & ack[3] & ack[4] & ack[5] & ack[6] == 255:
+            fin=self.control_codec.encode(final_seq,packet.FIN,handshake.encode_linger(self.LINGER_TIMEOUTS*timeout))
+            self.simulator.u_send_many((fin,))
+            if self.await_control(packet.FIN | packet.ACK,time.time()+timeout,final_seq) is not None:
                 self.logger.info("Received TERMINATION CONFIRMATION")
-                sys.exit()
+                return True
+            timeout=min(2*timeout,self.rtt.max_rto)
+        # every packet was acknowledged, only the confirmation is missing
+        self.logger.info("No FIN|ACK after {} attempts, closing",self.FIN_ATTEMPTS)
+        return False
+
+    def await_control(self,flags,deadline,seq=None):
+        """
+        Wait for a control frame, skipping anything else
+        :param flags: exact flags of the awaited frame
+        :param deadline: time to give up, in seconds
+        :param seq: sequence number the frame must carry, or None for any
+        :return: (sequence number, flags, payload copy), or None at the deadline
+        """
+        while True:
+            remaining=deadline-time.time()
+            if remaining <= 0:
+                return None
+            try:
+                frames=self.simulator.u_receive_many(self.MAX_BATCH,max(self.MIN_SOCKET_TIMEOUT,remaining))
+            except socket.timeout:
+                return None
+            for frame in frames:
+                if packet.peek_flags(frame)!=flags:
+                    continue
+                decoded=self.control_codec.decode(frame,0 if seq is None else seq)
+                if decoded is not None and (seq is None or decoded[0]==seq):
+                    return decoded[0],decoded[1],str(decoded[2])
+
+    def stats(self):
+        """
+        :return: dict of transfer statistics
+        """
+        return {
+            "packets_sent": self.packets_sent,
+            "packets_retransmitted": self.packets_retransmitted,
+            "bytes_sent": self.bytes_sent,
+            "srtt": self.rtt.srtt,
+            "rto": self.rtt.rto,
+            "parity_sent": self.fec.parity_sent if self.fec is not None else 0,
+            "compression_ratio": self.compressor.ratio() if self.compressor is not None else 1.0,
+            "timeouts": self.timeouts,
+            "acks_received": self.acks_received,
+            "acks_corrupted": self.acks_corrupted,
+            "rtt": self.rtt_histogram.summary(),
+            "window": self.window_histogram.summary(),
+        }
+
+    def dump_trace(self):
+        """
+        Write the packet trace, if tracing
+        """
+        if self.trace is not None:
+            self.trace.dump(self.trace_path)
+
+    def parity_frames(self,parities):
+        """
+        :param parities: (group start, parity payload) pairs from the FEC encoder
+        :return: list of parity datagrams
+        """
+        return [self.codec.encode(start,packet.PARITY,parity) for start,parity in parities]
+
+class SenderProtocol(eventloop.DatagramProtocol):
+    """
+    Sender state machine. The blocking loop in mySender.send_source and the event loop drive the same handlers:
+    fill sends new packets, merge_acks folds a batch of ACKs in and expire resends packets whose timer ran out.
+    """
+
+    def __init__(self,sender,packets):
+        """
+        :param sender: mySender providing the codec, estimators, controller and counters
+        :param packets: packettable.PacketTable or packettable.StreamPackets
+        """
+        self.sender=sender
+        self.packets=packets
+        self.logger=sender.logger
+        # lengths, first transmission times and flags of the packets in flight;
+        # datagrams are built by the source when they are (re)sent
+        self.window=sendstate.SendWindow(sender.WINDOW_SIZE)
+        self.scoreboard=sack.Scoreboard()
+        # (retransmit deadline, sequence number), one live entry per unacknowledged packet
+        self.timers=[]
+        self.exhausted=False
+        # retransmit timeouts of the oldest packet since a packet was last acknowledged
+        self.stalls=0
+        # why the transfer was given up, None while it runs
+        self.aborted=None
+        self.window_log=congestion.WindowLog(self.logger)
+        # packets sent since the last FEC loss observation
+        self.sent=0
+        self.transport=None
+        self.wakeup=None
+
+    @property
+    def finished(self):
+        return self.exhausted and not self.window.in_flight
+
+    def fill(self,now):
+        """
+        Pull new packets from the source while the receiver window and the controller allow
+        :param now: current time, in seconds
+        :return: list of datagrams to send
+        """
+        sender=self.sender
+        window=self.window
+        controller=sender.controller
+        trace=sender.trace
+        batch=[]
+        while self.aborted is None and not self.exhausted and window.has_room() and controller.can_send(window.in_flight,now):
+            datagram=self.packets.datagram(window.next_seq)
+            if datagram is None:
+                self.exhausted=True
+                if sender.fec is not None:
+                    batch.extend(sender.parity_frames(sender.fec.flush()))
                 break
-                
-        sys.exit(0)
-
-
-
-
-    def prepare_data(self,data):
-        self.logger.info("Preparing data")
-        print("Preparing data")
-        tuple_array=[]
-        success={}
-        input_length=len(data)
-        for i in range(0,input_length/self.BYTES_PER_PACKET+1):
-            lower=i*self.BYTES_PER_PACKET
-            upper=min(input_length,lower+self.BYTES_PER_PACKET)
-
-            data_packet_length_int=upper-lower
-            data_packet_length_bin=struct.pack(">i",data_packet_length_int & 0x3FF) 
-
-            data_packet_content_bin=data[lower:upper] + bytearray([0]*(self.BYTES_PER_PACKET + lower - upper))
-
-            sequence_num_int=i
-            sequence_num_bin_str="{0:b}".format(sequence_num_int).zfill(32)
-            sequence_num_bin=bytearray(int(sequence_num_bin_str[j:j+8],2) for j in range(0,32,8))
-
-            checksum_bin_str=format(self.checksum(sequence_num_bin_str,data_packet_content_bin),'b').zfill(32)
-            checksum_bin=bytearray(int(checksum_bin_str[j:j+8],2) for j in range(0,32,8)) 
-
-            tuple_array.append({
-                "sequence_number":      sequence_num_bin,
-                "data_packet_length":   data_packet_length_bin,
-                "checksum":             checksum_bin,
-                "data":                 data_packet_content_bin,
-                "sent":                 False})
-            success[i] = False
-        
-        self.logger.info("Done preparing data")
-        print("Done preparing data")
-        return tuple_array,success
-
-    def checksum(self,seq_num_bin_str,data_bin):
-        filled_data = string.join([string.zfill(n, 8) for n in map(lambda s: s[2:], map(bin, data_bin))], '')
-        checksum = zlib.adler32(seq_num_bin_str + filled_data) & 0xffffffff
-        return checksum
-
-
-
+            seq_num_int=window.send(len(datagram)-packet.HEADER_SIZE,now)
+            batch.append(datagram)
+            sender.packets_sent+=1
+            sender.bytes_sent+=len(datagram)-packet.HEADER_SIZE
+            if sender.fec is not None:
+                batch.extend(sender.parity_frames(sender.fec.add(seq_num_int,buffer(datagram,packet.HEADER_SIZE))))
+            controller.on_send(now)
+            if trace is not None:
+                trace.record(now,instrument.SEND,seq_num_int,controller.window)
+            heapq.heappush(self.timers,(now+sender.rtt.rto,seq_num_int))
+        self.sent+=len(batch)
+        if batch:
+            self.logger.debug("Sent {} frames up to packet {}",len(batch),window.next_seq-1)
+        return batch
+
+    def wake_time(self,now):
+        """
+        :param now: current time, in seconds
+        :return: the earliest retransmit deadline, or when pacing lets the next packet go if sooner
+        """
+        sender=self.sender
+        wake=self.timers[0][0] if self.timers else now+sender.rtt.rto
+        if not self.exhausted and self.window.has_room() and self.window.in_flight < sender.controller.window:
+            wake=min(wake,sender.controller.next_send_time(now))
+        return wake
+
+    def merge_acks(self,frames,now):
+        """
+        Merge a whole batch of ACKs before reacting to it
+        :param frames: received frames
+        :param now: current time, in seconds
+        """
+        sender=self.sender
+        window=self.window
+        codec=sender.codec
+        trace=sender.trace
+        newest_sent=None
+        acked=0
+        acked_bytes=0
+        for frame in frames:
+            flags=packet.peek_flags(frame)
+            if flags & packet.CONTROL:
+                # control frames are sealed with the control checksum, the only one expected here is ABORT
+                if flags==handshake.ABORT and sender.control_codec.decode(frame,window.lower) is not None:
+                    self.abort("The receiver ended the session")
+                continue
+            ack=codec.decode(frame,window.lower)
+            if ack is None:
+                sender.acks_corrupted+=1
+                continue
+            if not ack[1] & packet.ACK:
+                continue
+            sender.acks_received+=1
+            cumulative,flags,payload=ack
+            bitmap=sack.decode_bitmap(payload) if flags & packet.SACK else 0
+            for seq_num_int in self.scoreboard.ack(cumulative,bitmap):
+                slot=window.ack(seq_num_int)
+                if slot is None:
+                    continue
+                acked+=1
+                if trace is not None:
+                    trace.record(now,instrument.ACKED,seq_num_int,window.in_flight)
+                length,first_sent=slot
+                acked_bytes+=length
+                if first_sent and (newest_sent is None or first_sent > newest_sent):
+                    newest_sent=first_sent
+        if newest_sent is not None:
+            sender.rtt.sample(now-newest_sent)
+            sender.rtt_histogram.add(now-newest_sent)
+        if acked:
+            self.stalls=0
+            self.packets.release_below(window.lower)
+            sender.controller.on_ack(acked,now)
+            sender.window_histogram.add(sender.controller.window)
+            self.window_log.update(acked_bytes,sender.controller.window,sender.rtt.srtt,now)
+            self.logger.debug("Received ACKs up to sequence number {}",window.lower)
+
+    def expire(self,now):
+        """
+        Resend only the packets whose own timer expired
+        :param now: current time, in seconds
+        :return: list of datagrams to resend
+        """
+        sender=self.sender
+        window=self.window
+        timers=self.timers
+        trace=sender.trace
+        batch=[]
+        while self.aborted is None and timers and timers[0][0] <= now:
+            _,seq_num_int=heapq.heappop(timers)
+            if window.outstanding(seq_num_int):
+                if seq_num_int==window.lower:
+                    sender.rtt.backoff()
+                    self.stalls+=1
+                    if self.stalls > sender.MAX_BACKOFFS:
+                        self.abort("No packet acknowledged after {} timeouts".format(sender.MAX_BACKOFFS))
+                        return []
+                sender.controller.on_loss(seq_num_int,window.next_seq,now)
+                batch.append(self.packets.datagram(seq_num_int))
+                window.retransmitted(seq_num_int)
+                if trace is not None:
+                    trace.record(now,instrument.RETRANSMIT,seq_num_int,sender.controller.window)
+                heapq.heappush(timers,(now+sender.rtt.rto,seq_num_int))
+        if batch:
+            sender.packets_retransmitted+=len(batch)
+            sender.timeouts+=1
+            self.logger.debug("Resent {} packets",len(batch))
+        if sender.fec is not None:
+            sender.fec.observe(self.sent+len(batch),len(batch))
+        self.sent=0
+        return batch
+
+    def abort(self,reason):
+        """
+        Give the transfer up, nothing more is sent
+        :param reason: message logged
+        """
+        self.logger.info("Transfer aborted: {}",reason)
+        self.aborted=reason
+
+    # region Event loop callbacks
+
+    def connection_made(self,transport):
+        self.transport=transport
+        transport.loop.call_soon(self.service)
+
+    def datagrams_received(self,frames):
+        self.merge_acks(frames,self.transport.loop.time())
+        self.service()
+
+    def service(self):
+        """
+        Resend expired packets, send new ones and re-arm the single wakeup timer
+        """
+        loop=self.transport.loop
+        now=loop.time()
+        self.transport.sendto_many(self.expire(now))
+        self.transport.sendto_many(self.fill(now))
+        if self.wakeup is not None:
+            self.wakeup.cancel()
+        if self.finished or self.aborted is not None:
+            loop.stop()
+        else:
+            self.wakeup=loop.call_at(self.wake_time(now),self.service)
+    # endregion Event loop callbacks
+
+def send_stripe(index,results,data,ranges,options):
+    """
+    Send one range of a striped transfer; run in its own process
+    :param index: stripe number, selects the port pair
+    :param results: queue receiving (index, stats)
+    :param data: whole mapped input
+    :param ranges: (offset, length) of every stripe
+    :param options: mySender keyword arguments
+    """
+    receiver_inbound,receiver_outbound=stripe.ports(index)
+    options=stripe.stripe_options(options,index)
+    sndr=mySender(inbound_port=receiver_outbound,outbound_port=receiver_inbound,**options)
+    offset,length=ranges[index]
+    try:
+        if sndr.connect():
+            sndr.send_source(sndr.stream_source(packettable.RangeReader(data,offset,length),True))
+        else:
+            sndr.send_source(packettable.PacketTable(sndr.codec,data,offset,length,sndr.BYTES_PER_PACKET))
+    finally:
+        sndr.dump_trace()
+        sndr.simulator.save_record()
+        results.put((index,sndr.stats()))
 
 if __name__ == "__main__":
-    # test out BogoSender
-    DATA = bytearray(sys.stdin.read())
-    sndr = mySender()
-    sndr.send(DATA)
+    parser=argparse.ArgumentParser(description="Send stdin over the unreliable channel")
+    parser.add_argument("--controller",choices=sorted(congestion.CONTROLLERS),default=congestion.DEFAULT_CONTROLLER,
+                        help="window controller")
+    parser.add_argument("--rate",type=float,default=congestion.PacedWindow.DEFAULT_RATE,
+                        help="packets per second for the paced controller")
+    parser.add_argument("--checksum",choices=sorted(checksums.CHECKSUMS),default=checksums.DEFAULT_CHECKSUM,
+                        help="checksum offered to the receiver for data frames")
+    parser.add_argument("--compress",choices=compress.METHODS,default=None,
+                        help="compress the input before packetization, if the receiver agrees")
+    parser.add_argument("--seed",type=int,default=None,help="seed the channel's errors")
+    parser.add_argument("--fast-channel",action="store_true",help="use the simulator's fast corruption engine")
+    parser.add_argument("--stats",default=None,help="write transfer statistics as JSON to this file")
+    parser.add_argument("--fec-group",type=int,default=0,help="data packets per FEC group, 0 disables FEC")
+    parser.add_argument("--fec-parity",type=int,default=fec.DEFAULT_PARITY,help="parity packets per FEC group")
+    parser.add_argument("--fec-adaptive",action="store_true",help="add parity packets as the observed loss grows")
+    parser.add_argument("--event-loop",action="store_true",help="run the transfer on the select-based event loop")
+    parser.add_argument("--stripes",type=int,default=1,help="parallel sender processes, one port pair each")
+    parser.add_argument("--frame-size",type=int,default=channelsimulator.ChannelSimulator.BUFFER_SIZE,
+                        help="largest datagram in bytes offered to the receiver, header included")
+    parser.add_argument("--port",type=int,default=None,
+                        help="port ACKs arrive on, which also names the session; concurrent senders need different ones")
+    parser.add_argument("--resume",action="store_true",
+                        help="send only the ranges a receiver started with --resume still lacks")
+    parser.add_argument("--log-level",choices=utils.LOG_LEVELS,default="info",help="least severe messages written to the log")
+    parser.add_argument("--trace",default=None,
+                        help="write a binary per-packet trace to this file, read it with instrument.py")
+    parser.add_argument("--scenario",default=None,
+                        help="channel profile, one of {} or a JSON file".format(", ".join(sorted(scenario.PROFILES))))
+    parser.add_argument("--channel-record",default=None,help="with --scenario, save the fate of every frame sent")
+    parser.add_argument("--channel-replay",default=None,help="with --scenario, impose fates saved by --channel-record")
+    args=parser.parse_args()
+    if args.resume and args.stripes > 1:
+        parser.error("--resume needs a single stripe")
+    if args.port is not None and args.stripes > 1:
+        parser.error("--port needs a single stripe, stripes use ports of their own")
+
+    fec_options=None
+    if args.fec_group:
+        fec_options={"group": args.fec_group, "parity": args.fec_parity, "adaptive": args.fec_adaptive}
+    options={"rate": args.rate} if args.controller==congestion.PacedWindow.NAME else {}
+    sender_options={"checksum_name": args.checksum, "controller_name": args.controller, "controller_options": options, "fec_options": fec_options,
+                    "seed": args.seed, "fast": args.fast_channel, "event_loop": args.event_loop, "compression": args.compress,
+                    "debug_level": getattr(logging,args.log_level.upper()), "trace_path": args.trace,
+                    "scenario": scenario.direction(scenario.load(args.scenario),scenario.FORWARD) if args.scenario else None,
+                    "record": args.channel_record, "replay": args.channel_replay, "frame_size": args.frame_size,
+                    "resume": args.resume}
+
+    if args.stripes > 1:
+        data=packettable.map_input(sys.stdin)
+        if data is None:
+            data=sys.stdin.read()
+        ranges=stripe.split(len(data),args.stripes,args.frame_size-packet.HEADER_SIZE)
+        processes,results=stripe.run(send_stripe,args.stripes,data,ranges,sender_options)
+        stats=stripe.merge_stats(stripe.collect(processes,results))
+        if args.stats:
+            with open(args.stats,"w") as stats_file:
+                json.dump(stats,stats_file)
+        sys.exit(max(abs(process.exitcode) for process in processes))
+
+    if args.port is not None:
+        sender_options["inbound_port"]=args.port
+    sndr = mySender(**sender_options)
+    try:
+        sndr.send_stream(sys.stdin)
+    finally:
+        sndr.dump_trace()
+        sndr.simulator.save_record()
+        if args.stats:
+            with open(args.stats,"w") as stats_file:
+                json.dump(sndr.stats(),stats_file)
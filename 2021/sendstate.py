@@ -0,0 +1,102 @@
+"""
+Per-packet sender state in flat arrays.
+
+Packets between the lowest unacknowledged sequence number and the sending edge
+live in a ring of capacity slots indexed by sequence number modulo the
+capacity, the same layout as the receiver's ReorderBuffer. Each slot holds a
+state byte in a bytearray, the payload length in an array('H') and the first
+transmission time in an array('d'), so the sender keeps no per-packet Python
+objects. The lowest unacknowledged packet advances over acknowledged slots as
+they are cleared, in amortized O(1) per packet. Retransmission candidates stay
+in the sender's timer heap, which this state validates in O(1) per entry.
+"""
+
+from array import array
+
+# region States
+
+FREE = 0
+IN_FLIGHT = 1
+ACKED = 2
+# endregion States
+
+
+class SendWindow(object):
+
+    def __init__(self, capacity):
+        """
+        Create an empty window
+        :param capacity: most packets between the lowest unacknowledged one and the sending edge
+        """
+        self.capacity = capacity
+        self.state = bytearray(capacity)
+        self.lengths = array("H", [0]) * capacity
+        # first transmission time, 0 once retransmitted (Karn's rule)
+        self.sent_at = array("d", [0.0]) * capacity
+        # every packet below lower is acknowledged
+        self.lower = 0
+        # next sequence number to send
+        self.next_seq = 0
+        # packets sent and neither cumulatively nor selectively acknowledged
+        self.in_flight = 0
+
+    def has_room(self):
+        """
+        :return: True if the ring has a slot for the next sequence number
+        """
+        return self.next_seq < self.lower + self.capacity
+
+    def send(self, length, now):
+        """
+        Record the first transmission of the next packet
+        :param length: payload length in bytes
+        :param now: transmission time, in seconds
+        :return: sequence number of the packet
+        """
+        seq = self.next_seq
+        index = seq % self.capacity
+        self.state[index] = IN_FLIGHT
+        self.lengths[index] = length
+        self.sent_at[index] = now
+        self.next_seq += 1
+        self.in_flight += 1
+        return seq
+
+    def outstanding(self, seq):
+        """
+        :param seq: sequence number
+        :return: True if the packet was sent and is not acknowledged
+        """
+        return self.lower <= seq < self.next_seq and self.state[seq % self.capacity] == IN_FLIGHT
+
+    def retransmitted(self, seq):
+        """
+        Record a retransmission; the packet no longer yields an RTT sample
+        :param seq: sequence number of an outstanding packet
+        """
+        self.sent_at[seq % self.capacity] = 0.0
+
+    def ack(self, seq):
+        """
+        Record an acknowledgement
+        :param seq: sequence number
+        :return: (payload length, first transmission time or 0 if it was retransmitted), or None if the packet was
+            not outstanding
+        """
+        if not self.lower <= seq < self.next_seq:
+            return None
+        capacity = self.capacity
+        state = self.state
+        index = seq % capacity
+        if state[index] != IN_FLIGHT:
+            return None
+        state[index] = ACKED
+        self.in_flight -= 1
+        if seq == self.lower:
+            # release the run of acknowledged slots at the bottom of the window
+            lower = seq
+            while lower < self.next_seq and state[lower % capacity] == ACKED:
+                state[lower % capacity] = FREE
+                lower += 1
+            self.lower = lower
+        return self.lengths[index], self.sent_at[index]
@@ -0,0 +1,141 @@
+"""
+Striped transfers over several port pairs.
+
+The input is split into N contiguous ranges, each sent by its own sender
+process to its own receiver process over a separate ChannelSimulator port
+pair, so packing, checksums and the protocol loop run on N cores instead of
+one interpreter. Stripe i uses the default ports shifted by 2 * i. Both sides
+must be started with the same number of stripes.
+
+On the receiver, stripe 0 writes straight to stdout while later stripes spool
+to temporary files; the coordinator appends each spooled stripe, in order,
+once the stripe before it is complete.
+"""
+
+import multiprocessing
+import os
+import Queue
+import shutil
+import sys
+import tempfile
+
+# ports of stripe 0, as used by Receiver and Sender
+RECEIVER_INBOUND_PORT = 50005
+RECEIVER_OUTBOUND_PORT = 50006
+# mySender/myReceiver options naming files, one per stripe
+PATH_OPTIONS = ("trace_path", "record", "replay")
+
+
+def ports(index):
+    """
+    :param index: stripe number
+    :return: (receiver inbound port, receiver outbound port); the sender uses them the other way round
+    """
+    return RECEIVER_INBOUND_PORT + 2 * index, RECEIVER_OUTBOUND_PORT + 2 * index
+
+
+def stripe_options(options, index):
+    """
+    :param options: mySender or myReceiver keyword arguments of the whole transfer
+    :param index: stripe number
+    :return: options of one stripe, with the seed offset by the index and every file name suffixed with it
+    """
+    options = dict(options)
+    if options.get("seed") is not None:
+        options["seed"] += index
+    for key in PATH_OPTIONS:
+        if options.get(key) is not None:
+            options[key] = "{}.{}".format(options[key], index)
+    return options
+
+
+def split(size, stripes, packet_size):
+    """
+    Cut an input into contiguous ranges on packet boundaries
+    :param size: input length in bytes
+    :param stripes: number of ranges
+    :param packet_size: payload bytes per packet
+    :return: list of (offset, length) pairs, one per stripe
+    """
+    packets = (size + packet_size - 1) // packet_size
+    ranges = []
+    offset = 0
+    for index in xrange(stripes):
+        end = min(size, (packets * (index + 1) // stripes) * packet_size)
+        ranges.append((offset, end - offset))
+        offset = end
+    return ranges
+
+
+def run(target, stripes, *args):
+    """
+    Run target(index, results, *args) in one process per stripe
+    :param target: stripe function; it should put (index, stats dict) on results
+    :param stripes: number of processes
+    :return: (list of started processes in stripe order, results queue)
+    """
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=target, args=(index, results) + args) for index in xrange(stripes)]
+    for process in processes:
+        process.start()
+    return processes, results
+
+
+def collect(processes, results):
+    """
+    Wait for stripe processes
+    :param processes: processes returned by run
+    :param results: queue returned by run
+    :return: list of stats dicts in stripe order, None for stripes that reported nothing
+    """
+    for process in processes:
+        process.join()
+    stats = [None] * len(processes)
+    try:
+        while True:
+            index, value = results.get(timeout=0.1)
+            stats[index] = value
+    except Queue.Empty:
+        pass
+    return stats
+
+
+def merge_stats(stats):
+    """
+    :param stats: per-stripe stats dicts, None for failed stripes
+    :return: dict of the integer counters summed over stripes, with the per-stripe dicts under "stripes"
+    """
+    merged = {}
+    for value in stats:
+        for key, count in (value or {}).items():
+            if isinstance(count, (int, long)):
+                merged[key] = merged.get(key, 0) + count
+    merged["stripes"] = stats
+    return merged
+
+
+def spool_path(directory, index):
+    return os.path.join(directory, "stripe{}".format(index))
+
+
+def merge_spools(processes, directory, output=None):
+    """
+    Append the spooled output of every stripe after the first, in order, as each completes
+    :param processes: receiver processes; stripe 0 writes to output itself
+    :param directory: spool directory, removed afterwards
+    :param output: destination file object, stdout by default
+    """
+    output = output if output is not None else sys.stdout
+    try:
+        processes[0].join()
+        for index in xrange(1, len(processes)):
+            processes[index].join()
+            with open(spool_path(directory, index), "rb") as spool:
+                shutil.copyfileobj(spool, output, 1 << 20)
+            output.flush()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def spool_directory():
+    return tempfile.mkdtemp(prefix="stripes-")
@@ -1,7 +1,36 @@
+import io
+import json
 import logging
+import mmap
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
 from copy import deepcopy
 
+import checkpoint
+import checksums
+import compress
+import congestion
+import eventloop
+import fec
+import handshake
+import instrument
+import packet
+import packettable
+import reorder
+import rto
+import sack
+import scenario
+import sendstate
+import stripe
+import utils
+from receiver import ReceiverProtocol, ReceiverServer, myReceiver
+from sender import SenderProtocol, mySender
 from channelsimulator import ChannelSimulator, slice_frames
 
 
@@ -48,6 +77,791 @@ class TestChannelSimulator(unittest.TestCase):
         corrupted_bytes = c.corrupt(test_data, drop_error_prob=0, swap_error_prob=0, random_error_prob=1)
         assert test_data != corrupted_bytes
 
+    def test_fast_random_errors_use_corrupters(self):
+        c = ChannelSimulator(inbound_port=44444, outbound_port=55555, fast=True)
+        test_data = self.get_test_bytes(ChannelSimulator.BUFFER_SIZE)
+        corrupted_bytes = c.corrupt(test_data, drop_error_prob=0, swap_error_prob=0, random_error_prob=1)
+        assert len(corrupted_bytes) == len(test_data)
+        assert test_data != corrupted_bytes
+        assert set(a ^ b for a, b in zip(test_data, corrupted_bytes)) <= set(ChannelSimulator.CORRUPTERS)
+
+    def test_seeded_channels_are_reproducible(self):
+        for fast in (False, True):
+            outputs = []
+            for _ in range(2):
+                c = ChannelSimulator(inbound_port=44444, outbound_port=55555, fast=fast, seed=303)
+                outputs.append([c.corrupt(self.get_test_bytes(64), 0.2, 0.2, 0.2) for _ in range(50)])
+            assert outputs[0] == outputs[1]
+
+
+class TestBatchedChannel(unittest.TestCase):
+
+    def test_send_and_receive_many(self):
+        sender = ChannelSimulator(inbound_port=44446, outbound_port=44445)
+        receiver = ChannelSimulator(inbound_port=44445, outbound_port=44446)
+        sender.sndr_setup(1)
+        receiver.rcvr_setup(1)
+        sender.corrupt = lambda frame: frame
+        frames = [bytearray([i]) * (i + 1) for i in range(10)]
+        sender.u_send_many(frames)
+        received = []
+        while len(received) < len(frames):
+            received.extend(str(f) for f in receiver.u_receive_many(4, timeout=1))
+        assert received == [str(f) for f in frames]
+        self.assertRaises(socket.timeout, receiver.u_receive_many, 4, 0.01)
+        receiver.rcvr_socket.close()
+
+
+class TestScenario(unittest.TestCase):
+
+    def test_profiles(self):
+        for name in scenario.PROFILES:
+            for which in (scenario.FORWARD, scenario.REVERSE):
+                scenario.ChannelModel(scenario.direction(scenario.load(name), which))
+        assert scenario.direction({}, scenario.FORWARD) == scenario.DEFAULTS
+        self.assertRaises(ValueError, scenario.direction, {scenario.FORWARD: {"loss": 0.1}}, scenario.FORWARD)
+        self.assertRaises(ValueError, scenario.load, "no-such-profile")
+
+    def test_seeded_fates_and_replay(self):
+        settings = scenario.direction(scenario.load("bursty"), scenario.FORWARD)
+        settings["burst"] = dict(settings["burst"], to_bad=0.05)
+        models = [scenario.ChannelModel(settings, seed=7) for _ in range(2)]
+        fates = [[model.fate() for _ in range(2000)] for model in models]
+        assert fates[0] == fates[1]
+        drops = [fate & scenario.DROP for fate in fates[0]]
+        # losses come in bursts: a drop is far more likely right after another one than on average
+        after_drop = [b for a, b in zip(drops, drops[1:]) if a]
+        assert after_drop and float(sum(after_drop)) / len(after_drop) > 2 * float(sum(drops)) / len(drops)
+        with tempfile.NamedTemporaryFile() as f:
+            models[0].save(f.name)
+            replay = scenario.ChannelModel(scenario.direction(scenario.load("clean"), scenario.FORWARD), replay=f.name)
+            assert [replay.fate() for _ in range(2001)] == fates[0] + [0]
+
+    def test_scaled_fates(self):
+        settings = scenario.direction(scenario.load("scaled"), scenario.FORWARD)
+        model = scenario.ChannelModel(settings, seed=3)
+        small = sum(model.fate(scenario.SCALE_UNIT) & scenario.DROP for _ in range(4000))
+        large = sum(model.fate(16 * scenario.SCALE_UNIT) & scenario.DROP for _ in range(4000))
+        # about 0.5% of small frames against 7.7% of large ones
+        assert 5 < small < 40 and 200 < large < 420
+
+    def test_delayed_frames(self):
+        settings = scenario.direction({scenario.FORWARD: {"drop": 0, "error": 0, "swap": 0, "delay": 0.02}},
+                                      scenario.FORWARD)
+        sender = ChannelSimulator(inbound_port=44452, outbound_port=44451, scenario=settings)
+        receiver = ChannelSimulator(inbound_port=44451, outbound_port=44452)
+        sender.sndr_setup(1)
+        sender.rcvr_setup(1)
+        receiver.rcvr_setup(1)
+        start = time.time()
+        sender.u_send_many(["a", "b"])
+        assert sender.next_arrival() >= start + 0.02
+        self.assertRaises(socket.timeout, receiver.u_receive_many, 4, 0.005)
+        # the sender releases its frames while it waits on its own socket
+        self.assertRaises(socket.timeout, sender.u_receive_many, 4, 0.05)
+        assert sender.next_arrival() is None
+        assert [str(frame) for frame in receiver.u_receive_many(4, 0.1)] == ["a", "b"]
+        sender.rcvr_socket.close()
+        receiver.rcvr_socket.close()
+
+
+class TestEventLoop(unittest.TestCase):
+
+    def test_timers_run_in_order_and_cancel(self):
+        loop = eventloop.EventLoop()
+        calls = []
+        now = loop.time()
+        loop.call_at(now + 0.02, calls.append, "late")
+        loop.call_at(now + 0.01, calls.append, "early")
+        loop.call_soon(calls.append, "soon")
+        loop.call_at(now + 0.015, calls.append, "cancelled").cancel()
+        loop.call_at(now + 0.03, loop.stop)
+        loop.run_forever()
+        assert calls == ["soon", "early", "late"]
+
+    def test_transport_delivers_batches(self):
+        sender = ChannelSimulator(inbound_port=44448, outbound_port=44447)
+        receiver = ChannelSimulator(inbound_port=44447, outbound_port=44448)
+        sender.sndr_setup(1)
+        receiver.rcvr_setup(1)
+        sender.corrupt = lambda frame: frame
+
+        class Collector(eventloop.DatagramProtocol):
+            def __init__(self):
+                self.received = []
+
+            def datagram_received(self, data):
+                self.received.append(str(data))
+                if len(self.received) == 3:
+                    transport.loop.stop()
+
+        loop = eventloop.EventLoop()
+        protocol = Collector()
+        transport = eventloop.ChannelTransport(loop, receiver, protocol)
+        loop.call_soon(sender.u_send_many, ["a", "bb", "ccc"])
+        loop.call_later(1, loop.stop)
+        loop.run_forever()
+        transport.close()
+        receiver.rcvr_socket.close()
+        assert protocol.received == ["a", "bb", "ccc"]
+
+
+class TestChecksums(unittest.TestCase):
+
+    def test_known_values(self):
+        assert checksums.new_checksum("crc32").compute("123456789") == 0xCBF43926
+        assert checksums.new_checksum("crc32c").compute("123456789") == 0xE3069283
+        assert checksums.new_checksum("adler32").compute("123456789") == 0x091E01DE
+
+    def test_chunks_match_concatenation(self):
+        data = bytearray(range(256)) * 4
+        for name in checksums.CHECKSUMS:
+            c = checksums.new_checksum(name)
+            assert c.compute(buffer(data, 0, 8), buffer(data, 8)) == c.compute(str(data))
+
+    def test_verify_counts(self):
+        c = checksums.new_checksum()
+        value = c.compute("frame")
+        assert c.verify(value, "frame")
+        assert not c.verify(value, "frane")
+        assert (c.passed, c.failed) == (1, 1)
+
+
+class TestPacketCodec(unittest.TestCase):
+
+    @staticmethod
+    def setup_codec():
+        return packet.PacketCodec(checksums.new_checksum())
+
+    def test_round_trip(self):
+        codec = self.setup_codec()
+        frame = codec.encode(7, packet.ACK | packet.SACK, b"payload")
+        assert len(frame) == packet.HEADER_SIZE + 7
+        seq, flags, payload = codec.decode(frame)
+        assert (seq, flags, str(payload)) == (7, packet.ACK | packet.SACK, b"payload")
+
+    def test_encode_into_preallocated(self):
+        codec = self.setup_codec()
+        frame = bytearray(ChannelSimulator.BUFFER_SIZE)
+        size = codec.encode_into(frame, 3, payload=b"x" * packet.MAX_PAYLOAD)
+        assert size == ChannelSimulator.BUFFER_SIZE
+        assert codec.decode(frame)[0] == 3
+
+    def test_connection_id(self):
+        codec = packet.PacketCodec(checksums.new_checksum(), connection_id=50100)
+        frame = codec.encode(3, packet.ACK, b"abc")
+        assert packet.peek_connection(frame) == 50100 and codec.decode(frame)[:2] == (3, packet.ACK)
+        assert packet.peek_connection(frame[:packet.HEADER_SIZE - 1]) is None
+        # the checksum covers the connection ID
+        frame[5] ^= 1
+        assert codec.decode(frame) is None
+
+    def test_decode_rejects_corruption(self):
+        codec = self.setup_codec()
+        frame = codec.encode(1, 0, b"abc")
+        frame[-1] ^= 1
+        assert codec.decode(frame) is None
+        assert codec.decode(frame[:4]) is None
+        assert codec.decode(codec.encode(1, 0, b"abc")[:-1]) is None
+
+    def test_wrapped_sequence_numbers(self):
+        codec = self.setup_codec()
+        frame = codec.encode(packet.SEQ_MODULUS + 5, 0, b"abc")
+        assert codec.decode(frame)[0] == 5
+        assert codec.decode(frame, packet.SEQ_MODULUS)[0] == packet.SEQ_MODULUS + 5
+        # within half the modulus on either side of the reference
+        assert packet.unwrap(packet.SEQ_MASK, packet.SEQ_MODULUS + 2) == packet.SEQ_MODULUS - 1
+        assert packet.unwrap(3, 3 * packet.SEQ_MODULUS - 10) == 3 * packet.SEQ_MODULUS + 3
+
+
+class TestSack(unittest.TestCase):
+
+    def test_tracker_cumulative_and_bitmap(self):
+        tracker = sack.ReceiveTracker()
+        for seq in (0, 2, 3, 5):
+            assert tracker.add(seq)
+        assert not tracker.add(3)
+        assert tracker.expected == 1
+        # packets 2, 3 and 5 beyond the cumulative point 1
+        assert sack.decode_bitmap(tracker.bitmap()) == 0b1011
+        tracker.add(1)
+        assert tracker.expected == 4
+
+    def test_scoreboard_reports_each_packet_once(self):
+        scoreboard = sack.Scoreboard()
+        assert sorted(scoreboard.ack(1, 0b1011)) == [0, 2, 3, 5]
+        assert scoreboard.ack(1, 0b1011) == []
+        assert scoreboard.lower == 1
+        assert scoreboard.ack(4, 0b1) == [1]
+        assert scoreboard.lower == 4
+        assert scoreboard.ack(5, 0) == [4]
+        assert scoreboard.lower == 6
+
+    def test_ack_scheduler(self):
+        scheduler = sack.AckScheduler(every=2, delay=0.01)
+        assert not scheduler.due(0) and scheduler.deadline is None
+        assert not scheduler.arrived(1.0)
+        assert not scheduler.due(1.005) and scheduler.due(1.01)
+        assert scheduler.arrived(1.002)
+        scheduler.sent()
+        # out-of-order arrivals are acknowledged at the end of the batch
+        assert not scheduler.arrived(2.0, in_order=False) and scheduler.due(2.0)
+        scheduler.sent()
+        assert scheduler.pending == 0 and not scheduler.urgent and scheduler.deadline is None
+
+
+class TestRttEstimator(unittest.TestCase):
+
+    def test_sample_and_backoff(self):
+        rtt = rto.RttEstimator(initial_rto=1.0, min_rto=0.001, max_rto=4.0)
+        rtt.sample(0.1)
+        assert abs(rtt.rto - 0.3) < 1e-9
+        for _ in range(50):
+            rtt.sample(0.1)
+        assert abs(rtt.srtt - 0.1) < 1e-6 and rtt.rto < 0.11
+        for _ in range(10):
+            rtt.backoff()
+        assert rtt.rto == 4.0
+        rtt.sample(0.1)
+        assert rtt.rto < 0.11
+
+
+class TestWindowControllers(unittest.TestCase):
+
+    def test_newreno_grows_and_halves_once_per_window(self):
+        c = congestion.new_controller("newreno", 100)
+        c.on_ack(10, 0)
+        assert c.window == 20
+        c.on_loss(5, 30, 0)
+        assert c.window == 10
+        c.on_loss(6, 30, 0)
+        assert c.window == 10
+        assert c.can_send(9, 0) and not c.can_send(10, 0)
+
+    def test_paced_spaces_packets(self):
+        c = congestion.new_controller("paced", 100, rate=10)
+        # after an idle period at most one interval of credit is banked
+        assert c.can_send(0, 5.0)
+        c.on_send(5.0)
+        c.on_send(5.0)
+        assert not c.can_send(0, 5.05)
+        assert abs(c.next_send_time(5.05) - 5.1) < 1e-9
+
+
+class TestSendWindow(unittest.TestCase):
+
+    def test_ring_tracks_flight_and_lower_edge(self):
+        window = sendstate.SendWindow(4)
+        for length in (10, 20, 30, 40):
+            window.send(length, 1.0)
+        assert not window.has_room() and window.in_flight == 4
+        window.retransmitted(1)
+        assert window.ack(1) == (20, 0.0)
+        assert window.ack(1) is None and window.lower == 0
+        assert window.ack(0) == (10, 1.0)
+        # the cumulative edge skips the selectively acknowledged slot
+        assert window.lower == 2 and window.in_flight == 2 and window.has_room()
+        assert window.send(50, 2.0) == 4
+        assert window.outstanding(4) and not window.outstanding(0) and not window.outstanding(5)
+        assert window.ack(8) is None
+
+
+class TestSenderProtocol(unittest.TestCase):
+
+    def setUp(self):
+        self.sender = mySender(inbound_port=44452, outbound_port=44453, initial_rto=1.0, controller_name="fixed")
+        self.sender.logger.info = lambda message, *args: None
+        self.codec = self.sender.codec
+        # six packets, the last one short
+        self.protocol = SenderProtocol(self.sender, packettable.PacketTable(self.codec, "x" * 5500, packet_size=1000))
+
+    def tearDown(self):
+        self.sender.simulator.rcvr_socket.close()
+        self.sender.simulator.sndr_socket.close()
+
+    def ack(self, cumulative, mask=0):
+        return self.codec.encode(cumulative, packet.ACK | packet.SACK, sack.encode_bitmap(mask))
+
+    def seqs(self, batch):
+        return sorted(self.codec.decode(frame)[0] for frame in batch)
+
+    def test_sack_retransmits_only_holes(self):
+        protocol, rtt = self.protocol, self.sender.rtt
+        # a first transmission time of 0 marks a retransmitted packet, hence the clock starting at 1.0
+        assert self.seqs(protocol.fill(1.0)) == range(6)
+        # packet 0 in order, 2, 3 and 5 beyond the hole at 1
+        protocol.merge_acks([self.ack(1, 0b1011)], 1.1)
+        assert protocol.window.lower == 1 and protocol.window.in_flight == 2
+        assert rtt.samples == 1 and abs(rtt.rto - 0.3) < 1e-9
+        # timers keep the timeout they were armed with, the acknowledged packets' timers are dropped
+        assert protocol.expire(1.99) == []
+        assert self.seqs(protocol.expire(2.0)) == [1, 4]
+        assert rtt.backoffs == 1 and abs(rtt.rto - 0.6) < 1e-9
+        assert self.seqs(protocol.expire(2.61)) == [1, 4]
+        assert rtt.backoffs == 2 and abs(rtt.rto - 1.2) < 1e-9
+        assert self.sender.packets_retransmitted == 4 and self.sender.timeouts == 2
+
+    def test_cumulative_ack_retires_timers(self):
+        protocol, rtt = self.protocol, self.sender.rtt
+        protocol.fill(1.0)
+        protocol.expire(2.0)
+        # retransmitted packets give no RTT sample
+        protocol.merge_acks([self.ack(6)], 2.5)
+        assert rtt.samples == 0 and protocol.window.in_flight == 0 and protocol.stalls == 0
+        assert protocol.expire(10.0) == [] and protocol.timers == []
+        assert rtt.backoffs == 1 and protocol.fill(10.0) == [] and protocol.finished
+
+    def test_abort_from_the_receiver(self):
+        protocol = self.protocol
+        protocol.fill(1.0)
+        abort = self.sender.control_codec.encode(0, handshake.ABORT)
+        corrupted = abort[:]
+        corrupted[0] ^= 0xff
+        # a corrupted abort is not trusted
+        protocol.merge_acks([corrupted], 1.1)
+        assert protocol.aborted is None
+        protocol.merge_acks([abort], 1.1)
+        assert protocol.aborted is not None
+        assert protocol.expire(10.0) == [] and protocol.fill(10.0) == []
+
+    def test_connect_gives_up(self):
+        # nothing listens on the outbound port
+        self.sender.SYN_ATTEMPTS = 2
+        self.sender.rtt.rto = 0.01
+        with self.assertRaises(SystemExit) as raised:
+            self.sender.connect()
+        assert raised.exception.code == 1
+
+    def test_gives_up_without_progress(self):
+        protocol, rtt = self.protocol, self.sender.rtt
+        protocol.fill(1.0)
+        now = 1.0
+        while protocol.aborted is None:
+            now += rtt.max_rto
+            protocol.expire(now)
+        assert rtt.backoffs == mySender.MAX_BACKOFFS + 1
+        assert protocol.fill(now) == [] and not protocol.finished
+
+
+class TestTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.scripts = os.path.dirname(os.path.abspath(__file__))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def transfer(self, data, *args):
+        """
+        Run receiver.py and sender.py against each other over localhost
+        :param data: input of the sender
+        :param args: command line arguments of both
+        :return: (received bytes, sender statistics)
+        """
+        paths = dict((name, os.path.join(self.directory, name)) for name in ("input", "output", "stats"))
+        with open(paths["input"], "wb") as f:
+            f.write(data)
+        with open(paths["output"], "wb") as output:
+            receiver = subprocess.Popen([sys.executable, os.path.join(self.scripts, "receiver.py")] + list(args),
+                                        stdout=output, cwd=self.directory)
+            time.sleep(0.3)
+            with open(paths["input"], "rb") as stdin:
+                code = subprocess.call([sys.executable, os.path.join(self.scripts, "sender.py"), "--stats", paths["stats"]] +
+                                       list(args), stdin=stdin, cwd=self.directory)
+            # the receiver leaves once its linger runs out
+            deadline = time.time() + 5
+            while receiver.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+            if receiver.poll() is None:
+                receiver.kill()
+            assert code == 0 and receiver.wait() == 0
+        with open(paths["output"], "rb") as f, open(paths["stats"]) as stats:
+            return f.read(), json.load(stats)
+
+    def test_clean_channel_needs_no_retransmits(self):
+        data = os.urandom(3 * 10 ** 6)
+        received, stats = self.transfer(data, "--scenario", "clean")
+        assert received == data
+        assert stats["packets_retransmitted"] == 0 and stats["timeouts"] == 0
+
+
+class TestHandshake(unittest.TestCase):
+
+    def setUp(self):
+        self.control = handshake.control_codec()
+        self.output = io.BytesIO()
+        self.receiver = myReceiver(inbound_port=44449, outbound_port=44450, output=self.output)
+        self.receiver.logger.info = lambda message, *args: None
+
+    def tearDown(self):
+        self.receiver.simulator.rcvr_socket.close()
+
+    def test_negotiate(self):
+        assert handshake.negotiate((4096, 1007, "adler32", 0), 2048, 1013, "crc32") == (2048, 1007, "adler32", 0)
+        assert handshake.negotiate((64, 2000, "md5", 0xff), 2048, 1013, "crc32") == (64, 1013, "crc32",
+                                                                                     handshake.SUPPORTED_FEATURES)
+        options = handshake.encode_options(64, 500, "crc32c", handshake.COMPRESSED)
+        assert handshake.decode_options(buffer(options)) == (64, 500, "crc32c", handshake.COMPRESSED)
+        assert handshake.decode_linger(handshake.encode_linger(0.25), 1.0) == 0.25
+        options = handshake.encode_options(64, 500, "crc32", handshake.RESUME, [(0, 10), (2 ** 40, None)])
+        assert handshake.decode_options(buffer(options)) == (64, 500, "crc32", handshake.RESUME)
+        assert handshake.decode_ranges(buffer(options)) == [(0, 10), (2 ** 40, None)]
+
+    def test_session_lifecycle(self):
+        protocol = ReceiverProtocol(self.receiver)
+        data = packet.PacketCodec(checksums.new_checksum("adler32"))
+        # data before the SYN belongs to no session
+        assert protocol.handle([data.encode(0, 0, "early")]) == []
+
+        syn = self.control.encode(0, packet.SYN, handshake.encode_options(64, 500, "adler32"))
+        replies = protocol.handle([syn, syn])
+        assert len(replies) == 2
+        seq, flags, payload = self.control.decode(replies[0])
+        assert flags == packet.SYN | packet.ACK and handshake.decode_options(payload) == (64, 500, "adler32", 0)
+
+        fin = self.control.encode(1, packet.FIN, handshake.encode_linger(0.05))
+        # a FIN beyond missing data is premature
+        assert protocol.handle([fin]) == []
+        # a lone in-order packet waits for the delay timer
+        assert protocol.handle([data.encode(0, 0, "hello")]) == [] and self.output.getvalue() == "hello"
+        assert protocol.delayed_ack(time.time()) == []
+        ack = data.decode(protocol.delayed_ack(time.time() + myReceiver.ACK_DELAY)[0])
+        assert ack[:2] == (1, packet.ACK | packet.SACK) and protocol.ack_scheduler.deadline is None
+        replies = protocol.handle([fin, fin])
+        assert [self.control.decode(reply)[:2] for reply in replies] == [(1, packet.FIN | packet.ACK)] * 2
+        assert protocol.terminated and not protocol.closed(time.time())
+        assert protocol.closed(time.time() + 0.1)
+
+    def test_parity_kept_only_when_agreed(self):
+        data = packet.PacketCodec(checksums.new_checksum("crc32"))
+        for features in (0, handshake.PARITY):
+            protocol = ReceiverProtocol(self.receiver)
+            protocol.handle([self.control.encode(0, packet.SYN, handshake.encode_options(64, 500, "crc32", features))])
+            protocol.handle([data.encode(1, 0, "later")])
+            if features:
+                assert protocol.decoder.payloads == {1: "later"}
+            else:
+                # a session without FEC never stores payloads for repairs
+                assert protocol.decoder is None
+
+    def test_frame_size_negotiation(self):
+        protocol = ReceiverProtocol(self.receiver)
+        self.receiver.max_frame_size = 4096
+        syn = self.control.encode(0, packet.SYN, handshake.encode_options(64, 9000, "crc32"))
+        payload = self.control.decode(protocol.handle([syn])[0])[2]
+        # the receiver clamps the offer and grows its buffers to the agreed frame size
+        assert handshake.decode_options(payload)[1] == 4096 - packet.HEADER_SIZE
+        assert self.receiver.simulator.frame_size == 4096
+
+
+class TestReceiverServer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = ReceiverServer(self.directory, inbound_port=44451)
+        self.server.logger.info = lambda message, *args: None
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def deliver(self, connection_id, frames):
+        session = self.server.find_session(connection_id, frames, time.time())
+        return session, session.protocol.handle(frames) if session is not None else []
+
+    def test_sessions_are_demultiplexed(self):
+        control = {port: handshake.control_codec(port) for port in (51001, 51002)}
+        data = {port: packet.PacketCodec(checksums.new_checksum(), connection_id=port) for port in control}
+        # data of an unknown connection opens nothing
+        assert self.deliver(51001, [data[51001].encode(0, 0, "early")]) == (None, [])
+        sessions = {}
+        for port in control:
+            syn = control[port].encode(port, packet.SYN, handshake.encode_options(64, 500, checksums.DEFAULT_CHECKSUM))
+            sessions[port], replies = self.deliver(port, [syn])
+            assert packet.peek_connection(replies[0]) == port
+        for port in control:
+            assert self.deliver(port, [data[port].encode(0, 0, str(port))])[0] is sessions[port]
+        # a SYN with a new sequence number replaces the session of its connection
+        syn = control[51001].encode(7, packet.SYN, handshake.encode_options(64, 500, checksums.DEFAULT_CHECKSUM))
+        assert self.deliver(51001, [syn])[0] is not sessions[51001]
+        assert self.server.sessions_abandoned == 1 and self.server.totals["bytes_delivered"] == 5
+        with open(sessions[51002].path) as f:
+            assert f.read() == "51002"
+
+
+class TestReorderBuffer(unittest.TestCase):
+
+    def test_releases_contiguous_runs(self):
+        buf = reorder.ReorderBuffer(4)
+        assert buf.put(1, "b") and buf.put(2, "c")
+        assert buf.pop_ready() == []
+        assert not buf.put(2, "c")
+        assert buf.put(0, "a")
+        assert buf.pop_ready() == ["a", "b", "c"]
+        assert buf.expected == 3 and buf.buffered == 0
+        # the ring wraps around once earlier slots are released
+        assert buf.accepts(6) and not buf.accepts(7)
+        buf.put(6, "g")
+        buf.put(3, "d")
+        assert buf.pop_ready() == ["d"]
+
+
+class TestFec(unittest.TestCase):
+
+    def test_rebuilds_one_loss_per_class(self):
+        payloads = ["packet %d " % i * 7 for i in range(8)] + ["short"]
+        encoder = fec.ParityEncoder(group=4, parity=2, payload_size=100)
+        parities = []
+        for seq, payload in enumerate(payloads):
+            parities.extend(encoder.add(seq, payload))
+        parities.extend(encoder.flush())
+        assert [start for start, _ in parities] == [0, 0, 4, 4, 8]
+
+        decoder = fec.ParityDecoder()
+        # one loss in each class of the first group, and the short final packet
+        lost = {1, 2, 8}
+        for seq, payload in enumerate(payloads):
+            if seq not in lost:
+                decoder.add_data(seq, payload)
+        recovered = []
+        for start, parity in parities:
+            recovered.extend(decoder.add_parity(start, parity))
+        assert sorted(recovered) == [(seq, payloads[seq]) for seq in sorted(lost)]
+
+    def test_two_losses_in_a_class_wait_for_data(self):
+        payloads = ["x" * 10, "y" * 10, "z" * 10]
+        encoder = fec.ParityEncoder(group=3, parity=1, payload_size=10)
+        for seq, payload in enumerate(payloads[:2]):
+            assert encoder.add(seq, payload) == []
+        (start, parity), = encoder.add(2, payloads[2])
+        decoder = fec.ParityDecoder()
+        decoder.add_data(0, payloads[0])
+        assert decoder.add_parity(start, parity) == []
+        # a retransmission of one packet lets the parity rebuild the other
+        assert decoder.add_data(2, payloads[2]) == [(1, payloads[1])]
+        decoder.discard_below(3)
+        assert not decoder.payloads and not decoder.parities
+
+    def test_adaptive_parity_follows_loss(self):
+        encoder = fec.ParityEncoder(group=16, parity=0, payload_size=10, adaptive=True)
+        encoder.observe(1000, 100)
+        assert encoder.parity == 1
+        for _ in range(20):
+            encoder.observe(1000, 100)
+        assert encoder.parity == encoder.max_parity == 4
+        for _ in range(20):
+            encoder.observe(1000, 0)
+        assert encoder.parity == 1
+
+
+class TestCompression(unittest.TestCase):
+
+    def roundtrip(self, data, method, read_size=1013):
+        reader = compress.CompressingReader(io.BytesIO(data), method)
+        output = io.BytesIO()
+        decoder = compress.Decoder(output)
+        while True:
+            chunk = reader.read(read_size)
+            if not chunk:
+                break
+            decoder.write(chunk)
+        assert output.getvalue() == data and not decoder.incomplete
+        return reader
+
+    def test_methods_roundtrip(self):
+        text = "".join(chr(65 + i % 26) for i in range(3 * compress.BLOCK_SIZE + 7))
+        for method in compress.METHODS:
+            assert self.roundtrip(text, method).ratio() < 0.8
+        # a2b_base64 would silently drop the newline, only the round trip check keeps it
+        assert self.roundtrip("QUJD\nREVG" * 100, "base64").ratio() > 1
+        self.roundtrip("", "auto")
+
+    def test_mixed_entropy_roundtrip(self):
+        noise = open("/dev/urandom", "rb").read(compress.BLOCK_SIZE)
+        text = "".join(chr(65 + i % 26) for i in range(8 * compress.BLOCK_SIZE + 11))
+        for method in ("zlib", "auto"):
+            # a block sent RAW between ZLIB blocks must not desynchronize the inflater
+            self.roundtrip(noise + text, method)
+            self.roundtrip(text[:3 * compress.BLOCK_SIZE] + noise + text, method)
+
+    def test_undecodable_stream_fails_the_session(self):
+        receiver = myReceiver(inbound_port=44449, outbound_port=44450, output=io.BytesIO())
+        receiver.logger.info = lambda message, *args: None
+        try:
+            protocol = ReceiverProtocol(receiver)
+            control = handshake.control_codec()
+            syn = control.encode(0, packet.SYN, handshake.encode_options(64, 500, "crc32", handshake.COMPRESSED))
+            protocol.handle([syn])
+            frame = compress.FRAME.pack(compress.ZLIB, 4) + "junk"
+            replies = protocol.handle([receiver.codec.encode(0, 0, frame)])
+            assert [control.decode(reply)[:2] for reply in replies] == [(1, handshake.ABORT)]
+            assert protocol.failed and not protocol.closed(time.time())
+            # whatever the sender still sends is answered with ABORT until the linger runs out
+            fin = control.encode(1, packet.FIN, handshake.encode_linger(0.05))
+            for frames in ([receiver.codec.encode(1, 0, "more"), receiver.codec.encode(2, 0, "data")], [fin]):
+                replies = protocol.handle(frames)
+                assert [control.decode(reply)[:2] for reply in replies] == [(1, handshake.ABORT)]
+            assert protocol.closed(time.time() + myReceiver.LINGER)
+        finally:
+            receiver.simulator.rcvr_socket.close()
+
+    def test_incompressible_input_turns_it_off(self):
+        data = "".join(chr(random_byte) for random_byte in bytearray(open("/dev/urandom", "rb").read(
+            compress.CompressingReader.PROBE_BLOCKS * compress.BLOCK_SIZE * 2)))
+        reader = self.roundtrip(data, "auto", read_size=10 ** 7)
+        assert not reader.enabled
+
+
+class TestInstrument(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = instrument.Histogram(1e-3)
+        assert histogram.summary()["p50"] == 0.0
+        for value in [0.0005] * 90 + [0.05] * 10:
+            histogram.add(value)
+        summary = histogram.summary()
+        assert summary["count"] == 100 and summary["max"] == 0.05
+        assert summary["p50"] == 1e-3 and summary["p99"] == 0.05
+
+    def test_trace_ring(self):
+        trace = instrument.PacketTrace(100.0, capacity=4)
+        for seq in range(6):
+            trace.record(100.01 + seq * 0.05, instrument.SEND, seq, 10)
+        with tempfile.NamedTemporaryFile() as f:
+            trace.dump(f.name)
+            start, overwritten, records = instrument.load_trace(f.name)
+        assert start == 100.0 and overwritten == 2
+        assert [seq for _, _, seq, _ in records] == [2, 3, 4, 5]
+        rows = instrument.timeline(records, 0.1)
+        assert [(counts[instrument.SEND], seq) for _, counts, seq in rows] == [(2, 3), (2, 5)]
+
+    def test_logger_formats_after_level_check(self):
+        class Unprintable(object):
+            def __format__(self, spec):
+                raise AssertionError("formatted below the log level")
+        level = logging.root.level
+        logging.root.setLevel(logging.INFO)
+        try:
+            assert not utils.Logger.enabled(logging.DEBUG)
+            utils.Logger.debug("{}", Unprintable())
+        finally:
+            logging.root.setLevel(level)
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "output")
+        self.data = "".join(chr(i) for i in xrange(200)) * 3
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def transfer(self, ranges, finish=True):
+        target = checkpoint.Checkpoint(self.path, block_size=64)
+        writer = target.writer(ranges)
+        reader = checkpoint.RangesReader(io.BytesIO(self.data), ranges)
+        chunk = reader.read(50)
+        while chunk:
+            writer.write(chunk)
+            chunk = reader.read(50)
+        if finish:
+            writer.finish()
+        target.close()
+
+    def test_resume_after_interruption(self):
+        self.transfer([(0, None)], finish=False)
+        # the last block is partial and the end of the output unknown
+        assert checkpoint.Checkpoint(self.path).missing() == [(576, None)]
+        with open(self.path, "r+b") as f:
+            f.seek(70)
+            f.write("x")
+        target = checkpoint.Checkpoint(self.path)
+        missing = target.missing()
+        assert missing == [(64, 64), (576, None)] and target.verified == 512
+        target.close()
+        self.transfer(missing)
+        with open(self.path, "rb") as f:
+            assert f.read() == self.data
+        assert checkpoint.Checkpoint(self.path).missing() == []
+
+    def test_coalesce(self):
+        ranges = [(0, 10), (20, 10), (100, 10), (115, None)]
+        assert checkpoint.coalesce(ranges, 4) == ranges
+        assert checkpoint.coalesce(ranges, 2) == [(0, 30), (100, None)]
+        assert checkpoint.coalesce(ranges, 1) == [(0, None)]
+
+
+class TestStripes(unittest.TestCase):
+
+    def test_split_on_packet_boundaries(self):
+        assert stripe.split(10, 3, 4) == [(0, 4), (4, 4), (8, 2)]
+        ranges = stripe.split(1000003, 4, 1013)
+        assert sum(length for _, length in ranges) == 1000003
+        assert all(offset % 1013 == 0 for offset, _ in ranges)
+        assert stripe.split(0, 2, 1013) == [(0, 0), (0, 0)]
+
+    def test_ports(self):
+        assert stripe.ports(1) == (50007, 50008)
+
+
+class TestPacketTable(unittest.TestCase):
+
+    def setUp(self):
+        self.codec = packet.PacketCodec(checksums.new_checksum("crc32"))
+        self.data = "".join(chr(i % 251) for i in range(3 * mmap.ALLOCATIONGRANULARITY + 5))
+
+    def payloads(self, source):
+        seq = 0
+        result = []
+        while True:
+            datagram = source.datagram(seq)
+            if datagram is None:
+                return result
+            decoded = self.codec.decode(datagram)
+            assert decoded is not None and decoded[0] == seq
+            result.append(str(decoded[2]))
+            seq += 1
+
+    def test_sources_agree(self):
+        class SmallSegments(packettable.MappedFile):
+            SEGMENT_SIZE = mmap.ALLOCATIONGRANULARITY
+            OVERLAP = 1024
+
+        with tempfile.TemporaryFile() as f:
+            f.write(self.data)
+            f.flush()
+            mapped = packettable.PacketTable(self.codec, SmallSegments(f.fileno(), len(self.data)), packet_size=1000)
+            expected = self.payloads(packettable.PacketTable(self.codec, self.data, packet_size=1000))
+            assert "".join(expected) == self.data and expected[-1] == self.data[-(len(self.data) % 1000):]
+            assert self.payloads(mapped) == expected
+            # retransmissions reuse the cached checksums
+            assert all(mapped.sealed) and self.payloads(mapped) == expected
+            mapped.release_below(mapped.count)
+            assert not mapped.data.segments
+        stream = packettable.StreamPackets(self.codec, io.BytesIO(self.data), 1000, 4)
+        assert self.payloads(stream) == expected
+        stream.release_below(5)
+        assert min(stream.held) == 5
+
+    def test_empty_terminator(self):
+        table = packettable.PacketTable(self.codec, "x" * 2000, 1000, 1000, packet_size=1000)
+        assert table.count == 2 and self.payloads(table) == ["x" * 1000, ""]
+        assert self.payloads(packettable.StreamPackets(self.codec, io.BytesIO(""))) == [""]
+
+    def test_stream_packet_boundaries(self):
+        # (input length, packets): the last packet is short, or empty when the length is a whole number of packets
+        for length, count in ((0, 1), (999, 1), (1000, 2), (4000, 5), (8000, 9), (8001, 9)):
+            data = self.data[:length]
+            # send_stream's packetizer; a BytesIO cannot be mapped, so it is read block by block
+            source = packettable.open_source(self.codec, io.BytesIO(data), 1000, 4)
+            assert isinstance(source, packettable.StreamPackets)
+            payloads = self.payloads(source)
+            assert len(payloads) == count and "".join(payloads) == data
+            assert payloads[-1] == data[(count - 1) * 1000:] and len(payloads[-1]) < 1000
+
 
 if __name__ == "__main__":
     unittest.main()
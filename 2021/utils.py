@@ -1,6 +1,9 @@
 import datetime
 import logging
 
+# --log-level choices, logging module level names in lower case
+LOG_LEVELS = ("debug", "info", "warning")
+
 
 class Logger(object):
 
@@ -10,9 +13,23 @@ class Logger(object):
                             level=debug_level)
 
     @staticmethod
-    def info(message):
-        logging.info(message)
+    def enabled(level):
+        """
+        :param level: logging level, e.g. logging.DEBUG
+        :return: True if messages of that level are written
+        """
+        return logging.root.isEnabledFor(level)
+
+    @staticmethod
+    def info(message, *args):
+        """
+        :param message: message, or str.format template when args are given
+        :param args: formatted into message only once the level check passed
+        """
+        if logging.root.isEnabledFor(logging.INFO):
+            logging.info(message.format(*args) if args else message)
 
     @staticmethod
-    def debug(message):
-        logging.debug(message)
+    def debug(message, *args):
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug(message.format(*args) if args else message)